@@ -1,6 +1,5 @@
 import os
 
-
 EXPERIMENTS_PATH = "/Users/ketai/Downloads/Alemira/Thesis/experiments"
 EXTRA_EXPERIMENTS_PATH = "/Users/ketai/Downloads/extra-experiments"
 # FAILURE_INJECTION_PATH = os.path.join(EXPERIMENTS_PATH, "failure injection")
@@ -25,3 +24,5 @@ GCLOUD_UNIFIED_PATH = os.path.join(EXPERIMENTS_PATH, "gcloud_unified", "kpi-map"
 PROMETHEUS_UNIFIED_PATH = os.path.join(
     EXPERIMENTS_PATH, "prometheus_unified", "kpi-map"
 )
+WORK_QUEUE_PATH = os.path.join(EXPERIMENTS_PATH, "work-queue")
+MERGED_DATASET_PATH = os.path.join(EXPERIMENTS_PATH, "merged-dataset")
@@ -2,10 +2,92 @@ from abc import ABC, abstractmethod
 import json
 import os
 
+import numpy as np
 import pandas as pd
+from app.checkpoint import write_csv
+from app.column_model import concat_level, flatten_columns
+from app.sparse_frame import as_stored, read_combined, write_combined
+
+# target metrics tables by path, with the modification time they were read at
+_target_metrics_cache = {}
 
 
 class Aggregator(ABC):
+    source = None
+    journal = None
+    # frames handed from stage to stage in memory, set by `start_fused`
+    combined_frames = None
+    aggregated_frames = None
+    intermediate_writer = None
+
+    @property
+    def fused(self) -> bool:
+        return self.aggregated_frames is not None
+
+    def start_fused(self, intermediate_writer=None):
+        """Hand frames from merge to aggregate to the caller in memory.
+
+        Combined and aggregated files are skipped, or written in the
+        background by `intermediate_writer` for debugging.
+        """
+        self.combined_frames = {}
+        self.aggregated_frames = {}
+        self.intermediate_writer = intermediate_writer
+        # units are not persisted, so a fused run cannot be resumed
+        self.journal = None
+
+    def _write_intermediate(self, write, *args):
+        if not self.fused:
+            write(*args)
+        elif self.intermediate_writer is not None:
+            self.intermediate_writer.submit(write, *args)
+
+    def output_combined(self, metric_index, df_or_frame, path: str):
+        """Write the combined series of a metric or keep them for aggregation."""
+        if self.fused:
+            self.combined_frames[int(metric_index)] = as_stored(
+                df_or_frame, self.sparse_fill_ratio
+            )
+        self._write_intermediate(
+            write_combined, df_or_frame, path, self.sparse_fill_ratio
+        )
+
+    def input_combined(self, metric_index, path: str):
+        """Combined series of a metric, dense or as a `SparseFrame`."""
+        if self.fused and int(metric_index) in self.combined_frames:
+            return self.combined_frames.pop(int(metric_index))
+        return read_combined(path)
+
+    def output_aggregated(self, metric_index, df: pd.DataFrame, path: str):
+        """Write the aggregated series of a metric or keep them for merging."""
+        if self.fused:
+            self.aggregated_frames[int(metric_index)] = df
+        self._write_intermediate(write_csv, df, path)
+
+    def is_completed(self, stage: str, metric_index) -> bool:
+        """Check whether a unit of work has been journaled by a previous run."""
+        return self.journal is not None and self.journal.is_done(
+            self.metrics_path, self.source, stage, metric_index
+        )
+
+    def mark_completed(self, stage: str, metric_index):
+        if self.journal is not None:
+            self.journal.mark_done(self.metrics_path, self.source, stage, metric_index)
+
+    @staticmethod
+    def read_target_metrics_csv(path: str) -> pd.DataFrame:
+        """Read a target metrics table, cached until the file changes.
+
+        The tables are shared by all experiments, so long-running workers
+        read them once.
+        """
+        mtime = os.stat(path).st_mtime_ns
+        cached = _target_metrics_cache.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, pd.read_csv(path))
+            _target_metrics_cache[path] = cached
+        return cached[1].copy()
+
     @staticmethod
     def read_df_kpi_map(metric_index: int, kpi_map_folder_path: str) -> pd.DataFrame:
         kpi_map_path_json = os.path.join(
@@ -26,11 +108,81 @@ class Aggregator(ABC):
                 pd.read_csv(kpi_map_path_csv).set_index("Unnamed: 0").sort_index(axis=1)
             )
 
+    @staticmethod
+    def join_groups(df_list: list, groups: list) -> pd.DataFrame:
+        """Join per-group frames side by side as `<group>-<statistic>` columns."""
+        df_complete = concat_level(df_list, groups, ["group", "statistic"])
+        return df_complete.set_axis(
+            flatten_columns(df_complete.columns, "{group}-{statistic}"), axis=1
+        )
+
+    @staticmethod
+    def write_groups(df_list: list, groups: list, path: str):
+        df_complete = Aggregator.join_groups(df_list, groups)
+        if not df_complete.empty:
+            write_csv(df_complete, path)
+
+    def write_statistics(self, metric_index: int, df_statistics_list: list, groups):
+        """Persist sufficient statistics of all groups of a metric for rollups."""
+        if not df_statistics_list:
+            return
+        Aggregator.write_groups(
+            df_statistics_list,
+            groups,
+            os.path.join(self.statistics_path, f"metric-{metric_index}.csv"),
+        )
+
+    @staticmethod
+    def merge_metric_files(metric_paths: dict) -> pd.DataFrame:
+        """Read aggregated metrics into one frame with `metric-<index>-` columns."""
+        df_all = concat_level(
+            [
+                pd.read_csv(metric_path).set_index("timestamp")
+                for metric_path in metric_paths.values()
+            ],
+            list(metric_paths),
+            ["metric", "name"],
+        )
+        return df_all.set_axis(
+            flatten_columns(df_all.columns, "metric-{metric}-{name}"), axis=1
+        )
+
+    @staticmethod
+    def reduce_cumulative_block(
+        values: np.ndarray, timestamps: np.ndarray = None, per_second: bool = False
+    ) -> np.ndarray:
+        """Turn a 2D block of counters into deltas between consecutive rows.
+
+        A negative delta means the counter has been reset, like Prometheus
+        `increase()` the value after the reset is taken as the delta. With
+        `per_second` the deltas are divided by the seconds between rows.
+        """
+        values = np.asarray(values, dtype="float64")
+        deltas = np.full_like(values, np.nan)
+        previous, current = values[:-1], values[1:]
+        with np.errstate(invalid="ignore"):
+            deltas[1:] = np.where(current < previous, current, current - previous)
+        if per_second:
+            seconds = np.diff(np.asarray(timestamps, dtype="datetime64[ns]"))
+            seconds = seconds / np.timedelta64(1, "s")
+            with np.errstate(invalid="ignore", divide="ignore"):
+                deltas[1:] /= seconds[:, np.newaxis]
+        return deltas
+
+    @staticmethod
+    def reduce_cumulative_frame(
+        df: pd.DataFrame, per_second: bool = False
+    ) -> pd.DataFrame:
+        """Reduce all counters of a metric indexed by time in one pass."""
+        deltas = Aggregator.reduce_cumulative_block(
+            df.to_numpy(dtype="float64"), df.index.to_numpy(), per_second
+        )
+        return pd.DataFrame(deltas, index=df.index, columns=df.columns)
+
     @staticmethod
     def reduce_cumulative(series: pd.Series) -> pd.Series:
-        series = series.sub(series.shift())
-        series = series.mask(series < 0)
-        return series
+        deltas = Aggregator.reduce_cumulative_frame(series.to_frame()).iloc[:, 0]
+        return deltas.rename(series.name)
 
     @staticmethod
     def index_list(series) -> list:
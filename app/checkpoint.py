@@ -0,0 +1,131 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import json
+import os
+import uuid
+
+import pandas as pd
+from app.csv_writer import PARALLEL_MIN_CELLS, supports_blockwise, write_csv_blocks
+
+
+@contextmanager
+def atomic_output(path: str, mode: str = "w"):
+    """Open a temporary file next to `path` and move it into place on success.
+
+    Readers see either the previous file or the complete new one, never a
+    partially written file. The temporary file is removed if writing fails.
+    """
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, mode, newline="" if "b" not in mode else None) as fp:
+            yield fp
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_csv(df: pd.DataFrame, path: str, float_precision: int = None, **kwargs):
+    """Write a frame like `to_csv`, large frames are formatted in parallel.
+
+    `float_precision` limits floats to that many significant digits.
+    """
+    if float_precision is not None:
+        kwargs["float_format"] = f"%.{float_precision}g"
+    if df.size >= PARALLEL_MIN_CELLS and supports_blockwise(df, kwargs):
+        with atomic_output(path, "wb") as fp:
+            write_csv_blocks(df, fp, **kwargs)
+        return
+    with atomic_output(path) as fp:
+        df.to_csv(fp, **kwargs)
+
+
+def write_json(obj, path: str):
+    with atomic_output(path) as fp:
+        json.dump(obj, fp)
+
+
+class BackgroundWriter:
+    """Write files one after another in a background thread.
+
+    Writes are submitted as functions with their arguments and run in order,
+    `close` waits for all of them and re-raises the first error.
+    """
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(1)
+        self.futures = []
+
+    def submit(self, write, *args, **kwargs):
+        self.futures.append(self.executor.submit(write, *args, **kwargs))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        futures, self.futures = self.futures, []
+        for future in futures:
+            future.result()
+
+    def __enter__(self) -> "BackgroundWriter":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RunJournal:
+    """Append-only record of the units of work completed by a run.
+
+    A unit is identified by (experiment, source, stage, metric). Each
+    completed unit is appended as one JSON line and synced, so a crashed
+    run can be resumed by skipping the units already in the journal.
+    Several processes may append to the same journal.
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        self.path = path
+        self.completed = set()
+        if resume:
+            self.completed = RunJournal.read_units(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    @staticmethod
+    def unit(experiment: str, source: str, stage: str, metric) -> tuple:
+        return (str(experiment), str(source), str(stage), str(metric))
+
+    @staticmethod
+    def read_units(path: str) -> set:
+        units = set()
+        if not os.path.exists(path):
+            return units
+        with open(path) as fp:
+            for line in fp:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # last line of a crashed run may be incomplete
+                    continue
+                units.add(
+                    RunJournal.unit(
+                        entry["experiment"],
+                        entry["source"],
+                        entry["stage"],
+                        entry["metric"],
+                    )
+                )
+        return units
+
+    def is_done(self, experiment: str, source: str, stage: str, metric) -> bool:
+        return RunJournal.unit(experiment, source, stage, metric) in self.completed
+
+    def mark_done(self, experiment: str, source: str, stage: str, metric):
+        unit = RunJournal.unit(experiment, source, stage, metric)
+        entry = dict(zip(["experiment", "source", "stage", "metric"], unit))
+        with open(self.path, "a") as fp:
+            fp.write(json.dumps(entry) + "\n")
+            fp.flush()
+            os.fsync(fp.fileno())
+        self.completed.add(unit)
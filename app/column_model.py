@@ -0,0 +1,71 @@
+from string import Formatter
+
+import numpy as np
+import pandas as pd
+
+# levels identifying a column, each stored as integer codes into its values,
+# `name` holds flat names read back from files of an earlier stage
+LEVELS = ("source", "metric", "group", "kpi", "statistic", "name")
+INTEGER_LEVELS = {"metric", "kpi"}
+
+# flat names of the files written by the aggregators and the merger
+PROMETHEUS_COMBINED_PATTERN = r"value-(?P<kpi>[0-9]+)"
+GCLOUD_COMBINED_PATTERN = r"kpi-(?P<kpi>[0-9]+)-(?P<statistic>.+)"
+UNIFIED_PATTERN = r"agg-kpi-(?P<kpi>[0-9]+)(?:-(?P<statistic>.+))?"
+
+
+def parse_columns(columns: pd.Index, pattern: str) -> pd.MultiIndex:
+    """Parse flat column names into levels once, at the input boundary.
+
+    `pattern` is a regex whose named groups are the levels, `metric` and
+    `kpi` become integers. Names that do not match raise a ValueError.
+    """
+    df_levels = pd.Series(columns, dtype="object").str.extract(
+        f"^(?:{pattern})$", expand=True
+    )
+    unmatched = df_levels.isna().all(axis=1)
+    if unmatched.any():
+        raise ValueError(f"Unexpected columns {columns[unmatched.to_numpy()][:5]}!")
+    for level in INTEGER_LEVELS & set(df_levels.columns):
+        df_levels[level] = df_levels[level].astype("int64")
+    return pd.MultiIndex.from_frame(df_levels)
+
+
+def kpi_ids(columns: pd.Index, pattern: str = PROMETHEUS_COMBINED_PATTERN) -> pd.Index:
+    """Integer KPI ids of flat single-level column names."""
+    return parse_columns(columns, pattern).get_level_values("kpi")
+
+
+def concat_level(frames: list, keys: list, names: list) -> pd.DataFrame:
+    """Concatenate frames side by side under a new outer column level.
+
+    `names` are the names of the new level and of the levels of the frames.
+    """
+    df = pd.concat(frames, axis=1, keys=keys)
+    df.columns.names = names
+    return df
+
+
+def flatten_columns(columns: pd.Index, template: str) -> pd.Index:
+    """Generate flat column names at the output boundary.
+
+    `template` is a format string over level names, e.g. `"{group}-{statistic}"`.
+    Each distinct level value is formatted once and picked by its codes.
+    Levels missing from the template are dropped, missing values format
+    as "".
+    """
+    if not isinstance(columns, pd.MultiIndex):
+        columns = pd.MultiIndex.from_arrays([columns])
+    names = np.full(len(columns), "", dtype="object")
+    for literal, field, spec, _ in Formatter().parse(template):
+        names = names + literal
+        if field is None:
+            continue
+        level = columns.names.index(field)
+        values = np.array(
+            [format(value, spec) for value in columns.levels[level]] + [""],
+            dtype="object",
+        )
+        # code -1 of missing values picks the trailing ""
+        names = names + values[columns.codes[level]]
+    return pd.Index(names, dtype="object")
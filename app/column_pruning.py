@@ -0,0 +1,71 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+# cells of a chunk, 32 MiB as float64
+CHUNK_CELLS = 1 << 22
+PRUNED_COLUMNS = ["column", "reason", "kept_as", "value"]
+
+
+def chunk_rows_of(num_columns: int, chunk_cells: int = CHUNK_CELLS) -> int:
+    """Rows of a chunk holding about `chunk_cells` cells of `num_columns` columns."""
+    return max(chunk_cells // max(num_columns, 1), 1)
+
+
+class ColumnFingerprints:
+    """Streaming fingerprints of the columns of a dataset read in chunks.
+
+    Each column is hashed over its values, with NaN replaced by zero, and
+    over its NaN mask. Its number of values, minimum and maximum are kept
+    to detect empty and constant columns. Columns missing from a chunk
+    count as all NaN there, so chunks of differently shaped files can be
+    fed one after another.
+    """
+
+    def __init__(self, columns: list):
+        self.columns = pd.Index(columns)
+        self.hashes = [hashlib.blake2b(digest_size=16) for _ in self.columns]
+        self.num_rows = 0
+        self.counts = np.zeros(len(self.columns), dtype="int64")
+        self.minimums = np.full(len(self.columns), np.nan)
+        self.maximums = np.full(len(self.columns), np.nan)
+
+    def update(self, df: pd.DataFrame):
+        values = df.reindex(columns=self.columns).to_numpy(dtype="float64")
+        mask = np.isnan(values)
+        self.num_rows += len(values)
+        self.counts += len(values) - mask.sum(axis=0)
+        # fmin and fmax ignore NaN
+        self.minimums = np.fmin(self.minimums, np.fmin.reduce(values, axis=0))
+        self.maximums = np.fmax(self.maximums, np.fmax.reduce(values, axis=0))
+        # column-major, so that the bytes of each column are contiguous
+        filled = np.asfortranarray(np.where(mask, 0.0, values))
+        packed_mask = np.asfortranarray(np.packbits(mask, axis=0))
+        for j, column_hash in enumerate(self.hashes):
+            column_hash.update(filled[:, j])
+            column_hash.update(packed_mask[:, j])
+
+    def pruned_columns(self) -> pd.DataFrame:
+        """Columns carrying no information, with the reason to prune them.
+
+        Empty columns have no values and constant columns one value in all
+        rows. A duplicate is `kept_as` the first column with the same
+        fingerprint, a constant keeps its `value`.
+        """
+        pruned = []
+        first_columns = {}
+        for j, column in enumerate(self.columns):
+            if self.counts[j] == 0:
+                pruned.append([column, "empty", None, None])
+            elif (
+                self.counts[j] == self.num_rows and self.minimums[j] == self.maximums[j]
+            ):
+                pruned.append([column, "constant", None, self.minimums[j]])
+            else:
+                digest = self.hashes[j].digest()
+                if digest in first_columns:
+                    pruned.append([column, "duplicate", first_columns[digest], None])
+                else:
+                    first_columns[digest] = column
+        return pd.DataFrame(pruned, columns=PRUNED_COLUMNS)
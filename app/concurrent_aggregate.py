@@ -1,5 +1,6 @@
-from multiprocessing import Pool
+import argparse
 import os
+import sys
 
 import pandas as pd
 from app import (
@@ -10,46 +11,143 @@ from app import (
     NORMAL_PATH,
     PROMETHEUS_TARGET_METRICS_PATH,
 )
+from app.checkpoint import RunJournal
 from app.gcloud_aggregator import GCloudAggregator
 from app.locust_aggregator import LocustAggregator
+from app.memory_scheduler import (
+    GIB,
+    MemoryModel,
+    gcloud_task_features,
+    locust_task_features,
+    prometheus_task_features,
+    run_with_memory_budget,
+)
 from app.merger import (
     copy_merged_faulty_metrics_for_experiments,
     merge_faulty_metrics_from_aggregated,
     merge_normal_metrics,
 )
 from app.prometheus_aggregator import PrometheusAggregator
+from app.sparse_frame import SPARSE_FILL_RATIO
 
 
-def perform_aggregation(
-    gcloud_metrics_parent_path,
-    gcloud_metrics_folder,
-    prom_metrics_parent_path,
-    prom_metrics_folder,
-    locust_metrics_parent_path,
-    locust_metrics_folder,
+def _open_journal(journal_path: str) -> RunJournal:
+    # every worker appends to the journal the parent has prepared
+    return RunJournal(journal_path, resume=True) if journal_path else None
+
+
+def perform_gcloud_aggregation(
+    metrics_parent_path, metrics_folder, journal_path: str = None
 ):
     gcloud_aggregator = GCloudAggregator(
-        gcloud_metrics_parent_path,
-        gcloud_metrics_folder,
+        metrics_parent_path,
+        metrics_folder,
         GCLOUD_TARGET_METRICS_PATH,
+        journal=_open_journal(journal_path),
+        sparse_fill_ratio=SPARSE_FILL_RATIO,
     )
     gcloud_aggregator.merge_all_submetrics()
     gcloud_aggregator.aggregate_all_metrics()
 
+
+def perform_prometheus_aggregation(
+    metrics_parent_path, metrics_folder, journal_path: str = None
+):
     prometheus_aggregator = PrometheusAggregator(
-        prom_metrics_parent_path,
-        prom_metrics_folder,
+        metrics_parent_path,
+        metrics_folder,
         PROMETHEUS_TARGET_METRICS_PATH,
+        journal=_open_journal(journal_path),
+        sparse_fill_ratio=SPARSE_FILL_RATIO,
     )
-    prometheus_aggregator.merge_all_submetrics()
+    prometheus_aggregator.merge_all_submetrics(lazy=True)
     prometheus_aggregator.aggregate_all_metrics()
 
+
+def perform_locust_aggregation(
+    metrics_parent_path, metrics_folder, journal_path: str = None
+):
     locust_aggregator = LocustAggregator(
-        locust_metrics_parent_path, locust_metrics_folder
+        metrics_parent_path, metrics_folder, _open_journal(journal_path)
     )
     locust_aggregator.aggregate_all_metrics()
 
 
+def perform_aggregation(
+    gcloud_metrics_parent_path,
+    gcloud_metrics_folder,
+    prom_metrics_parent_path,
+    prom_metrics_folder,
+    locust_metrics_parent_path,
+    locust_metrics_folder,
+    journal_path: str = None,
+):
+    perform_gcloud_aggregation(
+        gcloud_metrics_parent_path, gcloud_metrics_folder, journal_path
+    )
+    perform_prometheus_aggregation(
+        prom_metrics_parent_path, prom_metrics_folder, journal_path
+    )
+    perform_locust_aggregation(
+        locust_metrics_parent_path, locust_metrics_folder, journal_path
+    )
+
+
+def gen_tasks(paths: list, journal_path: str = None) -> list:
+    """Split aggregations into one task per source with its memory features."""
+    tasks = []
+    for (
+        gcloud_metrics_parent_path,
+        gcloud_metrics_folder,
+        prom_metrics_parent_path,
+        prom_metrics_folder,
+        locust_metrics_parent_path,
+        locust_metrics_folder,
+    ) in paths:
+        gcloud_metrics_path = os.path.join(
+            gcloud_metrics_parent_path, gcloud_metrics_folder
+        )
+        prom_metrics_path = os.path.join(prom_metrics_parent_path, prom_metrics_folder)
+        locust_stats_path = os.path.join(
+            locust_metrics_parent_path,
+            locust_metrics_folder,
+            "alemira_stats_history.csv",
+        )
+        for kind, func, parent_path, folder, features in [
+            (
+                "gcloud",
+                perform_gcloud_aggregation,
+                gcloud_metrics_parent_path,
+                gcloud_metrics_folder,
+                gcloud_task_features(gcloud_metrics_path),
+            ),
+            (
+                "prometheus",
+                perform_prometheus_aggregation,
+                prom_metrics_parent_path,
+                prom_metrics_folder,
+                prometheus_task_features(prom_metrics_path),
+            ),
+            (
+                "locust",
+                perform_locust_aggregation,
+                locust_metrics_parent_path,
+                locust_metrics_folder,
+                locust_task_features(locust_stats_path),
+            ),
+        ]:
+            tasks.append(
+                {
+                    "name": f"{kind} {os.path.join(parent_path, folder)}",
+                    "kind": kind,
+                    "func": func,
+                    "args": (parent_path, folder, journal_path),
+                    **features,
+                }
+            )
+    return tasks
+
+
 def gen_paths(log_filename: str) -> list:
     paths = []
     # paths for normal metrics
@@ -100,11 +198,36 @@ def gen_paths(log_filename: str) -> list:
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip units of work completed by a previous run according to its journal",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=float,
+        help="GiB the concurrent tasks may use together, 80%% of the RAM by default",
+    )
+    parser.add_argument("--max-processes", type=int, default=6)
+    args = parser.parse_args()
+    journal_path = os.path.join(EXTRA_EXPERIMENTS_PATH, "aggregation-journal.jsonl")
+    journal = RunJournal(journal_path, resume=args.resume)
     paths = gen_paths("failure-injection-logs.csv")
-    with Pool(processes=6) as pool:
-        pool.starmap(perform_aggregation, paths)
-        pool.close()
-        pool.join()
-    merge_normal_metrics(os.path.join(EXTRA_EXPERIMENTS_PATH, "extra-1-week"))
+    summaries = run_with_memory_budget(
+        gen_tasks(paths, journal_path),
+        args.memory_budget * GIB if args.memory_budget else None,
+        args.max_processes,
+        MemoryModel(os.path.join(EXTRA_EXPERIMENTS_PATH, "memory-profile.jsonl")),
+    )
+    failed = [summary["name"] for summary in summaries if summary["status"] != "ok"]
+    if failed:
+        # merging would read partial aggregated outputs of the failed tasks
+        print(f"Not merging, {len(failed)} tasks failed: {', '.join(failed)}")
+        sys.exit(1)
+    normal_path = os.path.join(EXTRA_EXPERIMENTS_PATH, "extra-1-week")
+    if not journal.is_done(normal_path, "normal", "merge", "all"):
+        merge_normal_metrics(normal_path)
+        journal.mark_done(normal_path, "normal", "merge", "all")
     # merge_faulty_metrics_from_aggregated()
     # copy_merged_faulty_metrics_for_experiments()
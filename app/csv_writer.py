@@ -0,0 +1,126 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+import multiprocessing
+import os
+import threading
+
+import pandas as pd
+
+# frames with fewer cells are written by a single `to_csv` call
+PARALLEL_MIN_CELLS = 1 << 21
+BLOCK_CELLS = 1 << 20
+WRITE_BATCH_BYTES = 1 << 26
+BLOCKWISE_KWARGS = {"index", "header", "index_label", "float_format", "na_rep"}
+
+_frame = None
+_row_kwargs = None
+
+
+def supports_blockwise(df: pd.DataFrame, kwargs: dict) -> bool:
+    """Check whether formatting row blocks separately gives the same bytes.
+
+    Floats, integers and strings are formatted element by element, while the
+    format of datetime columns depends on all their values, so those frames
+    and unusual `to_csv` options are left to pandas.
+    """
+    if not set(kwargs) <= BLOCKWISE_KWARGS:
+        return False
+    if any(dtype.kind in "mM" for dtype in df.dtypes):
+        return False
+    if isinstance(df.index, pd.MultiIndex):
+        return not any(level.dtype.kind in "mM" for level in df.index.levels)
+    return True
+
+
+def formatted_index(df: pd.DataFrame, kwargs: dict) -> pd.Index:
+    """Format a datetime index once, its format depends on all of its values."""
+    if df.index.dtype.kind not in "mM" or not kwargs.get("index", True):
+        return df.index
+    lines = df.iloc[:, :0].to_csv(header=False, na_rep=kwargs.get("na_rep", ""))
+    # an empty line of a missing value is quoted, it is an empty field in a row
+    lines = ["" if line == '""' else line for line in lines.splitlines()]
+    return pd.Index(lines, name=df.index.name, dtype="object")
+
+
+def _init_worker(df: pd.DataFrame, row_kwargs: dict):
+    global _frame, _row_kwargs
+    _frame, _row_kwargs = df, row_kwargs
+
+
+def _format_rows(df: pd.DataFrame, row_kwargs: dict, bounds: tuple) -> bytes:
+    start, stop = bounds
+    return df.iloc[start:stop].to_csv(header=False, **row_kwargs).encode()
+
+
+def _format_block(bounds: tuple) -> bytes:
+    return _format_rows(_frame, _row_kwargs, bounds)
+
+
+def _write_all(fd: int, buffers: list):
+    """Write buffers with `writev`, resuming after partial writes."""
+    view_list = [memoryview(buffer) for buffer in buffers if buffer]
+    while view_list:
+        written = os.writev(fd, view_list)
+        while view_list and written >= len(view_list[0]):
+            written -= len(view_list[0])
+            view_list.pop(0)
+        if view_list and written:
+            view_list[0] = view_list[0][written:]
+
+
+def _executor(workers: int, df: pd.DataFrame, row_kwargs: dict) -> tuple:
+    """Pick forked processes sharing the frame if possible, threads otherwise."""
+    # daemonic pool workers are not allowed to have children, and forking
+    # while other threads run may deadlock children on locks they hold
+    if (
+        workers > 1
+        and not multiprocessing.current_process().daemon
+        and threading.active_count() == 1
+        and "fork" in multiprocessing.get_all_start_methods()
+    ):
+        executor = ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(df, row_kwargs),
+        )
+        return executor, _format_block
+    return ThreadPoolExecutor(workers), partial(_format_rows, df, row_kwargs)
+
+
+def write_csv_blocks(
+    df: pd.DataFrame, fp, workers: int = None, block_rows: int = None, **kwargs
+):
+    """Write a frame as CSV to a binary file, formatting row blocks in parallel.
+
+    The output is identical to `df.to_csv(fp, **kwargs)`. Blocks are
+    formatted by forked worker processes, or threads where forking is not
+    possible, and written in order through `writev` in batches of 64 MiB.
+    """
+    if not supports_blockwise(df, kwargs):
+        df.to_csv(fp, **kwargs)
+        return
+    row_kwargs = {
+        key: value
+        for key, value in kwargs.items()
+        if key in ["index", "float_format", "na_rep"]
+    }
+    header = df.iloc[:0].to_csv(**kwargs).encode()
+    df = df.set_axis(formatted_index(df, kwargs), axis=0)
+    workers = workers or os.cpu_count() or 1
+    block_rows = block_rows or max(BLOCK_CELLS // max(len(df.columns), 1), 1)
+    bounds_list = [
+        (start, min(start + block_rows, len(df)))
+        for start in range(0, len(df), block_rows)
+    ]
+    fp.flush()
+    batch, batch_bytes = [header], len(header)
+    executor, format_block = _executor(workers, df, row_kwargs)
+    with executor:
+        for block in executor.map(format_block, bounds_list):
+            batch.append(block)
+            batch_bytes += len(block)
+            if batch_bytes >= WRITE_BATCH_BYTES:
+                _write_all(fp.fileno(), batch)
+                batch, batch_bytes = [], 0
+    _write_all(fp.fileno(), batch)
@@ -0,0 +1,149 @@
+import fnmatch
+import os
+import shutil
+
+import pandas as pd
+from app.checkpoint import atomic_output
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+COLUMN_PREFIXES = ("gm-", "pm-", "lm-")
+
+
+def _require_pyarrow():
+    if pq is None:
+        raise ImportError("pyarrow is required for the Parquet dataset sink!")
+
+
+def _partition_value(value: str) -> str:
+    return str(value).replace("/", "_")
+
+
+def write_merged_dataset(
+    df: pd.DataFrame,
+    dataset_path: str,
+    experiment: str,
+    row_group_size: int = 1440,
+):
+    """Write a merged time series as `experiment=<name>/day=<date>/part-0.parquet`.
+
+    Parquet keeps min/max statistics per column and row group, with one row
+    group per day of minutes by default. Previous partitions of the
+    experiment are replaced.
+    """
+    _require_pyarrow()
+    experiment_path = os.path.join(
+        dataset_path, f"experiment={_partition_value(experiment)}"
+    )
+    if os.path.exists(experiment_path):
+        shutil.rmtree(experiment_path)
+    df = df.sort_index()
+    df.index = pd.to_datetime(df.index)
+    df.index.name = "timestamp"
+    for day, df_day in df.groupby(df.index.date):
+        day_path = os.path.join(experiment_path, f"day={day.isoformat()}")
+        os.makedirs(day_path, exist_ok=True)
+        table = pa.Table.from_pandas(df_day, preserve_index=False).add_column(
+            0, "timestamp", pa.array(df_day.index)
+        )
+        with atomic_output(os.path.join(day_path, "part-0.parquet"), "wb") as fp:
+            pq.write_table(
+                table, fp, row_group_size=row_group_size, write_statistics=True
+            )
+
+
+def list_partitions(dataset_path: str) -> pd.DataFrame:
+    """List partition files with their experiment and day."""
+    partitions = []
+    for experiment_folder in sorted(os.listdir(dataset_path)):
+        if not experiment_folder.startswith("experiment="):
+            continue
+        experiment_path = os.path.join(dataset_path, experiment_folder)
+        for day_folder in sorted(os.listdir(experiment_path)):
+            if not day_folder.startswith("day="):
+                continue
+            day_path = os.path.join(experiment_path, day_folder)
+            for filename in sorted(os.listdir(day_path)):
+                if filename.endswith(".parquet"):
+                    partitions.append(
+                        {
+                            "experiment": experiment_folder.removeprefix("experiment="),
+                            "day": pd.Timestamp(day_folder.removeprefix("day=")),
+                            "path": os.path.join(day_path, filename),
+                        }
+                    )
+    return pd.DataFrame(partitions, columns=["experiment", "day", "path"])
+
+
+def _select_partitions(
+    df_partitions: pd.DataFrame, experiments, start, end
+) -> pd.DataFrame:
+    if experiments is not None:
+        if isinstance(experiments, str):
+            selected = df_partitions["experiment"].map(
+                lambda experiment: fnmatch.fnmatch(experiment, experiments)
+            )
+        else:
+            selected = df_partitions["experiment"].isin(
+                [_partition_value(e) for e in experiments]
+            )
+        df_partitions = df_partitions[selected]
+    if start is not None:
+        df_partitions = df_partitions[
+            df_partitions["day"] >= pd.Timestamp(start).normalize()
+        ]
+    if end is not None:
+        df_partitions = df_partitions[df_partitions["day"] <= pd.Timestamp(end)]
+    return df_partitions
+
+
+def read_merged_dataset(
+    dataset_path: str,
+    experiments=None,
+    start=None,
+    end=None,
+    column_prefixes: tuple = None,
+) -> pd.DataFrame:
+    """Read merged time series with filters pushed down to files and row groups.
+
+    `experiments` is a list of names or a glob pattern. Partitions outside the
+    experiments or the days of [start, end] are not opened, row groups outside
+    the time range are skipped by their statistics, and only columns starting
+    with one of `column_prefixes` are decoded. An `experiment` column is added
+    when several experiments are read.
+    """
+    _require_pyarrow()
+    df_partitions = _select_partitions(
+        list_partitions(dataset_path), experiments, start, end
+    )
+    filters = []
+    if start is not None:
+        filters.append(("timestamp", ">=", pd.Timestamp(start)))
+    if end is not None:
+        filters.append(("timestamp", "<=", pd.Timestamp(end)))
+    df_list = []
+    for partition in df_partitions.itertuples():
+        schema = pq.read_schema(partition.path)
+        columns = [
+            name
+            for name in schema.names
+            if name == "timestamp"
+            or column_prefixes is None
+            or name.startswith(tuple(column_prefixes))
+        ]
+        df = pq.read_table(
+            partition.path, columns=columns, filters=filters or None
+        ).to_pandas()
+        df.insert(0, "experiment", partition.experiment)
+        df_list.append(df)
+    if not df_list:
+        return pd.DataFrame()
+    df_all = pd.concat(df_list).set_index("timestamp")
+    if df_all["experiment"].nunique() == 1:
+        df_all = df_all.drop(columns="experiment")
+    return df_all
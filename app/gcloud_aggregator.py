@@ -1,21 +1,45 @@
-import json
 import os
 import re
 import warnings
 
-import jsonlines
+import numpy as np
 import pandas as pd
 from app.aggregator import Aggregator
+from app.checkpoint import RunJournal, write_csv, write_json
+from app.column_model import (
+    GCLOUD_COMBINED_PATTERN,
+    flatten_columns,
+    parse_columns,
+)
 from app.gcloud_metric_kind import GCloudMetricKind
+from app.kpi_pack import metric_type_indices, read_metric_type
+from app.label_index import LabelIndex
+from app.quantile_sketch import sketch_rows
+from app.rollup import sufficient_statistics
+from app.sparse_frame import SparseFrame, as_dense
+from app.minute_dedup import (
+    dedup_minutes,
+    minute_keys_to_timestamps,
+    pivot_minutes,
+    to_minute_keys,
+)
 
 
 class GCloudAggregator(Aggregator):
+    source = "gcloud"
+
     def __init__(
         self,
         metrics_parent_path: str,
         metrics_folder: str,
         target_metrics_path: str,
         output_suffix: str = "",
+        per_second_rates: bool = False,
+        sketch_accuracy: float = None,
+        persist_statistics: bool = False,
+        journal: RunJournal = None,
+        sparse_fill_ratio: float = None,
+        read_workers: int = None,
     ):
         if "day" in metrics_folder:
             day = re.search(r"gcloud_metrics-day-([0-9]+)", metrics_folder)[1]
@@ -30,72 +54,121 @@ class GCloudAggregator(Aggregator):
         self.complete_time_series_path = os.path.join(
             metrics_parent_path, f"gcloud-complete-time-series{output_suffix}.csv"
         )
-        self.df_target_metrics = pd.read_csv(target_metrics_path).set_index("index")
+        self.df_target_metrics = self.read_target_metrics_csv(
+            target_metrics_path
+        ).set_index("index")
+        self.per_second_rates = per_second_rates
+        self.sketch_accuracy = sketch_accuracy
+        self.persist_statistics = persist_statistics
+        self.statistics_path = os.path.join(
+            metrics_parent_path, "gcloud_statistics" + output_suffix
+        )
+        self.journal = journal
+        self.sparse_fill_ratio = sparse_fill_ratio
+        self.read_workers = read_workers
+        self._label_index = None
         if not os.path.exists(self.merged_submetrics_path):
             os.mkdir(self.merged_submetrics_path)
         if not os.path.exists(self.aggregated_metrics_path):
             os.mkdir(self.aggregated_metrics_path)
+        if persist_statistics and not os.path.exists(self.statistics_path):
+            os.mkdir(self.statistics_path)
 
     def _merge_submetrics(self, metric_path: str, metric_index: int):
         """Merge all available KPIs in one metric to produce a dataframe."""
         # copy KPI map to destination path
-        kpi_map_path = os.path.join(
-            metric_path,
-            "kpi_map.jsonl",
-        )
-        with jsonlines.open(kpi_map_path) as reader:
-            kpi_map_list = [obj for obj in reader]
-        with open(
+        kpi_map_list, kpis = read_metric_type(metric_path, self.read_workers)
+        write_json(
+            kpi_map_list,
             os.path.join(
                 self.merged_submetrics_path, f"metric-{metric_index}-kpi-map.json"
             ),
-            "w",
-        ) as fp:
-            json.dump(kpi_map_list, fp)
+        )
         # merge KPIs in the metric type
-        kpi_list = []
-        for kpi_map in kpi_map_list:
-            kpi_index = kpi_map["index"]
-            kpi_path = os.path.join(
-                metric_path,
-                f"kpi-{kpi_index}.csv",
-            )
-            df_kpi = pd.read_csv(kpi_path)
+        columns = []
+        series_ids_list = []
+        keys_list = []
+        values_list = []
+        for kpi_map, (value_columns, timestamps, values) in zip(kpi_map_list, kpis):
             # round timestamp to minute
-            df_kpi["timestamp"] = pd.to_datetime(
-                df_kpi["timestamp"], unit="s"
-            ).dt.round("min")
-            df_kpi = df_kpi.set_index("timestamp").add_prefix(f"kpi-{kpi_index}-")
-            # aggregate duplicated minutes
-            if len(df_kpi.index) != len(df_kpi.index.drop_duplicates()):
-                df_kpi = df_kpi.groupby("timestamp").agg("mean")
-            kpi_list.append(df_kpi)
-        df_kpis = pd.concat(kpi_list, axis=1)
-        df_kpis.to_csv(
-            os.path.join(self.merged_submetrics_path, f"metric-{metric_index}.csv")
+            keys = to_minute_keys(timestamps)
+            for j, column in enumerate(value_columns):
+                series_ids_list.append(np.full(len(keys), len(columns)))
+                keys_list.append(keys)
+                values_list.append(values[:, j])
+                columns.append(f"kpi-{kpi_map['index']}-{column}")
+        # aggregate duplicated minutes of all KPIs at once
+        series_ids, keys, values = dedup_minutes(
+            np.concatenate(series_ids_list),
+            np.concatenate(keys_list),
+            np.concatenate(values_list),
+        )
+        if self.sparse_fill_ratio is not None:
+            df_kpis = SparseFrame.from_minutes(series_ids, keys, values, columns)
+        else:
+            unique_keys, matrix = pivot_minutes(series_ids, keys, values, len(columns))
+            df_kpis = pd.DataFrame(
+                matrix, index=minute_keys_to_timestamps(unique_keys), columns=columns
+            )
+        self.output_combined(
+            metric_index,
+            df_kpis,
+            os.path.join(self.merged_submetrics_path, f"metric-{metric_index}.csv"),
         )
 
     def merge_all_submetrics(self):
         print(f"merge {self.metrics_path}")
-        metric_types_indices = [
-            f.split("-")[-1]
-            for f in os.listdir(self.metrics_path)
-            if f.startswith("metric-type")
-        ]
+        metric_types_indices = metric_type_indices(self.metrics_path)
         for metric_index in metric_types_indices:
+            if self.is_completed("merge", metric_index):
+                continue
             metric_path = os.path.join(self.metrics_path, f"metric-type-{metric_index}")
             self._merge_submetrics(metric_path, metric_index)
+            self.mark_completed("merge", metric_index)
+        self._label_index = LabelIndex.from_kpi_maps(
+            self.merged_submetrics_path, metric_types_indices
+        )
+        self._label_index.save(self.merged_submetrics_path)
 
-    def get_df_metric(self, metric_index: int) -> pd.DataFrame:
-        metric_path = os.path.join(
-            self.merged_submetrics_path, f"metric-{metric_index}.csv"
+    @property
+    def label_index(self) -> LabelIndex:
+        """Label index of the combined metrics, built from kpi maps if not persisted."""
+        if self._label_index is None:
+            if os.path.exists(
+                os.path.join(self.merged_submetrics_path, LabelIndex.filename)
+            ):
+                self._label_index = LabelIndex.load(self.merged_submetrics_path)
+            else:
+                self._label_index = LabelIndex.from_kpi_maps(
+                    self.merged_submetrics_path, self.get_metric_indices()
+                )
+        return self._label_index
+
+    def get_df_metric(self, metric_index: int):
+        """Read the combined KPIs of a metric, dense or as a `SparseFrame`.
+
+        Columns are identified by the levels `kpi` and `statistic`.
+        """
+        df_metric = self.input_combined(
+            metric_index,
+            os.path.join(self.merged_submetrics_path, f"metric-{metric_index}.csv"),
+        )
+        df_metric = df_metric.set_axis(
+            parse_columns(df_metric.columns, GCLOUD_COMBINED_PATTERN), axis=1
         )
-        df_metric = pd.read_csv(metric_path)
-        df_metric["timestamp"] = pd.to_datetime(df_metric["timestamp"])
-        df_metric = df_metric.set_index("timestamp").sort_index()
         metric_kind = self.df_target_metrics.loc[metric_index]["kind"]
         if metric_kind == GCloudMetricKind.CUMULATIVE.value:
-            df_metric = df_metric.apply(Aggregator.reduce_cumulative)
+            if GCloudAggregator.is_distribution(
+                df_metric.columns.get_level_values("statistic")
+            ):
+                return GCloudAggregator.reduce_cumulative_distributions(
+                    as_dense(df_metric)
+                )
+            if isinstance(df_metric, SparseFrame):
+                return df_metric.reduce_cumulative(self.per_second_rates)
+            df_metric = Aggregator.reduce_cumulative_frame(
+                df_metric, self.per_second_rates
+            )
         return df_metric
 
     def aggregate_one_metric(self, metric_index: int, for_extra: bool = False):
@@ -162,12 +235,8 @@ class GCloudAggregator(Aggregator):
     ):
         """Aggregate KPIs with same container name."""
         print(f"Aggregating metric {metric_index} with same container name ...")
-        group_columns = ["container_name"]
-        df_kpi_map_unique = df_kpi_map[group_columns]
-        df_kpi_map_unique = (
-            df_kpi_map_unique.reset_index()
-            .groupby(group_columns)
-            .agg(Aggregator.index_list)
+        df_kpi_map_unique = self.label_index.group_frame(
+            metric_index, "container_name", df_kpi_map.index
         )
         self.aggregate(metric_index, df_kpi_map_unique)
 
@@ -208,7 +277,8 @@ class GCloudAggregator(Aggregator):
         ):
             df_kpi_map = df_kpi_map[["container_name"]]
         # adapt kpi name
-        df_metric = self.get_df_metric(metric_index)
+        df_metric = as_dense(self.get_df_metric(metric_index))
+        df_metric.columns = flatten_columns(df_metric.columns, "kpi-{kpi}-{statistic}")
         for i in df_kpi_map.index:
             original_column_name = f"kpi-{i}-value"
             if original_column_name in df_metric.columns:
@@ -220,8 +290,10 @@ class GCloudAggregator(Aggregator):
                     columns={original_column_name: new_col_name},
                     inplace=True,
                 )
-        df_metric.to_csv(
-            os.path.join(self.aggregated_metrics_path, f"metric-{metric_index}.csv")
+        self.output_aggregated(
+            metric_index,
+            df_metric,
+            os.path.join(self.aggregated_metrics_path, f"metric-{metric_index}.csv"),
         )
 
     @staticmethod
@@ -242,67 +314,259 @@ class GCloudAggregator(Aggregator):
             )
             return df_metric_agg
 
+    @staticmethod
+    def merge_distributions(
+        counts: np.ndarray, means: np.ndarray, squared_deviations: np.ndarray
+    ):
+        """Pool the distributions of KPIs (columns) per minute (rows).
+
+        Returns the total count, the count-weighted mean and the pooled sum of
+        squared deviations of each row. KPIs without count or mean in a row are
+        left out of that row, a missing sum of squared deviations counts as 0.
+        """
+        valid = ~np.isnan(counts) & ~np.isnan(means) & (counts > 0)
+        counts = np.where(valid, counts, 0.0)
+        means = np.where(valid, means, 0.0)
+        squared_deviations = np.where(
+            valid & ~np.isnan(squared_deviations), squared_deviations, 0.0
+        )
+        total_count = counts.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            pooled_mean = (counts * means).sum(axis=1) / total_count
+        between = counts * (means - pooled_mean[:, np.newaxis]) ** 2
+        pooled_squared_deviation = (squared_deviations + between).sum(axis=1)
+        empty = total_count == 0
+        pooled_mean[empty] = np.nan
+        pooled_squared_deviation[empty] = np.nan
+        return total_count, pooled_mean, pooled_squared_deviation
+
+    @staticmethod
+    def reduce_cumulative_distributions(df_metric: pd.DataFrame) -> pd.DataFrame:
+        """Turn cumulative distributions into distributions between rows.
+
+        Deltas of counts and sums give the count and mean of the observations
+        between two rows, and their sum of squared deviations follows from the
+        parallel variance formula. A decreasing count is a reset, the values
+        after it are the delta. Counts are not divided into per second rates,
+        they weight the pooling of distributions.
+        """
+        indices = list(
+            dict.fromkeys(
+                kpi
+                for kpi, statistic in df_metric.columns
+                if statistic in ["count", "mean", "sum_of_squared_deviation"]
+            )
+        )
+        counts, means, squared_deviations = GCloudAggregator.distribution_blocks(
+            df_metric, indices
+        )
+        previous_counts, current_counts = counts[:-1], counts[1:]
+        previous_means, current_means = means[:-1], means[1:]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            reset = current_counts < previous_counts
+            # no observations before are no observations to subtract
+            previous_counts = np.where(reset, 0.0, previous_counts)
+            started = previous_counts > 0
+            previous_sums = np.where(started, previous_counts * previous_means, 0.0)
+            delta_counts = current_counts - previous_counts
+            delta_means = (
+                current_counts * current_means - previous_sums
+            ) / delta_counts
+            between = np.where(
+                started,
+                previous_counts
+                * delta_counts
+                / current_counts
+                * (delta_means - previous_means) ** 2,
+                0.0,
+            )
+            previous_deviations = np.where(
+                reset, 0.0, np.nan_to_num(squared_deviations[:-1])
+            )
+            delta_deviations = np.clip(
+                squared_deviations[1:] - previous_deviations - between, 0, None
+            )
+        blocks = {}
+        for statistic, delta in [
+            ("count", delta_counts),
+            ("mean", delta_means),
+            ("sum_of_squared_deviation", delta_deviations),
+        ]:
+            block = np.full_like(counts, np.nan)
+            block[1:] = delta
+            blocks[statistic] = block
+        columns = pd.MultiIndex.from_tuples(
+            [(kpi, statistic) for statistic in blocks for kpi in indices],
+            names=df_metric.columns.names,
+        )
+        return pd.DataFrame(
+            np.concatenate(list(blocks.values()), axis=1),
+            index=df_metric.index,
+            columns=columns,
+        )
+
+    @staticmethod
+    def distribution_blocks(df_metric: pd.DataFrame, indices: list):
+        """Select count, mean and sum of squared deviations of KPIs as 2D blocks."""
+        return [
+            df_metric.reindex(columns=[(i, suffix) for i in indices]).to_numpy(
+                dtype="float64"
+            )
+            for suffix in ["count", "mean", "sum_of_squared_deviation"]
+        ]
+
+    @staticmethod
+    def gen_df_distribution_agg(df_metric: pd.DataFrame, indices: list) -> pd.DataFrame:
+        counts, means, squared_deviations = GCloudAggregator.distribution_blocks(
+            df_metric, indices
+        )
+        total_count, pooled_mean, pooled_squared_deviation = (
+            GCloudAggregator.merge_distributions(counts, means, squared_deviations)
+        )
+        with np.errstate(invalid="ignore", divide="ignore"):
+            pooled_variance = pooled_squared_deviation / (total_count - 1)
+        return pd.DataFrame(
+            {
+                "count": total_count,
+                "mean": pooled_mean,
+                "variance": np.where(total_count > 1, pooled_variance, np.nan),
+            },
+            index=df_metric.index,
+        )
+
+    @staticmethod
+    def distribution_statistics(df_metric: pd.DataFrame, indices: list) -> pd.DataFrame:
+        """Sufficient statistics of the pooled observations behind distributions.
+
+        Minimum and maximum are unknown from distribution summaries.
+        """
+        counts, means, squared_deviations = GCloudAggregator.distribution_blocks(
+            df_metric, indices
+        )
+        total_count, pooled_mean, pooled_squared_deviation = (
+            GCloudAggregator.merge_distributions(counts, means, squared_deviations)
+        )
+        total = np.where(total_count > 0, total_count * pooled_mean, 0.0)
+        return pd.DataFrame(
+            {
+                "count": total_count,
+                "sum": total,
+                "sum_of_squares": np.where(
+                    total_count > 0,
+                    pooled_squared_deviation + total * pooled_mean,
+                    0.0,
+                ),
+                "min": np.nan,
+                "max": np.nan,
+            },
+            index=df_metric.index,
+        )
+
     def aggregate(self, metric_index: int, df_kpi_map_unique: pd.DataFrame):
         df_metric = self.get_df_metric(metric_index)
+        is_distribution = GCloudAggregator.is_distribution(
+            df_metric.columns.get_level_values("statistic")
+        )
         df_agg_list = []
+        df_statistics_list = []
+        column_prefixes = []
         df_kpi_map_unique = df_kpi_map_unique.rename(
             columns={"index": "index_list"}
         ).reset_index()
+        indices_with_metrics = set(df_metric.columns.get_level_values("kpi"))
         for i in df_kpi_map_unique.index:
             column_prefix = df_kpi_map_unique[
                 df_kpi_map_unique.drop(columns="index_list").columns[0]
             ].loc[i]
             # select columns to merge
-            indices_with_metrics = [
-                int(re.search(r"kpi-([0-9]+)-.*", column)[1])
-                for column in df_metric.columns.to_list()
-            ]
             valid_indices = list(
-                set(df_kpi_map_unique.loc[i]["index_list"]) & set(indices_with_metrics)
+                set(df_kpi_map_unique.loc[i]["index_list"]) & indices_with_metrics
             )
-            if GCloudAggregator.is_distribution(df_metric.columns):
-                for suffix in ["count", "mean"]:
-                    columns_to_merge = [f"kpi-{i}-{suffix}" for i in valid_indices]
-                    df_metric_to_agg = df_metric[columns_to_merge]
-                    df_metric_agg = GCloudAggregator.gen_df_metric_agg(
-                        df_metric_to_agg
-                    ).add_prefix(f"{column_prefix}-d{suffix}-")
-                    df_agg_list.append(df_metric_agg)
+            column_prefixes.append(column_prefix)
+            if is_distribution:
+                df_metric_agg = GCloudAggregator.gen_df_distribution_agg(
+                    df_metric, valid_indices
+                )
+                df_agg_list.append(df_metric_agg)
+                if self.persist_statistics:
+                    df_statistics_list.append(
+                        GCloudAggregator.distribution_statistics(
+                            df_metric, valid_indices
+                        )
+                    )
             else:
-                columns_to_merge = [f"kpi-{i}-value" for i in valid_indices]
+                columns_to_merge = [(i, "value") for i in valid_indices]
                 df_metric_to_agg = df_metric[columns_to_merge]
-                df_metric_agg = GCloudAggregator.gen_df_metric_agg(
-                    df_metric_to_agg
-                ).add_prefix(f"{column_prefix}-")
+                df_metric_agg = GCloudAggregator.gen_df_metric_agg(df_metric_to_agg)
+                if self.sketch_accuracy:
+                    df_metric_agg["sketch"] = sketch_rows(
+                        as_dense(df_metric_to_agg), self.sketch_accuracy
+                    )
                 df_agg_list.append(df_metric_agg)
-        df_complete_agg = pd.concat(df_agg_list, axis=1)
-        if not df_complete_agg.empty:
-            df_complete_agg.to_csv(
-                os.path.join(self.aggregated_metrics_path, f"metric-{metric_index}.csv")
+                if self.persist_statistics:
+                    df_statistics_list.append(
+                        sufficient_statistics(as_dense(df_metric_to_agg))
+                    )
+        df_complete = Aggregator.join_groups(df_agg_list, column_prefixes)
+        if not df_complete.empty:
+            self.output_aggregated(
+                metric_index,
+                df_complete,
+                os.path.join(
+                    self.aggregated_metrics_path, f"metric-{metric_index}.csv"
+                ),
             )
+        self.write_statistics(metric_index, df_statistics_list, column_prefixes)
 
     def aggregate_all_metrics(self):
         """Aggregate all available metrics to reduce dimensionality."""
         metric_indices = self.get_metric_indices()
         for metric_index in metric_indices:
+            if self.is_completed("aggregate", metric_index):
+                continue
             self.aggregate_one_metric(metric_index, True)
+            self.mark_completed("aggregate", metric_index)
+
+    def run_fused(self, intermediate_writer=None) -> dict:
+        """Merge and aggregate metric by metric, handing frames over in memory.
+
+        Only kpi maps and the label index are written, other intermediate
+        files are left to `intermediate_writer` if given. Returns the
+        aggregated frames by metric index.
+        """
+        print(f"merge and aggregate {self.metrics_path}")
+        self.start_fused(intermediate_writer)
+        metric_types_indices = sorted(
+            int(metric_index) for metric_index in metric_type_indices(self.metrics_path)
+        )
+        self._label_index = LabelIndex()
+        for metric_index in metric_types_indices:
+            metric_path = os.path.join(self.metrics_path, f"metric-type-{metric_index}")
+            self._merge_submetrics(metric_path, metric_index)
+            self._label_index.add_metric(
+                metric_index,
+                Aggregator.read_df_kpi_map(metric_index, self.merged_submetrics_path),
+            )
+            if metric_index in self.get_metric_indices():
+                self.aggregate_one_metric(metric_index, True)
+            self.combined_frames.pop(metric_index, None)
+        self._label_index.save(self.merged_submetrics_path)
+        return self.aggregated_frames
 
     def merge_metrics(self):
         """Merge all metrics into one dataframe."""
-        df_all_list = []
+        metric_paths = {}
         metric_indices = self.get_metric_indices()
         for metric_index in metric_indices:
             print(f"Processing metric {metric_index} ...")
-            metric_path = os.path.join(
+            metric_paths[metric_index] = os.path.join(
                 self.aggregated_metrics_path, f"metric-{metric_index}.csv"
             )
-            df_metric = pd.read_csv(metric_path).set_index("timestamp")
-            df_all_list.append(df_metric.add_prefix(f"metric-{metric_index}-"))
-        df_all = pd.concat(df_all_list, axis=1)
+        df_all = Aggregator.merge_metric_files(metric_paths)
         num_cols = len(df_all.columns)
         num_rows = len(df_all)
         print(f"{num_rows} rows x {num_cols} columns")
-        df_all.to_csv(self.complete_time_series_path)
+        write_csv(df_all, self.complete_time_series_path)
 
     def get_metric_indices(self) -> list:
         metric_indices = [
@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor
+import io
+
+import numpy as np
+import pandas as pd
+
+# files are mostly tiny, so reads are bound by filesystem latency
+READ_WORKERS = 16
+
+
+def parse_kpi_csv(data: bytes) -> tuple:
+    """Parse a `timestamp,<values>...` CSV of plain numbers without pandas.
+
+    Returns the value column names, the timestamps, integers if they all
+    are like `read_csv` infers them, and a 2D array of values where empty
+    fields are NaN. Anything else raises a ValueError.
+    """
+    text = str(data, "utf-8")
+    if '"' in text or "\r" in text:
+        raise ValueError("Quoted fields and CRLF line ends are not supported!")
+    header, _, body = text.partition("\n")
+    columns = header.split(",")
+    if columns[0] != "timestamp" or len(columns) < 2:
+        raise ValueError(f"Unexpected header {header}!")
+    body = body.rstrip("\n")
+    fields = np.array(body.replace("\n", ",").split(",") if body else [])
+    if len(fields) % len(columns):
+        raise ValueError("Rows have different numbers of fields!")
+    table = fields.reshape(-1, len(columns))
+    try:
+        timestamps = table[:, 0].astype("int64")
+    except ValueError:
+        timestamps = table[:, 0].astype("float64")
+    values = table[:, 1:]
+    # not assigned in place, the fixed-width strings may be too short for "nan"
+    values = np.where(values == "", "nan", values)
+    return columns[1:], timestamps, values.astype("float64")
+
+
+def read_kpi_data(data: bytes) -> tuple:
+    """Parse a KPI file with the light parser or `pd.read_csv` if unsupported."""
+    try:
+        return parse_kpi_csv(data)
+    except ValueError:
+        df_kpi = pd.read_csv(io.BytesIO(data))
+        value_columns = df_kpi.columns.drop("timestamp").to_list()
+        return (
+            value_columns,
+            df_kpi["timestamp"].to_numpy(),
+            df_kpi[value_columns].to_numpy(dtype="float64"),
+        )
+
+
+def _read_kpi_file(path: str) -> tuple:
+    with open(path, "rb") as fp:
+        return read_kpi_data(fp.read())
+
+
+def read_kpi_files(paths: list, workers: int = None):
+    """Read many small KPI files concurrently, yielding their parses in order.
+
+    Each parse is (value column names, timestamps, values) as returned by
+    `parse_kpi_csv`. Files the light parser does not support are read
+    with `pd.read_csv` instead.
+    """
+    with ThreadPoolExecutor(workers or READ_WORKERS) as executor:
+        yield from executor.map(_read_kpi_file, paths)
@@ -0,0 +1,207 @@
+import argparse
+import json
+import mmap
+import os
+import re
+import shutil
+import struct
+import zlib
+
+import jsonlines
+from app.checkpoint import atomic_output
+from app.kpi_files import read_kpi_data, read_kpi_files
+
+MAGIC = b"GCKPACK1"
+FOOTER_STRUCT = struct.Struct("<Q8s")
+PACK_SUFFIX = ".kpipack"
+METRIC_TYPE_PATTERN = re.compile(r"^metric-type-(\d+)(\.kpipack)?$")
+
+
+def write_kpi_pack(pack_path: str, kpi_map_list: list, kpi_paths: list) -> int:
+    """Write the kpi map and KPI files of a metric type to one pack file.
+
+    The file holds the bytes of all KPI files back to back, then a
+    compressed JSON footer with the kpi map and the KPI index, byte offset
+    and length of each block, then the footer length and a magic number.
+    """
+    blocks = []
+    with atomic_output(pack_path, "wb") as fp:
+        fp.write(MAGIC)
+        for kpi_map, kpi_path in zip(kpi_map_list, kpi_paths):
+            with open(kpi_path, "rb") as kpi_fp:
+                data = kpi_fp.read()
+            blocks.append([kpi_map["index"], fp.tell(), len(data)])
+            fp.write(data)
+        footer = zlib.compress(
+            json.dumps({"kpi_map": kpi_map_list, "blocks": blocks}).encode()
+        )
+        fp.write(footer)
+        fp.write(FOOTER_STRUCT.pack(len(footer), MAGIC))
+    return len(blocks)
+
+
+class KpiPackReader:
+    """Random access to the KPI files of a packed metric type through mmap."""
+
+    def __init__(self, pack_path: str):
+        self.pack_path = pack_path
+        with open(pack_path, "rb") as fp:
+            self.buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        footer_length, magic = FOOTER_STRUCT.unpack(self.buffer[-FOOTER_STRUCT.size :])
+        if magic != MAGIC or self.buffer[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{pack_path} is not a KPI pack file!")
+        footer_end = len(self.buffer) - FOOTER_STRUCT.size
+        footer = json.loads(
+            zlib.decompress(self.buffer[footer_end - footer_length : footer_end])
+        )
+        self.kpi_map_list = footer["kpi_map"]
+        self.blocks = {
+            kpi_index: (offset, length)
+            for kpi_index, offset, length in footer["blocks"]
+        }
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+    def close(self):
+        self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read_bytes(self, kpi_index: int) -> bytes:
+        """Raw bytes of the file of one KPI."""
+        offset, length = self.blocks[kpi_index]
+        return self.buffer[offset : offset + length]
+
+    def read_kpi(self, kpi_index: int) -> tuple:
+        """Parse of one KPI as returned by `read_kpi_data`."""
+        offset, length = self.blocks[kpi_index]
+        with memoryview(self.buffer)[offset : offset + length] as data:
+            return read_kpi_data(data)
+
+
+def pack_path_of(metric_type_path: str) -> str:
+    return os.path.normpath(metric_type_path) + PACK_SUFFIX
+
+
+def has_fresh_pack(metric_type_path: str) -> bool:
+    """Check whether a pack exists and is not older than the unpacked kpi map."""
+    pack_path = pack_path_of(metric_type_path)
+    kpi_map_path = os.path.join(metric_type_path, "kpi_map.jsonl")
+    return os.path.exists(pack_path) and (
+        not os.path.exists(kpi_map_path)
+        or os.path.getmtime(pack_path) >= os.path.getmtime(kpi_map_path)
+    )
+
+
+def metric_type_indices(metrics_path: str) -> list:
+    """Indices of the metric types of a GCloud metrics folder in either layout."""
+    metric_indices = []
+    for f in os.listdir(metrics_path):
+        # temporary files of interrupted writes and other entries are ignored
+        match = METRIC_TYPE_PATTERN.match(f)
+        if match and match[1] not in metric_indices:
+            metric_indices.append(match[1])
+    return metric_indices
+
+
+def read_metric_type(metric_type_path: str, workers: int = None) -> tuple:
+    """Read the kpi map and lazily the KPIs of a packed or unpacked metric type.
+
+    Returns the kpi map list and an iterator over the parse of each KPI
+    in kpi map order.
+    """
+    if has_fresh_pack(metric_type_path):
+        reader = KpiPackReader(pack_path_of(metric_type_path))
+
+        def iter_packed_kpis():
+            with reader:
+                for kpi_map in reader.kpi_map_list:
+                    yield reader.read_kpi(kpi_map["index"])
+
+        return reader.kpi_map_list, iter_packed_kpis()
+    with jsonlines.open(os.path.join(metric_type_path, "kpi_map.jsonl")) as reader:
+        kpi_map_list = [obj for obj in reader]
+    kpi_paths = [
+        os.path.join(metric_type_path, f"kpi-{kpi_map['index']}.csv")
+        for kpi_map in kpi_map_list
+    ]
+    return kpi_map_list, read_kpi_files(kpi_paths, workers)
+
+
+def pack_metric_type(metric_type_path: str) -> int:
+    """Pack one metric type folder into a file next to it."""
+    with jsonlines.open(os.path.join(metric_type_path, "kpi_map.jsonl")) as reader:
+        kpi_map_list = [obj for obj in reader]
+    return write_kpi_pack(
+        pack_path_of(metric_type_path),
+        kpi_map_list,
+        [
+            os.path.join(metric_type_path, f"kpi-{kpi_map['index']}.csv")
+            for kpi_map in kpi_map_list
+        ],
+    )
+
+
+def unpack_metric_type(metric_type_path: str) -> int:
+    """Restore the folder of a packed metric type next to its pack."""
+    with KpiPackReader(pack_path_of(metric_type_path)) as reader:
+        os.makedirs(metric_type_path, exist_ok=True)
+        for kpi_map in reader.kpi_map_list:
+            kpi_path = os.path.join(metric_type_path, f"kpi-{kpi_map['index']}.csv")
+            with atomic_output(kpi_path, "wb") as fp:
+                fp.write(reader.read_bytes(kpi_map["index"]))
+        # the kpi map is written last, so that the pack is not seen as stale
+        # by a folder missing some of its KPI files
+        with atomic_output(os.path.join(metric_type_path, "kpi_map.jsonl")) as fp:
+            for kpi_map in reader.kpi_map_list:
+                fp.write(json.dumps(kpi_map) + "\n")
+        return len(reader)
+
+
+def pack_metrics_folder(metrics_path: str, remove: bool = False, force: bool = False):
+    """Pack all metric type folders of a GCloud metrics folder once."""
+    for metric_index in sorted(metric_type_indices(metrics_path), key=int):
+        metric_type_path = os.path.join(metrics_path, f"metric-type-{metric_index}")
+        if not os.path.isdir(metric_type_path):
+            continue
+        if force or not has_fresh_pack(metric_type_path):
+            num_kpis = pack_metric_type(metric_type_path)
+            print(f"Packed metric-type-{metric_index} with {num_kpis} KPIs")
+        if remove:
+            shutil.rmtree(metric_type_path)
+
+
+def unpack_metrics_folder(metrics_path: str):
+    """Unpack all packed metric types of a GCloud metrics folder."""
+    for metric_index in sorted(metric_type_indices(metrics_path), key=int):
+        metric_type_path = os.path.join(metrics_path, f"metric-type-{metric_index}")
+        if os.path.exists(pack_path_of(metric_type_path)):
+            num_kpis = unpack_metric_type(metric_type_path)
+            print(f"Unpacked metric-type-{metric_index} with {num_kpis} KPIs")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pack GCloud metric type folders into indexed files or back"
+    )
+    parser.add_argument("command", choices=["pack", "unpack"])
+    parser.add_argument("metrics_paths", nargs="+")
+    parser.add_argument(
+        "--remove", action="store_true", help="remove folders after packing"
+    )
+    parser.add_argument("--force", action="store_true")
+    args = parser.parse_args()
+    for metrics_path in args.metrics_paths:
+        if args.command == "pack":
+            pack_metrics_folder(metrics_path, args.remove, args.force)
+        else:
+            unpack_metrics_folder(metrics_path)
+
+
+if __name__ == "__main__":
+    main()
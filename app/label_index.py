@@ -0,0 +1,161 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from app.aggregator import Aggregator
+from app.checkpoint import write_json
+
+
+class LabelIndex:
+    """Inverted index from (metric, label, value) to KPI positions.
+
+    Positions refer to the order of KPIs in the combined stores, i.e. the
+    column `value-{position}` of a Prometheus metric or the position of the
+    KPI in the kpi map of a GCloud metric.
+    """
+
+    filename = "label-index.json"
+
+    def __init__(self):
+        self.kpi_ids = {}
+        self.postings = {}
+
+    def add_metric(self, metric_index: int, df_kpi_map: pd.DataFrame):
+        """Index all labels of one metric from its kpi map."""
+        metric_index = int(metric_index)
+        self.kpi_ids[metric_index] = np.asarray(df_kpi_map.index, dtype="int64")
+        label_postings = {}
+        for label in df_kpi_map.columns:
+            values = df_kpi_map[label].reset_index(drop=True).dropna().astype(str)
+            positions = np.asarray(values.index, dtype="int64")
+            label_postings[label] = {
+                value: positions[value_positions]
+                for value, value_positions in values.groupby(values).indices.items()
+            }
+        self.postings[metric_index] = label_postings
+
+    @classmethod
+    def from_kpi_maps(
+        cls,
+        kpi_map_folder_path: str,
+        metric_indices: list,
+        read_kpi_map=Aggregator.read_df_kpi_map,
+    ):
+        """Index the kpi maps of a combined folder read by `read_kpi_map`."""
+        label_index = cls()
+        for metric_index in metric_indices:
+            df_kpi_map = read_kpi_map(metric_index, kpi_map_folder_path)
+            if df_kpi_map is not None:
+                label_index.add_metric(metric_index, df_kpi_map)
+        return label_index
+
+    def _positions(self, metric_index: int, label: str, value) -> np.ndarray:
+        value_postings = self.postings[metric_index].get(label, {})
+        if isinstance(value, (list, tuple, set)):
+            positions = [value_postings.get(str(v)) for v in value]
+            positions = [p for p in positions if p is not None]
+            if not positions:
+                return np.empty(0, dtype="int64")
+            return np.unique(np.concatenate(positions))
+        return value_postings.get(str(value), np.empty(0, dtype="int64"))
+
+    def select(self, metric: int, **labels) -> np.ndarray:
+        """Return positions of KPIs of a metric matching all label predicates.
+
+        A predicate is either a value or a collection of accepted values.
+        """
+        metric = int(metric)
+        positions = np.arange(len(self.kpi_ids[metric]))
+        for label, value in labels.items():
+            positions = np.intersect1d(
+                positions, self._positions(metric, label, value), assume_unique=True
+            )
+        return positions
+
+    def select_ids(self, metric: int, **labels) -> np.ndarray:
+        """Return KPI indices of a metric matching all label predicates."""
+        return self.kpi_ids[int(metric)][self.select(metric, **labels)]
+
+    def group(self, metric: int, label: str, positions: np.ndarray = None) -> dict:
+        """Group KPI positions of a metric by the values of one label."""
+        groups = {}
+        value_postings = self.postings[int(metric)].get(label, {})
+        for value, value_positions in sorted(value_postings.items()):
+            if positions is not None:
+                value_positions = np.intersect1d(
+                    value_positions, positions, assume_unique=True
+                )
+            if len(value_positions):
+                groups[value] = value_positions
+        return groups
+
+    def group_frame(
+        self,
+        metric: int,
+        label: str,
+        kpi_ids: np.ndarray = None,
+        missing: str = None,
+    ) -> pd.DataFrame:
+        """Group KPI indices by one label in the layout of `groupby().agg(index_list)`.
+
+        Only the given KPI indices are grouped if any. KPIs without the label
+        are grouped under `missing` if given, otherwise dropped.
+        """
+        metric = int(metric)
+        if kpi_ids is None:
+            positions = np.arange(len(self.kpi_ids[metric]))
+        else:
+            positions = np.flatnonzero(np.isin(self.kpi_ids[metric], kpi_ids))
+        groups = self.group(metric, label, positions)
+        if missing is not None:
+            labelled = [value_positions for value_positions in groups.values()]
+            if labelled:
+                unlabelled = np.setdiff1d(positions, np.concatenate(labelled))
+            else:
+                unlabelled = np.asarray(positions, dtype="int64")
+            if len(unlabelled):
+                groups[missing] = np.union1d(groups.get(missing, []), unlabelled)
+        values = sorted(groups)
+        return pd.DataFrame(
+            {
+                "index": [
+                    self.kpi_ids[metric][groups[value].astype("int64")].tolist()
+                    for value in values
+                ]
+            },
+            index=pd.Index(values, name=label),
+        )
+
+    def save(self, folder_path: str):
+        index = {
+            str(metric_index): {
+                "ids": self.kpi_ids[metric_index].tolist(),
+                "labels": {
+                    label: {
+                        value: positions.tolist()
+                        for value, positions in value_postings.items()
+                    }
+                    for label, value_postings in self.postings[metric_index].items()
+                },
+            }
+            for metric_index in sorted(self.kpi_ids)
+        }
+        write_json(index, os.path.join(folder_path, LabelIndex.filename))
+
+    @classmethod
+    def load(cls, folder_path: str):
+        with open(os.path.join(folder_path, LabelIndex.filename)) as fp:
+            index = json.load(fp)
+        label_index = cls()
+        for metric_index, metric in index.items():
+            metric_index = int(metric_index)
+            label_index.kpi_ids[metric_index] = np.asarray(metric["ids"], dtype="int64")
+            label_index.postings[metric_index] = {
+                label: {
+                    value: np.asarray(positions, dtype="int64")
+                    for value, positions in value_postings.items()
+                }
+                for label, value_postings in metric["labels"].items()
+            }
+        return label_index
@@ -3,13 +3,17 @@ from scipy.stats import zscore
 import numpy as np
 import pandas as pd
 from app.aggregator import Aggregator
+from app.checkpoint import RunJournal, write_csv
 
 
 class LocustAggregator(Aggregator):
+    source = "locust"
+
     def __init__(
         self,
         metrics_parent_path: str,
         metrics_folder: str,
+        journal: RunJournal = None,
     ):
         self.metrics_parent_path = metrics_parent_path
         self.metrics_path = os.path.join(
@@ -18,8 +22,16 @@ class LocustAggregator(Aggregator):
         self.aggregated_metrics_path = os.path.join(
             metrics_parent_path, metrics_folder, "locust_aggregated_stats.csv"
         )
+        self.journal = journal
 
     def aggregate_all_metrics(self):
+        if self.is_completed("aggregate", "stats"):
+            return
+        write_csv(self.aggregate_stats(), self.aggregated_metrics_path, index=False)
+        self.mark_completed("aggregate", "stats")
+
+    def aggregate_stats(self) -> pd.DataFrame:
+        """Aggregate the Locust stats history per minute."""
         df_stats = pd.read_csv(self.metrics_path)
         df_stats = df_stats[df_stats["Name"] == "Aggregated"].drop(
             columns=[
@@ -56,8 +68,7 @@ class LocustAggregator(Aggregator):
             }
         )
         df_stats.index.rename("timestamp", inplace=True)
-        df_stats = df_stats.add_prefix("lm-").reset_index()
-        df_stats.to_csv(self.aggregated_metrics_path, index=False)
+        return df_stats.add_prefix("lm-").reset_index()
 
     @staticmethod
     def merge_normal_metrics(metrics_parent_path, folders):
@@ -74,7 +85,8 @@ class LocustAggregator(Aggregator):
         complete_df = complete_df[
             (np.abs(zscore(complete_df[["lm-Failures/s", "lm-95%"]])) < 3).all(axis=1)
         ]
-        complete_df.to_csv(
+        write_csv(
+            complete_df,
             os.path.join(metrics_parent_path, "locust_normal_stats.csv"),
             index=False,
         )
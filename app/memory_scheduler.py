@@ -0,0 +1,248 @@
+import json
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import wait
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+from app.kpi_pack import (
+    KpiPackReader,
+    has_fresh_pack,
+    metric_type_indices,
+    pack_path_of,
+)
+
+GIB = 1 << 30
+# per kind (base bytes, bytes per input byte, bytes per series), used until
+# enough measurements of the kind have been recorded
+DEFAULT_MEMORY_MODELS = {
+    "gcloud": (300 << 20, 12.0, 200 << 10),
+    "prometheus": (300 << 20, 6.0, 100 << 10),
+    "locust": (200 << 20, 8.0, 0.0),
+}
+MIN_MEASUREMENTS = 5
+
+
+def count_series_in_file(path: str, token: bytes = b'"metric"') -> int:
+    """Count series in a Prometheus metric file by scanning for their label sets."""
+    count = 0
+    tail = b""
+    with open(path, "rb") as fp:
+        while chunk := fp.read(1 << 24):
+            chunk = tail + chunk
+            count += chunk.count(token)
+            # a token split across chunks is completed by the next chunk
+            tail = chunk[-(len(token) - 1) :]
+    return count
+
+
+def gcloud_task_features(metrics_path: str) -> dict:
+    """Size of the largest metric type, the aggregator holds one at a time."""
+    input_bytes, series = 0, 0
+    for metric_index in metric_type_indices(metrics_path):
+        metric_type_path = os.path.join(metrics_path, f"metric-type-{metric_index}")
+        if has_fresh_pack(metric_type_path):
+            pack_path = pack_path_of(metric_type_path)
+            with KpiPackReader(pack_path) as reader:
+                folder_bytes, num_kpis = os.path.getsize(pack_path), len(reader)
+        else:
+            filenames = os.listdir(metric_type_path)
+            kpi_filenames = [f for f in filenames if f.startswith("kpi-")]
+            folder_bytes = sum(
+                os.path.getsize(os.path.join(metric_type_path, f))
+                for f in kpi_filenames
+            )
+            num_kpis = len(kpi_filenames)
+        if folder_bytes > input_bytes:
+            input_bytes, series = folder_bytes, num_kpis
+    return {"input_bytes": input_bytes, "series": series}
+
+
+def prometheus_task_features(metrics_path: str) -> dict:
+    """Size and series count of the largest metric file."""
+    metric_paths = [
+        os.path.join(metrics_path, f)
+        for f in os.listdir(metrics_path)
+        if f.startswith("metric-") and f.endswith(".json")
+    ]
+    if not metric_paths:
+        return {"input_bytes": 0, "series": 0}
+    largest_path = max(metric_paths, key=os.path.getsize)
+    return {
+        "input_bytes": os.path.getsize(largest_path),
+        "series": count_series_in_file(largest_path),
+    }
+
+
+def locust_task_features(stats_path: str) -> dict:
+    return {"input_bytes": os.path.getsize(stats_path), "series": 0}
+
+
+class MemoryModel:
+    """Linear model of peak memory per task kind fitted on past measurements.
+
+    Measurements are appended as JSON lines to `profile_path`. Estimates are
+    scaled by `safety_factor` to leave room for model error.
+    """
+
+    def __init__(self, profile_path: str = None, safety_factor: float = 1.25):
+        self.profile_path = profile_path
+        self.safety_factor = safety_factor
+        self.coefficients = dict(DEFAULT_MEMORY_MODELS)
+        if profile_path is not None and os.path.exists(profile_path):
+            self.calibrate(MemoryModel.read_measurements(profile_path))
+
+    @staticmethod
+    def read_measurements(profile_path: str) -> list:
+        measurements = []
+        with open(profile_path) as fp:
+            for line in fp:
+                try:
+                    measurements.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return measurements
+
+    def calibrate(self, measurements: list):
+        """Fit base, per byte and per series coefficients of each kind by least squares."""
+        for kind in {m["kind"] for m in measurements}:
+            kind_measurements = [m for m in measurements if m["kind"] == kind]
+            if len(kind_measurements) < MIN_MEASUREMENTS:
+                continue
+            features = np.array(
+                [[1.0, m["input_bytes"], m["series"]] for m in kind_measurements]
+            )
+            peaks = np.array([m["peak_bytes"] for m in kind_measurements], float)
+            coefficients, *_ = np.linalg.lstsq(features, peaks, rcond=None)
+            # negative coefficients do not make sense physically
+            self.coefficients[kind] = tuple(np.clip(coefficients, 0, None).tolist())
+
+    def estimate(self, kind: str, input_bytes: int, series: int) -> float:
+        base, per_byte, per_series = self.coefficients.get(
+            kind, DEFAULT_MEMORY_MODELS["gcloud"]
+        )
+        return self.safety_factor * (
+            base + per_byte * input_bytes + per_series * series
+        )
+
+    def record(self, measurement: dict):
+        if self.profile_path is None:
+            return
+        with open(self.profile_path, "a") as fp:
+            fp.write(json.dumps(measurement) + "\n")
+
+
+def total_memory_bytes() -> int:
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def _peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _current_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as fp:
+            return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return _peak_rss_bytes()
+
+
+def _run_measured(func, args: tuple, connection):
+    """Run a task in its own process and send back its peak memory and time.
+
+    The forked process starts with the resident memory of its parent, which
+    is not counted towards the peak of the task.
+    """
+    inherited = _current_rss_bytes()
+    start = time.perf_counter()
+    try:
+        func(*args)
+        error = None
+    except Exception as e:
+        error = repr(e)
+    try:
+        peak = max(_peak_rss_bytes() - inherited, 0)
+        connection.send((peak, time.perf_counter() - start, error))
+    finally:
+        connection.close()
+
+
+def run_with_memory_budget(
+    tasks: list,
+    memory_budget: float = None,
+    max_processes: int = None,
+    model: MemoryModel = None,
+) -> list:
+    """Run tasks concurrently while the sum of their estimated peaks fits the budget.
+
+    A task is a dict with `name`, `kind`, `func`, `args`, `input_bytes` and
+    `series`. Whenever a worker is free the heaviest pending task that fits
+    is started, so heavy tasks run with few neighbours and light ones are
+    packed densely. A task heavier than the whole budget runs alone. Each
+    task runs in its own process, so a task killed for lack of memory fails
+    alone, and its measured peak is recorded to calibrate later estimates.
+    """
+    model = model or MemoryModel()
+    memory_budget = memory_budget or 0.8 * total_memory_bytes()
+    max_processes = max_processes or os.cpu_count()
+    for task in tasks:
+        task["estimate"] = model.estimate(
+            task["kind"], task["input_bytes"], task["series"]
+        )
+    pending = sorted(tasks, key=lambda task: task["estimate"], reverse=True)
+    running = {}
+    summaries = []
+    while pending or running:
+        reserved = sum(task["estimate"] for task, _, _ in running.values())
+        for task in list(pending):
+            if len(running) >= max_processes:
+                break
+            if reserved + task["estimate"] <= memory_budget or not running:
+                print(
+                    f"Starting {task['name']} with about "
+                    f"{task['estimate'] / GIB:.1f} GiB ..."
+                )
+                receiver, sender = Pipe(duplex=False)
+                process = Process(
+                    target=_run_measured, args=(task["func"], task["args"], sender)
+                )
+                process.start()
+                sender.close()
+                running[process.sentinel] = (task, process, receiver)
+                reserved += task["estimate"]
+                pending.remove(task)
+        for sentinel in wait(list(running)):
+            task, process, receiver = running.pop(sentinel)
+            summary = {
+                "name": task["name"],
+                "kind": task["kind"],
+                "input_bytes": task["input_bytes"],
+                "series": task["series"],
+                "estimate_bytes": int(task["estimate"]),
+                "status": "ok",
+            }
+            try:
+                result = receiver.recv()
+            except EOFError:
+                # killed before reporting, e.g. by the OOM killer
+                result = None
+            process.join()
+            if result is None:
+                summary["status"] = "failed"
+                summary["error"] = f"terminated with exit code {process.exitcode}"
+            else:
+                summary["peak_bytes"], summary["seconds"], error = result
+                if error is None:
+                    model.record(summary)
+                else:
+                    summary["status"] = "failed"
+                    summary["error"] = error
+            if summary["status"] != "ok":
+                print(f"Task {task['name']} failed: {summary['error']}")
+            summaries.append(summary)
+    return summaries
@@ -1,5 +1,8 @@
+import fnmatch
+from multiprocessing import Pool
 import os
-import re
+import time
+import numpy as np
 import pandas as pd
 import json
 from app import (
@@ -7,13 +10,24 @@ from app import (
     EXTRA_EXPERIMENTS_PATH,
     FAILURE_INJECTION_PATH,
     GCLOUD_TARGET_METRICS_PATH,
+    MERGED_DATASET_PATH,
     NORMAL_GCLOUD_METRICS_PATH,
     NORMAL_PATH,
     PROMETHEUS_TARGET_METRICS_PATH,
 )
 import shutil
 from app.aggregator import Aggregator
+from app.checkpoint import RunJournal, atomic_output, write_csv
+from app.column_model import (
+    UNIFIED_PATTERN,
+    concat_level,
+    flatten_columns,
+    parse_columns,
+)
+from app.column_pruning import CHUNK_CELLS, ColumnFingerprints, chunk_rows_of
+from app.dataset_sink import write_merged_dataset
 from app.locust_aggregator import LocustAggregator
+from app.minute_dedup import mean_duplicate_rows
 
 
 def reindex_kpis(
@@ -29,8 +43,10 @@ def reindex_kpis(
         print(f"Processing [{metric_index}/{num_metrics}] {metric_name} ...")
         # create a unified KPI map
         df_unified_kpi_map = pd.DataFrame()
+        df_kpi_maps = []
         for agg_path in aggregated_paths_list:
             df_kpi_map = Aggregator.read_df_kpi_map(metric_index, agg_path)
+            df_kpi_maps.append(df_kpi_map)
             df_unified_kpi_map = pd.concat(
                 [df_unified_kpi_map, df_kpi_map], ignore_index=True
             )
@@ -47,8 +63,11 @@ def reindex_kpis(
             df_kpi = pd.read_csv(
                 os.path.join(agg_path, f"metric-{metric_index}.csv")
             ).set_index("timestamp")
+            df_kpi = df_kpi.loc[:, df_kpi.columns.str.fullmatch(UNIFIED_PATTERN)]
+            df_kpi.columns = parse_columns(df_kpi.columns, UNIFIED_PATTERN)
             unified_df_kpi_list = []
-            for kpi_index, row in df_kpi_map.iterrows():
+            # KPI ids are local to each aggregated folder
+            for kpi_index, row in df_kpi_maps[i].iterrows():
                 rename_candidate_kpi_columns(
                     df_unified_kpi_map, df_kpi, kpi_index, row, unified_df_kpi_list
                 )
@@ -70,23 +89,13 @@ def rename_candidate_kpi_columns(
         df_unified_kpi_map.loc[unified_kpi_map_index] = row
     else:
         unified_kpi_map_index = int(same_row_indices[0])
-    # find candidate columns for renaming
-    candidate_cols = [
-        col
-        for col in df_kpi.columns
-        if col.startswith(f"agg-kpi-{kpi_index}-") or col == f"agg-kpi-{kpi_index}"
-    ]
-    # generate columns for unified KPIs
-    unified_kpi_columns = []
-    for col in candidate_cols:
-        unified_kpi_columns.append(re.sub(r"[0-9]+", str(unified_kpi_map_index), col))
-    df_candidate_kpi = df_kpi[candidate_cols].copy()
-    df_candidate_kpi.rename(
-        columns={
-            candidate_cols[i]: unified_kpi_columns[i]
-            for i in range(len(candidate_cols))
-        },
-        inplace=True,
+    # select columns of the KPI and move them to the unified KPI
+    is_candidate = df_kpi.columns.get_level_values("kpi") == kpi_index
+    df_candidate_kpi = df_kpi.loc[:, is_candidate]
+    df_candidate_kpi.columns = (
+        df_candidate_kpi.columns.remove_unused_levels().set_levels(
+            [unified_kpi_map_index], level="kpi", verify_integrity=False
+        )
     )
     unified_df_kpi_list.append(df_candidate_kpi)
 
@@ -98,10 +107,18 @@ def write_unified_kpi(
 ):
     if not os.path.exists(unified_kpi_path):
         os.mkdir(unified_kpi_path)
-    df_kpi = pd.concat(unified_df_kpi_list, axis=1).sort_index(
-        axis=1, key=lambda x: x.str.extract(r"([0-9]+)", expand=False).astype(int)
+    df_kpi = pd.concat(unified_df_kpi_list, axis=1)
+    df_kpi = df_kpi.iloc[
+        :, np.argsort(df_kpi.columns.get_level_values("kpi"), kind="stable")
+    ]
+    # statistics are optional, KPIs without one are named `agg-kpi-<id>`
+    has_statistic = df_kpi.columns.get_level_values("statistic").notna()
+    df_kpi.columns = np.where(
+        has_statistic,
+        flatten_columns(df_kpi.columns, "agg-kpi-{kpi}-{statistic}"),
+        flatten_columns(df_kpi.columns, "agg-kpi-{kpi}"),
     )
-    df_kpi.to_csv(os.path.join(unified_kpi_path, f"metric-{metric_index}.csv"))
+    write_csv(df_kpi, os.path.join(unified_kpi_path, f"metric-{metric_index}.csv"))
 
 
 def write_unified_kpi_map(
@@ -110,18 +127,26 @@ def write_unified_kpi_map(
     output_folder = os.path.join(unified_path, "kpi-map")
     if not os.path.exists(output_folder):
         os.mkdir(output_folder)
-    df_unified_kpi_map.to_csv(
-        os.path.join(output_folder, f"metric-{metric_index}-kpi-map.csv")
+    write_csv(
+        df_unified_kpi_map,
+        os.path.join(output_folder, f"metric-{metric_index}-kpi-map.csv"),
     )
 
 
+def read_aggregated_metric(metric_path: str) -> pd.DataFrame:
+    """Read an aggregated metric without its serialized quantile sketches."""
+    return pd.read_csv(
+        metric_path, usecols=lambda col: not col.endswith("-sketch")
+    ).set_index("timestamp")
+
+
 def merge_gcloud_prometheus_metrics_in_one_experiment(
     df_gcloud_target_metrics: pd.DataFrame,
     df_prometheus_target_metrics: pd.DataFrame,
     gcloud_metrics_path: str,
     prometheus_metrics_path: str,
 ) -> pd.DataFrame:
-    gcloud_df_list = []
+    gcloud_frames = {}
     metric_types_indices = [
         f.split("-")[-1][:-4]
         for f in os.listdir(gcloud_metrics_path)
@@ -129,18 +154,35 @@ def merge_gcloud_prometheus_metrics_in_one_experiment(
     ]
     for metric_index in metric_types_indices:
         metric_path = os.path.join(gcloud_metrics_path, f"metric-{metric_index}.csv")
-        df_metric = pd.read_csv(metric_path).set_index("timestamp")
-        gcloud_df_list.append(df_metric.add_prefix(f"gm-{metric_index}-"))
-    df_gcloud = pd.concat(gcloud_df_list, axis=1)
-    prometheus_df_list = []
+        gcloud_frames[metric_index] = read_aggregated_metric(metric_path)
+    prometheus_frames = {}
     for metric_index in df_prometheus_target_metrics.index:
         metric_path = os.path.join(
             prometheus_metrics_path, f"metric-{metric_index}.csv"
         )
-        df_metric = pd.read_csv(metric_path).set_index("timestamp")
-        prometheus_df_list.append(df_metric.add_prefix(f"pm-{metric_index}-"))
-    df_prometheus = pd.concat(prometheus_df_list, axis=1)
-    df_gp = pd.concat([df_gcloud, df_prometheus], axis=1)
+        prometheus_frames[metric_index] = read_aggregated_metric(metric_path)
+    return concat_aggregated_metrics(gcloud_frames, prometheus_frames)
+
+
+def concat_aggregated_metrics(
+    gcloud_frames: dict, prometheus_frames: dict
+) -> pd.DataFrame:
+    """Join aggregated metrics by index as `gm-` and `pm-` columns.
+
+    Serialized quantile sketches are dropped.
+    """
+    df_gcloud, df_prometheus = [
+        concat_level(
+            [df.loc[:, ~df.columns.str.endswith("-sketch")] for df in frames.values()],
+            list(frames),
+            ["metric", "name"],
+        )
+        for frames in [gcloud_frames, prometheus_frames]
+    ]
+    df_gp = concat_level(
+        [df_gcloud, df_prometheus], ["gm", "pm"], ["source", "metric", "name"]
+    )
+    df_gp.columns = flatten_columns(df_gp.columns, "{source}-{metric}-{name}")
     df_gp.index = pd.to_datetime(df_gp.index)
     return df_gp
 
@@ -152,13 +194,17 @@ def merge_gcloud_prometheus_in_one_experiment(
     gcloud_df_list = []
     for metric_index in df_gcloud_target_metrics.index:
         metric_path = os.path.join(gcloud_metrics_path, f"metric-{metric_index}.csv")
-        df_metric = pd.read_csv(metric_path).set_index("timestamp")
+        df_metric = read_aggregated_metric(metric_path)
         df_metric.index = pd.to_datetime(df_metric.index)
-        gcloud_df_list.append(df_metric.add_prefix(f"gm-{metric_index}-"))
-    return pd.concat(gcloud_df_list, axis=1).sort_index()
+        gcloud_df_list.append(df_metric)
+    df_gcloud = concat_level(
+        gcloud_df_list, df_gcloud_target_metrics.index.to_list(), ["metric", "name"]
+    )
+    df_gcloud.columns = flatten_columns(df_gcloud.columns, "gm-{metric}-{name}")
+    return df_gcloud.sort_index()
 
 
-def merge_normal_metrics(path: str):
+def merge_normal_metrics(path: str, dataset_path: str = None):
     exp_folders = [folder for folder in os.listdir(path) if folder.startswith("day")]
     gcloud_paths = [
         os.path.join(path, folder, "gcloud_aggregated") for folder in exp_folders
@@ -168,11 +214,7 @@ def merge_normal_metrics(path: str):
     ]
     if len(gcloud_paths) != len(prometheus_paths):
         print("Two paths list have different lengths!")
-    df_gcloud_target_metrics = pd.read_csv(GCLOUD_TARGET_METRICS_PATH).set_index(
-        "index"
-    )
-    df_prometheus_target_metrics = pd.read_csv(PROMETHEUS_TARGET_METRICS_PATH)
-    df_prometheus_target_metrics.index += 1
+    df_gcloud_target_metrics, df_prometheus_target_metrics = read_target_metrics()
     df_gp_list = []
     for i in range(len(gcloud_paths)):
         df_gp_list.append(
@@ -193,110 +235,69 @@ def merge_normal_metrics(path: str):
     )
     df_locust.index = pd.to_datetime(df_locust.index)
     df_complete = df_locust.join(df_gp)
-    if len(df_complete.index) != len(df_complete.index.drop_duplicates()):
-        df_complete = df_complete.groupby("timestamp").agg("mean")
+    df_complete = mean_duplicate_rows(df_complete)
     num_rows = len(df_complete)
     num_columns = len(df_complete.columns)
     print(f"{num_rows} rows x {num_columns} columns")
-    df_complete.sort_index().to_csv(os.path.join(path, "extra_normal_time_series.csv"))
+    write_csv(
+        df_complete.sort_index(), os.path.join(path, "extra_normal_time_series.csv")
+    )
+    if dataset_path is not None:
+        write_merged_dataset(df_complete, dataset_path, os.path.basename(path))
 
 
-def merge_faulty_metrics_from_unified():
-    gcloud_paths = [
-        os.path.join(EXPERIMENTS_PATH, "gcloud_unified", folder)
-        for folder in os.listdir(os.path.join(EXPERIMENTS_PATH, "gcloud_unified"))
-        if folder.startswith("faulty-")
-    ]
-    prometheus_paths = [
-        os.path.join(EXPERIMENTS_PATH, "prometheus_unified", folder)
-        for folder in os.listdir(os.path.join(EXPERIMENTS_PATH, "prometheus_unified"))
-        if folder.startswith("faulty-")
-    ]
-    if len(gcloud_paths) != len(prometheus_paths):
-        print("Two paths list have different lengths!")
-    df_gcloud_target_metrics = pd.read_csv(GCLOUD_TARGET_METRICS_PATH).set_index(
-        "index"
+def read_target_metrics() -> tuple:
+    """Read GCloud and Prometheus target metrics shared by all experiments."""
+    df_gcloud_target_metrics = Aggregator.read_target_metrics_csv(
+        GCLOUD_TARGET_METRICS_PATH
+    ).set_index("index")
+    df_prometheus_target_metrics = Aggregator.read_target_metrics_csv(
+        PROMETHEUS_TARGET_METRICS_PATH
     )
-    df_prometheus_target_metrics = pd.read_csv(PROMETHEUS_TARGET_METRICS_PATH)
     df_prometheus_target_metrics.index += 1
-    for i in range(len(gcloud_paths)):
-        folder = os.path.basename(prometheus_paths[i]).removeprefix("faulty-")
-        print(f"Processing {folder} ...")
-        df_gp = merge_gcloud_prometheus_metrics_in_one_experiment(
-            df_gcloud_target_metrics,
-            df_prometheus_target_metrics,
-            gcloud_paths[i],
-            prometheus_paths[i],
-        )
-        df_locust = pd.read_csv(
-            os.path.join(FAILURE_INJECTION_PATH, folder, "locust_aggregated_stats.csv")
-        ).set_index("timestamp")
-        df_complete = df_gp.join(df_locust, how="inner")
-        if len(df_complete.index) != len(df_complete.index.drop_duplicates()):
-            df_complete = df_complete.groupby("timestamp").agg("mean")
-        num_rows = len(df_complete)
-        num_columns = len(df_complete.columns)
-        print(f"{num_rows} rows x {num_columns} columns")
-        df_complete.to_csv(
-            os.path.join(FAILURE_INJECTION_PATH, folder, f"{folder}.csv")
-        )
+    return df_gcloud_target_metrics, df_prometheus_target_metrics
 
 
-def merge_faulty_metrics_from_aggregated():
-    gcloud_paths = [
-        os.path.join(FAILURE_INJECTION_PATH, folder, "gcloud_aggregated")
-        for folder in os.listdir(FAILURE_INJECTION_PATH)
-        if "userapi" in folder
-    ]
-    prometheus_paths = [
-        os.path.join(FAILURE_INJECTION_PATH, folder, "prometheus_aggregated")
-        for folder in os.listdir(FAILURE_INJECTION_PATH)
-        if "userapi" in folder
-    ]
-    folders = [
-        folder for folder in os.listdir(FAILURE_INJECTION_PATH) if "userapi" in folder
-    ]
-    if len(gcloud_paths) != len(prometheus_paths):
-        print("Two paths list have different lengths!")
-    df_gcloud_target_metrics = pd.read_csv(GCLOUD_TARGET_METRICS_PATH).set_index(
-        "index"
-    )
-    df_prometheus_target_metrics = pd.read_csv(PROMETHEUS_TARGET_METRICS_PATH)
-    df_prometheus_target_metrics.index += 1
-    for i in range(len(gcloud_paths)):
-        folder = folders[i]
-        print(f"Processing {folder} ...")
-        df_gp = merge_gcloud_prometheus_metrics_in_one_experiment(
-            df_gcloud_target_metrics,
-            df_prometheus_target_metrics,
-            gcloud_paths[i],
-            prometheus_paths[i],
-        )
-        df_locust = pd.read_csv(
-            os.path.join(FAILURE_INJECTION_PATH, folder, "locust_aggregated_stats.csv")
-        ).set_index("timestamp")
-        df_locust.index = pd.to_datetime(df_locust.index)
-        df_complete = df_gp.join(df_locust, how="inner")
-        if len(df_complete.index) != len(df_complete.index.drop_duplicates()):
-            df_complete = df_complete.groupby("timestamp").agg("mean")
-        num_rows = len(df_complete)
-        num_columns = len(df_complete.columns)
-        print(f"{num_rows} rows x {num_columns} columns")
-        df_complete.to_csv(
-            os.path.join(FAILURE_INJECTION_PATH, folder, f"{folder}.csv")
-        )
+def select_experiments(selector, parent_path: str = None) -> list:
+    """Select experiment folders by a glob pattern, a log CSV or an explicit list."""
+    if parent_path is None:
+        parent_path = FAILURE_INJECTION_PATH
+    if isinstance(selector, (list, tuple)):
+        return list(selector)
+    if selector.endswith(".csv"):
+        log_path = selector
+        if not os.path.isabs(log_path):
+            log_path = os.path.join(parent_path, selector)
+        return pd.read_csv(log_path)["folder_name"].to_list()
+    return sorted(fnmatch.filter(os.listdir(parent_path), selector))
 
 
-def merge_faulty_metrics_from_one_experiment(exp_name: str):
-    gcloud_path = os.path.join(FAILURE_INJECTION_PATH, exp_name, "gcloud_aggregated")
-    prometheus_path = os.path.join(
-        FAILURE_INJECTION_PATH, exp_name, "prometheus_aggregated"
-    )
-    df_gcloud_target_metrics = pd.read_csv(GCLOUD_TARGET_METRICS_PATH).set_index(
-        "index"
-    )
-    df_prometheus_target_metrics = pd.read_csv(PROMETHEUS_TARGET_METRICS_PATH)
-    df_prometheus_target_metrics.index += 1
+def merge_one_faulty_experiment(
+    folder: str,
+    source: str,
+    df_gcloud_target_metrics: pd.DataFrame,
+    df_prometheus_target_metrics: pd.DataFrame,
+    dataset_path: str = None,
+) -> tuple:
+    """Merge GCloud, Prometheus and Locust metrics of one faulty experiment.
+
+    The merged time series is also written to the Parquet dataset if given.
+    """
+    print(f"Processing {folder} ...")
+    if source == "aggregated":
+        gcloud_path = os.path.join(FAILURE_INJECTION_PATH, folder, "gcloud_aggregated")
+        prometheus_path = os.path.join(
+            FAILURE_INJECTION_PATH, folder, "prometheus_aggregated"
+        )
+    elif source == "unified":
+        gcloud_path = os.path.join(
+            EXPERIMENTS_PATH, "gcloud_unified", f"faulty-{folder}"
+        )
+        prometheus_path = os.path.join(
+            EXPERIMENTS_PATH, "prometheus_unified", f"faulty-{folder}"
+        )
+    else:
+        raise ValueError(f"Unsupported source {source} of faulty metrics!")
     df_gp = merge_gcloud_prometheus_metrics_in_one_experiment(
         df_gcloud_target_metrics,
         df_prometheus_target_metrics,
@@ -304,18 +305,117 @@ def merge_faulty_metrics_from_one_experiment(exp_name: str):
         prometheus_path,
     )
     df_locust = pd.read_csv(
-        os.path.join(FAILURE_INJECTION_PATH, exp_name, "locust_aggregated_stats.csv")
+        os.path.join(FAILURE_INJECTION_PATH, folder, "locust_aggregated_stats.csv")
     ).set_index("timestamp")
     df_locust.index = pd.to_datetime(df_locust.index)
+    return complete_faulty_experiment(folder, df_gp, df_locust, dataset_path)
+
+
+def complete_faulty_experiment(
+    folder: str,
+    df_gp: pd.DataFrame,
+    df_locust: pd.DataFrame,
+    dataset_path: str = None,
+) -> tuple:
+    """Join merged metrics with Locust stats and write the experiment."""
     df_complete = df_gp.join(df_locust, how="inner")
-    if len(df_complete.index) != len(df_complete.index.drop_duplicates()):
-        df_complete = df_complete.groupby("timestamp").agg("mean")
+    df_complete = mean_duplicate_rows(df_complete)
     num_rows = len(df_complete)
     num_columns = len(df_complete.columns)
     print(f"{num_rows} rows x {num_columns} columns")
-    df_complete.to_csv(
-        os.path.join(FAILURE_INJECTION_PATH, exp_name, f"{exp_name}.csv")
+    write_csv(
+        df_complete, os.path.join(FAILURE_INJECTION_PATH, folder, f"{folder}.csv")
+    )
+    if dataset_path is not None:
+        write_merged_dataset(df_complete, dataset_path, folder)
+    return num_rows, num_columns
+
+
+_shared_target_metrics = None
+
+
+def _init_merge_worker(
+    df_gcloud_target_metrics: pd.DataFrame, df_prometheus_target_metrics: pd.DataFrame
+):
+    global _shared_target_metrics
+    _shared_target_metrics = (df_gcloud_target_metrics, df_prometheus_target_metrics)
+
+
+def _merge_faulty_experiment_isolated(
+    folder: str, source: str, dataset_path: str = None
+) -> dict:
+    """Merge one experiment and report its failure instead of raising it."""
+    summary = {"folder": folder, "status": "ok", "rows": 0, "columns": 0}
+    start = time.perf_counter()
+    try:
+        summary["rows"], summary["columns"] = merge_one_faulty_experiment(
+            folder, source, *_shared_target_metrics, dataset_path
+        )
+    except Exception as e:
+        print(f"Failed to merge {folder}: {e!r}")
+        summary["status"] = "failed"
+        summary["error"] = repr(e)
+    summary["seconds"] = round(time.perf_counter() - start, 3)
+    return summary
+
+
+def merge_faulty_experiments(
+    selector,
+    source: str = "aggregated",
+    processes: int = 4,
+    summary_path: str = None,
+    journal: RunJournal = None,
+    dataset_path: str = None,
+) -> pd.DataFrame:
+    """Merge many faulty experiments on a worker pool and write a summary table.
+
+    Experiments already merged according to the journal are skipped.
+    """
+    folders = select_experiments(selector)
+    if journal is not None:
+        folders = [
+            folder
+            for folder in folders
+            if not journal.is_done(folder, source, "merge", "all")
+        ]
+    target_metrics = read_target_metrics()
+    args = [(folder, source, dataset_path) for folder in folders]
+    if processes > 1 and len(folders) > 1:
+        with Pool(processes, _init_merge_worker, target_metrics) as pool:
+            summaries = pool.starmap(_merge_faulty_experiment_isolated, args)
+    else:
+        _init_merge_worker(*target_metrics)
+        summaries = [_merge_faulty_experiment_isolated(*arg) for arg in args]
+    if journal is not None:
+        for summary in summaries:
+            if summary["status"] == "ok":
+                journal.mark_done(summary["folder"], source, "merge", "all")
+    df_summary = pd.DataFrame(
+        summaries, columns=["folder", "status", "rows", "columns", "seconds", "error"]
     )
+    if summary_path is None:
+        summary_path = os.path.join(FAILURE_INJECTION_PATH, "merge-summary.csv")
+    write_csv(df_summary, summary_path, index=False)
+    num_failed = (df_summary["status"] != "ok").sum()
+    print(f"Merged {len(df_summary) - num_failed}/{len(df_summary)} experiments")
+    return df_summary
+
+
+def merge_faulty_metrics_from_unified():
+    folders = [
+        folder.removeprefix("faulty-")
+        for folder in os.listdir(os.path.join(EXPERIMENTS_PATH, "prometheus_unified"))
+        if folder.startswith("faulty-")
+    ]
+    merge_faulty_experiments(folders, source="unified")
+
+
+def merge_faulty_metrics_from_aggregated():
+    merge_faulty_experiments("*userapi*")
+
+
+def merge_faulty_metrics_from_one_experiment(exp_name: str) -> tuple:
+    return merge_one_faulty_experiment(exp_name, "aggregated", *read_target_metrics())
 
 
 def copy_merged_faulty_metrics_for_experiments():
@@ -330,3 +430,72 @@ def copy_merged_faulty_metrics_for_experiments():
             os.path.join(FAILURE_INJECTION_PATH, folder, f"{folder}.csv"),
             os.path.join(dest, f"{folder}.csv"),
         )
+
+
+def read_merged_chunks(path: str, chunk_rows: int):
+    """Read a merged experiment in chunks, floats exactly as they were written."""
+    return pd.read_csv(
+        path, index_col="timestamp", chunksize=chunk_rows, float_precision="round_trip"
+    )
+
+
+def prune_merged_faulty_experiments(
+    selector="*userapi*", mapping_path: str = None, chunk_cells: int = CHUNK_CELLS
+) -> pd.DataFrame:
+    """Drop constant, empty and duplicate columns across merged experiments.
+
+    Columns of all selected experiments are fingerprinted in one pass over
+    their merged CSVs, in chunks of about `chunk_cells` cells of all their
+    columns, so memory does not grow with their length or width. Each
+    experiment is then rewritten chunk-wise without the pruned columns as
+    `<folder>-pruned.csv`.
+    The pruned columns are listed in `mapping_path`.
+    """
+    folders = select_experiments(selector)
+    paths = [
+        os.path.join(FAILURE_INJECTION_PATH, folder, f"{folder}.csv")
+        for folder in folders
+    ]
+    columns = {}
+    for path in paths:
+        columns.update(
+            dict.fromkeys(pd.read_csv(path, index_col="timestamp", nrows=0).columns)
+        )
+    fingerprints = ColumnFingerprints(list(columns))
+    # chunks are reindexed to all columns, so they are sized by those
+    chunk_rows = chunk_rows_of(len(columns), chunk_cells)
+    for folder, path in zip(folders, paths):
+        print(f"Fingerprinting {folder} ...")
+        for df_chunk in read_merged_chunks(path, chunk_rows):
+            fingerprints.update(df_chunk)
+    df_pruned = fingerprints.pruned_columns()
+    print(
+        f"Pruning {len(df_pruned)}/{len(columns)} columns: "
+        f"{df_pruned['reason'].value_counts().to_dict()}"
+    )
+    if mapping_path is None:
+        mapping_path = os.path.join(FAILURE_INJECTION_PATH, "pruned-columns.csv")
+    write_csv(df_pruned, mapping_path, index=False)
+    pruned_columns = set(df_pruned["column"])
+    for folder, path in zip(folders, paths):
+        with atomic_output(
+            os.path.join(FAILURE_INJECTION_PATH, folder, f"{folder}-pruned.csv")
+        ) as fp:
+            for i, df_chunk in enumerate(read_merged_chunks(path, chunk_rows)):
+                df_chunk.drop(
+                    columns=[c for c in df_chunk.columns if c in pruned_columns]
+                ).to_csv(fp, header=i == 0)
+    return df_pruned
+
+
+def export_merged_faulty_metrics_to_dataset(
+    selector="*userapi*", dataset_path: str = MERGED_DATASET_PATH
+):
+    """Write already merged faulty experiments to the partitioned Parquet dataset."""
+    for folder in select_experiments(selector):
+        print(f"Exporting {folder} ...")
+        df_complete = pd.read_csv(
+            os.path.join(FAILURE_INJECTION_PATH, folder, f"{folder}.csv")
+        ).set_index("timestamp")
+        df_complete.index = pd.to_datetime(df_complete.index)
+        write_merged_dataset(df_complete, dataset_path, folder)
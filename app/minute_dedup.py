@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+
+NS_PER_MINUTE = 60 * 10**9
+
+
+def to_minute_keys(timestamps) -> np.ndarray:
+    """Round unix timestamps in seconds to integer minute keys.
+
+    Ties are rounded half to even like `Series.dt.round("min")`.
+    """
+    timestamps = np.asarray(timestamps)
+    if np.issubdtype(timestamps.dtype, np.integer):
+        nanoseconds = timestamps.astype("int64") * 10**9
+    else:
+        nanoseconds = np.round(timestamps.astype("float64") * 10**9).astype("int64")
+    keys, remainders = np.divmod(nanoseconds, NS_PER_MINUTE)
+    half = NS_PER_MINUTE // 2
+    keys += (remainders > half) | ((remainders == half) & (keys % 2 == 1))
+    return keys
+
+
+def minute_keys_to_timestamps(keys: np.ndarray) -> pd.DatetimeIndex:
+    return pd.DatetimeIndex(
+        np.asarray(keys, dtype="int64") * NS_PER_MINUTE, name="timestamp"
+    )
+
+
+def dedup_minutes(series_ids: np.ndarray, keys: np.ndarray, values: np.ndarray):
+    """Average duplicated minutes of many series in one call.
+
+    Returns series ids, minute keys and values sorted by series and minute
+    with one entry per pair. NaN values are skipped like `groupby().mean()`.
+    """
+    series_ids = np.asarray(series_ids, dtype="int64")
+    keys = np.asarray(keys, dtype="int64")
+    values = np.asarray(values, dtype="float64")
+    if len(keys) == 0:
+        return series_ids, keys, values
+    min_key = keys.min()
+    span = keys.max() - min_key + 1
+    combined = series_ids * span + (keys - min_key)
+    # sorted without duplicates, nothing to do
+    if np.all(combined[1:] > combined[:-1]):
+        return series_ids, keys, values
+    order = np.argsort(combined, kind="stable")
+    combined = combined[order]
+    values = values[order]
+    starts = np.concatenate([[0], np.flatnonzero(combined[1:] != combined[:-1]) + 1])
+    isnan = np.isnan(values)
+    sums = np.add.reduceat(np.where(isnan, 0.0, values), starts)
+    counts = np.add.reduceat(~isnan, starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(counts > 0, sums / counts, np.nan)
+    series_ids, keys = np.divmod(combined[starts], span)
+    return series_ids, keys + min_key, means
+
+
+def pivot_minutes(
+    series_ids: np.ndarray, keys: np.ndarray, values: np.ndarray, num_series: int
+):
+    """Scatter deduplicated long-format series into a minutes x series matrix."""
+    unique_keys = np.unique(keys)
+    matrix = np.full((len(unique_keys), num_series), np.nan)
+    matrix[np.searchsorted(unique_keys, keys), series_ids] = values
+    return unique_keys, matrix
+
+
+def mean_duplicate_rows(df: pd.DataFrame) -> pd.DataFrame:
+    """Average rows with the same timestamp in a wide frame in one pass."""
+    if df.index.is_unique:
+        return df
+    codes, uniques = pd.factorize(df.index, sort=True)
+    order = np.argsort(codes, kind="stable")
+    codes = codes[order]
+    values = df.to_numpy(dtype="float64")[order]
+    starts = np.concatenate([[0], np.flatnonzero(codes[1:] != codes[:-1]) + 1])
+    isnan = np.isnan(values)
+    sums = np.add.reduceat(np.where(isnan, 0.0, values), starts, axis=0)
+    counts = np.add.reduceat(~isnan, starts, axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(counts > 0, sums / counts, np.nan)
+    return pd.DataFrame(means, index=uniques.rename(df.index.name), columns=df.columns)
@@ -1,22 +1,282 @@
+from functools import cached_property
 import json
 import os
+import re
 import warnings
+import numpy as np
 import pandas as pd
 from app.aggregator import Aggregator
+from app.checkpoint import RunJournal, atomic_output, write_csv
+from app.column_model import flatten_columns, kpi_ids
+from app.csv_writer import formatted_index
+from app.label_index import LabelIndex
+from app.minute_dedup import dedup_minutes, minute_keys_to_timestamps, to_minute_keys
+from app.quantile_sketch import sketch_rows
+from app.rollup import sufficient_statistics
+from app.series_chunks import (
+    ChunkedMetricReader,
+    chunks_path_of,
+    has_fresh_chunks,
+    label_predicates,
+    match_labels,
+)
+from app.sparse_frame import SparseFrame, as_dense, remove_sparse
+
+RESULT_ARRAY_PATTERN = re.compile(r'"result"\s*:\s*\[')
+RESULT_TYPE_PATTERN = re.compile(r'"resultType"\s*:\s*"([^"]*)"')
 
 
 class Metric:
-    def __init__(self, name: str, data):
-        self.metric_name = name
-        self.metric_items = []
+    """Columnar collection of the series of one metric.
+
+    Minute keys and values of all series are stored back to back in two
+    contiguous arrays, `offsets[i]:offsets[i + 1]` delimits series `i`.
+    Labels are stored as a table of codes into per-label value lists.
+    """
+
+    def __init__(self, name: str, data, **labels):
+        self._init_empty(name)
         if self.check_data(data):
             if type(data) is dict:
-                for item in data["result"]:
-                    if item["values"]:
-                        self.metric_items.append(MetricItem(item))
+                predicates = label_predicates(**labels)
+                result_items = [item for item in data["result"] if item["values"]]
+                self.dropped_keys = Metric.unique_keys(
+                    [
+                        Metric.result_item_keys(item)
+                        for item in result_items
+                        if not match_labels(item["metric"], predicates)
+                    ]
+                )
+                self._load_result_items(
+                    [
+                        item
+                        for item in result_items
+                        if match_labels(item["metric"], predicates)
+                    ]
+                )
             elif type(data) is list:
-                self.metric_items = data
-        self.num_metric_items = len(self.metric_items)
+                self._load_metric_items(data)
+        self.num_metric_items = len(self.offsets) - 1
+
+    def _init_empty(self, name: str):
+        self.metric_name = name
+        self.keys = np.empty(0, dtype="int64")
+        self.values = np.empty(0, dtype="float64")
+        self.offsets = np.zeros(1, dtype="int64")
+        self.label_names = []
+        self.label_values = []
+        self.label_codes = np.empty((0, 0), dtype="int32")
+        # minutes of series dropped by label predicates, kept so that the
+        # combined series cover the same minutes as without predicates
+        self.dropped_keys = np.empty(0, dtype="int64")
+
+    @staticmethod
+    def unique_keys(keys_list: list) -> np.ndarray:
+        if not keys_list:
+            return np.empty(0, dtype="int64")
+        return np.unique(np.concatenate(keys_list))
+
+    @staticmethod
+    def result_item_keys(result_item: dict) -> np.ndarray:
+        """Minute keys of a raw series without parsing its values."""
+        timestamps = np.array(
+            [sample[0] for sample in result_item["values"]], dtype="float64"
+        )
+        return to_minute_keys(timestamps.astype("int64"))
+
+    @classmethod
+    def from_series(cls, name: str, series) -> "Metric":
+        """Build a metric from (labels, minute keys, values) of each series."""
+        metric = cls.__new__(cls)
+        metric._init_empty(name)
+        metadata_list, keys_list, values_list = [], [], []
+        for labels, keys, values in series:
+            metadata_list.append(labels)
+            keys_list.append(keys)
+            values_list.append(values)
+        if metadata_list:
+            metric._set_series(
+                metadata_list,
+                np.repeat(
+                    np.arange(len(metadata_list)), [len(keys) for keys in keys_list]
+                ),
+                np.concatenate(keys_list),
+                np.concatenate(values_list),
+            )
+        metric.num_metric_items = len(metric.offsets) - 1
+        return metric
+
+    @classmethod
+    def from_chunks(cls, name: str, chunks_path: str, **labels) -> "Metric":
+        """Read a metric from a chunked file, only series matching the labels."""
+        with ChunkedMetricReader(chunks_path) as reader:
+            if not labels:
+                return cls.from_series(name, reader.iter_series())
+            positions = reader.select(**labels)
+            metric = cls.from_series(name, reader.iter_series(positions))
+            dropped = np.setdiff1d(np.arange(len(reader)), positions)
+            metric.dropped_keys = Metric.unique_keys(
+                [reader.read_keys(position) for position in dropped]
+            )
+            return metric
+
+    @classmethod
+    def iter_items(
+        cls,
+        name: str,
+        metric_path: str,
+        use_chunks: bool = True,
+        dropped_keys: list = None,
+        **labels,
+    ):
+        """Lazily yield the series of a metric file one at a time as views.
+
+        Only one raw series is decoded at a time, so memory does not grow
+        with the size of the JSON file. A fresh chunked file of the metric
+        is read instead of the JSON dump if there is one. Values of series
+        not matching the label predicates are never decoded, their minute
+        keys are appended to `dropped_keys` if given.
+        """
+        predicates = label_predicates(**labels)
+        if use_chunks and has_fresh_chunks(metric_path):
+            with ChunkedMetricReader(chunks_path_of(metric_path)) as reader:
+                for position, series_labels in enumerate(reader.labels):
+                    if match_labels(series_labels, predicates):
+                        series = (series_labels, *reader.read_series(position))
+                        yield MetricItem(cls.from_series(name, [series]), 0)
+                    elif dropped_keys is not None:
+                        dropped_keys.append(reader.read_keys(position))
+            return
+        for result_item in Metric.iter_result_items(name, metric_path):
+            if not result_item["values"]:
+                continue
+            if match_labels(result_item["metric"], predicates):
+                metric = cls(name, {"resultType": "matrix", "result": [result_item]})
+                yield MetricItem(metric, 0)
+            elif dropped_keys is not None:
+                dropped_keys.append(Metric.result_item_keys(result_item))
+
+    @staticmethod
+    def iter_result_items(name: str, metric_path: str, chunk_size: int = 1 << 20):
+        """Incrementally decode the items of the result array of a metric file."""
+        decoder = json.JSONDecoder()
+        read_size = chunk_size
+        with open(metric_path) as fp:
+            buffer = ""
+            position = None
+            eof = False
+            # locate the start of the result array
+            while position is None:
+                match = RESULT_ARRAY_PATTERN.search(buffer)
+                if match:
+                    result_type = RESULT_TYPE_PATTERN.search(buffer[: match.start()])
+                    if result_type and result_type[1] != "matrix":
+                        print(f"The format of input data is not supported in {name}!")
+                        return
+                    position = match.end()
+                elif eof:
+                    print(f"Empty results in {name}!")
+                    return
+                else:
+                    chunk = fp.read(chunk_size)
+                    eof = not chunk
+                    buffer += chunk
+            while True:
+                while position < len(buffer) and buffer[position] in " \t\r\n,":
+                    position += 1
+                if position < len(buffer) and buffer[position] == "]":
+                    return
+                try:
+                    if position == len(buffer):
+                        raise json.JSONDecodeError("Incomplete item", buffer, position)
+                    item, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if eof:
+                        print(f"{name} in {metric_path} cannot be decoded!")
+                        return
+                    chunk = fp.read(read_size)
+                    eof = not chunk
+                    # drop consumed items and grow reads for very large items
+                    buffer = buffer[position:] + chunk
+                    position = 0
+                    read_size *= 2
+                    continue
+                position = end
+                read_size = chunk_size
+                yield item
+
+    def _load_result_items(self, result_items: list):
+        """Parse all series of a metric and average duplicated minutes in one call."""
+        lengths = [len(item["values"]) for item in result_items]
+        bounds = np.cumsum([0] + lengths)
+        timestamps = np.empty(bounds[-1], dtype="float64")
+        values = np.empty(bounds[-1], dtype="float64")
+        for i, item in enumerate(result_items):
+            samples = np.array(item["values"])
+            timestamps[bounds[i] : bounds[i + 1]] = samples[:, 0].astype("float64")
+            values[bounds[i] : bounds[i + 1]] = samples[:, 1].astype("float64")
+        series_ids = np.repeat(np.arange(len(result_items)), lengths)
+        self._set_series(
+            [item["metric"] for item in result_items],
+            series_ids,
+            to_minute_keys(timestamps.astype("int64")),
+            values,
+        )
+
+    def _load_metric_items(self, metric_items: list):
+        self._set_series(
+            [item.metadata for item in metric_items],
+            np.repeat(
+                np.arange(len(metric_items)), [len(item) for item in metric_items]
+            ),
+            np.concatenate([item.keys for item in metric_items]),
+            np.concatenate([item.value_array for item in metric_items]),
+        )
+
+    def _set_series(
+        self,
+        metadata_list: list,
+        series_ids: np.ndarray,
+        keys: np.ndarray,
+        values: np.ndarray,
+    ):
+        series_ids, self.keys, self.values = dedup_minutes(series_ids, keys, values)
+        self.offsets = np.searchsorted(series_ids, np.arange(len(metadata_list) + 1))
+        # encode labels as codes into per-label value lists
+        label_positions = {}
+        value_codes = []
+        codes = []
+        for metadata in metadata_list:
+            series_codes = {}
+            for label, value in metadata.items():
+                if label not in label_positions:
+                    label_positions[label] = len(self.label_names)
+                    self.label_names.append(label)
+                    self.label_values.append([])
+                    value_codes.append({})
+                position = label_positions[label]
+                if value not in value_codes[position]:
+                    value_codes[position][value] = len(self.label_values[position])
+                    self.label_values[position].append(value)
+                series_codes[position] = value_codes[position][value]
+            codes.append(series_codes)
+        self.label_codes = np.full(
+            (len(metadata_list), len(self.label_names)), -1, dtype="int32"
+        )
+        for i, series_codes in enumerate(codes):
+            self.label_codes[i, list(series_codes)] = list(series_codes.values())
+
+    @cached_property
+    def metric_items(self) -> list:
+        """Views of all series, built once since callers index into them."""
+        return [MetricItem(self, i) for i in range(self.num_metric_items)]
+
+    def get_metadata(self, position: int) -> dict:
+        return {
+            self.label_names[j]: self.label_values[j][code]
+            for j, code in enumerate(self.label_codes[position])
+            if code >= 0
+        }
 
     def check_data(self, data) -> bool:
         if not data:
@@ -34,10 +294,9 @@ class Metric:
             else:
                 return True
         elif type(data) is list:
-            for item in data:
-                if type(item) is not MetricItem:
-                    print(f"The type of {item} is not supported in metric collection!")
-                    return False
+            if not all(type(item) is MetricItem for item in data):
+                print("The type of items is not supported in metric collection!")
+                return False
             return True
         else:
             print(f"The type of {data} is not supported in metric data!")
@@ -45,27 +304,57 @@ class Metric:
 
 
 class MetricItem:
-    def __init__(self, result_item: dict):
-        self.metadata = result_item["metric"]
-        self.values = pd.DataFrame(
-            result_item["values"], columns=["timestamp", "value"]
-        ).astype({"timestamp": "int64", "value": "float64"})
-        self.values["timestamp"] = pd.to_datetime(
-            self.values["timestamp"], unit="s"
-        ).dt.round("min")
-        if len(self.values["timestamp"]) != len(
-            self.values["timestamp"].drop_duplicates()
-        ):
-            self.values = self.values.groupby("timestamp").agg("mean").reset_index()
+    """Lightweight view of one series in a columnar `Metric`."""
+
+    __slots__ = ("metric", "position")
+
+    def __init__(self, metric: Metric, position: int):
+        self.metric = metric
+        self.position = position
+
+    def __len__(self) -> int:
+        return int(
+            self.metric.offsets[self.position + 1] - self.metric.offsets[self.position]
+        )
+
+    @property
+    def metadata(self) -> dict:
+        return self.metric.get_metadata(self.position)
+
+    @property
+    def keys(self) -> np.ndarray:
+        start, end = self.metric.offsets[self.position : self.position + 2]
+        return self.metric.keys[start:end]
+
+    @property
+    def value_array(self) -> np.ndarray:
+        start, end = self.metric.offsets[self.position : self.position + 2]
+        return self.metric.values[start:end]
+
+    @property
+    def values(self) -> pd.DataFrame:
+        return pd.DataFrame(
+            {
+                "timestamp": minute_keys_to_timestamps(self.keys),
+                "value": self.value_array,
+            }
+        )
 
 
 class PrometheusAggregator(Aggregator):
+    source = "prometheus"
+
     def __init__(
         self,
         metrics_parent_path: str,
         metrics_folder: str,
         target_metrics_path: str,
         output_suffix: str = "",
+        per_second_rates: bool = False,
+        sketch_accuracy: float = None,
+        persist_statistics: bool = False,
+        journal: RunJournal = None,
+        sparse_fill_ratio: float = None,
     ):
         self.metrics_path = os.path.join(metrics_parent_path, metrics_folder)
         self.merged_submetrics_path = os.path.join(
@@ -77,12 +366,23 @@ class PrometheusAggregator(Aggregator):
         self.complete_time_series_path = os.path.join(
             metrics_parent_path, f"prometheus-complete-time-series{output_suffix}.csv"
         )
-        self.target_metrics = pd.read_csv(target_metrics_path)
+        self.target_metrics = self.read_target_metrics_csv(target_metrics_path)
         self.target_metrics.index += 1
+        self.per_second_rates = per_second_rates
+        self.sketch_accuracy = sketch_accuracy
+        self.persist_statistics = persist_statistics
+        self.statistics_path = os.path.join(
+            metrics_parent_path, "prometheus_statistics" + output_suffix
+        )
+        self.journal = journal
+        self.sparse_fill_ratio = sparse_fill_ratio
+        self._label_index = None
         if not os.path.exists(self.merged_submetrics_path):
             os.mkdir(self.merged_submetrics_path)
         if not os.path.exists(self.aggregated_metrics_path):
             os.mkdir(self.aggregated_metrics_path)
+        if persist_statistics and not os.path.exists(self.statistics_path):
+            os.mkdir(self.statistics_path)
 
     def _get_metric_index(self, metric_name: str):
         """Get metric index in metric names map."""
@@ -91,55 +391,250 @@ class PrometheusAggregator(Aggregator):
             metric_names_map = list(json.load(fp).values())
         return metric_names_map.index(metric_name) + 1
 
+    @staticmethod
+    def series_filters(metric_name: str) -> dict:
+        """Label predicates of the series aggregated for a metric family.
+
+        Only KPIs in the alms namespace are aggregated, metrics adapted
+        without aggregation also keep series without a namespace. Other
+        series are dropped while reading.
+        """
+        if (
+            metric_name in ["ALERTS", "ALERTS_FOR_STATE"]
+            or metric_name.startswith("container")
+            or metric_name.startswith("kube")
+        ):
+            return {"namespace": "alms"}
+        if (
+            metric_name.startswith("namespace")
+            or metric_name.startswith(":node")
+            or metric_name.startswith("node:")
+        ):
+            return {"namespace": ["alms", None]}
+        return {}
+
     def _get_metric(self, metric_name: str) -> Metric:
-        metric_index = self._get_metric_index(metric_name)
-        metric_path = os.path.join(
-            self.metrics_path, f"metric-{metric_index}-day-1.json"
-        )
+        metric_path = self._get_metric_path(metric_name)
+        labels = PrometheusAggregator.series_filters(metric_name)
+        if has_fresh_chunks(metric_path):
+            return Metric.from_chunks(
+                metric_name, chunks_path_of(metric_path), **labels
+            )
         metric_data = None
         try:
             with open(metric_path) as fp:
                 metric_data = json.load(fp)
         except json.JSONDecodeError as e:
             print(f"{metric_name} in {self.metrics_path} cannot be decoded!")
-        return Metric(metric_name, metric_data)
+        return Metric(metric_name, metric_data, **labels)
 
     def _read_df_kpi(self, metric_index: int, metric_name: str):
-        df_kpi = pd.read_csv(
-            os.path.join(self.merged_submetrics_path, f"metric-{metric_index}.csv")
+        """Read the combined series of a metric, dense or as a `SparseFrame`.
+
+        Columns are identified by their integer KPI ids.
+        """
+        df_kpi = self.input_combined(
+            metric_index,
+            os.path.join(self.merged_submetrics_path, f"metric-{metric_index}.csv"),
         )
-        df_kpi["timestamp"] = pd.to_datetime(df_kpi["timestamp"])
-        df_kpi = df_kpi.set_index("timestamp").sort_index()
+        df_kpi = df_kpi.set_axis(kpi_ids(df_kpi.columns), axis=1)
         if metric_name.endswith("total") or metric_name.startswith("node_vmstat"):
-            df_kpi = df_kpi.apply(Aggregator.reduce_cumulative)
+            if isinstance(df_kpi, SparseFrame):
+                return df_kpi.reduce_cumulative(self.per_second_rates)
+            df_kpi = Aggregator.reduce_cumulative_frame(df_kpi, self.per_second_rates)
         return df_kpi
 
-    def merge_all_submetrics(self):
+    def _get_metric_path(self, metric_name: str) -> str:
+        metric_index = self._get_metric_index(metric_name)
+        return os.path.join(self.metrics_path, f"metric-{metric_index}-day-1.json")
+
+    def _write_combined_lazily(
+        self, metric_index: int, metric_name: str, block_rows: int = 256
+    ) -> pd.DataFrame:
+        """Stream series of a metric into the combined file and return its kpi map.
+
+        Only compact minute keys and values of each series are kept, so peak
+        memory grows with the number of samples of the metric, 16 bytes each,
+        instead of its minutes times its series as a dense frame. Rows of the
+        combined file are formatted in blocks of `block_rows` minutes. Metrics
+        filled below `sparse_fill_ratio` are saved as a `SparseFrame` instead,
+        as are all metrics when fused and handed to `output_combined`.
+        """
+        kpi_map_list = []
+        keys_list = []
+        values_list = []
+        dropped_keys = []
+        metric_path = self._get_metric_path(metric_name)
+        labels = PrometheusAggregator.series_filters(metric_name)
+        for item in Metric.iter_items(
+            metric_name, metric_path, dropped_keys=dropped_keys, **labels
+        ):
+            kpi_map_list.append(item.metadata)
+            keys_list.append(item.keys)
+            values_list.append(item.value_array)
+        if not kpi_map_list:
+            return pd.DataFrame()
+        unique_keys = Metric.unique_keys(keys_list + dropped_keys)
+        timestamps = minute_keys_to_timestamps(unique_keys)
+        columns = [f"value-{i}" for i in range(len(kpi_map_list))]
+        combined_path = os.path.join(
+            self.merged_submetrics_path, f"metric-{metric_index}.csv"
+        )
+        num_points = sum(len(keys) for keys in keys_list)
+        shape = (len(unique_keys), len(columns))
+        if self.fused or (
+            self.sparse_fill_ratio is not None
+            and SparseFrame.fill_ratio_of(num_points, shape) < self.sparse_fill_ratio
+        ):
+            self.output_combined(
+                metric_index,
+                SparseFrame.from_minutes(
+                    np.repeat(np.arange(len(columns)), [len(k) for k in keys_list]),
+                    np.concatenate(keys_list),
+                    np.concatenate(values_list),
+                    columns,
+                    unique_keys,
+                ),
+                combined_path,
+            )
+            return pd.DataFrame(kpi_map_list)
+        # formatted once, pandas picks the datetime format from all timestamps
+        index = formatted_index(pd.DataFrame(index=timestamps), {})
+        with atomic_output(combined_path) as fp:
+            for start in range(0, len(unique_keys), block_rows):
+                block_keys = unique_keys[start : start + block_rows]
+                block = np.full((len(block_keys), len(columns)), np.nan)
+                for i in range(len(columns)):
+                    keys = keys_list[i]
+                    lo = np.searchsorted(keys, block_keys[0])
+                    hi = np.searchsorted(keys, block_keys[-1], side="right")
+                    rows = np.searchsorted(block_keys, keys[lo:hi])
+                    block[rows, i] = values_list[i][lo:hi]
+                pd.DataFrame(
+                    block,
+                    index=index[start : start + block_rows],
+                    columns=columns,
+                ).to_csv(fp, header=start == 0)
+        remove_sparse(combined_path)
+        return pd.DataFrame(kpi_map_list)
+
+    def merge_one_metric(
+        self, metric_index: int, metric_name: str, lazy: bool = False
+    ) -> pd.DataFrame:
+        """Write the combined series of one metric and return its kpi map."""
+        if lazy:
+            return self._write_combined_lazily(metric_index, metric_name)
+        metric = self._get_metric(metric_name)
+        kpi_map_list = []  # contains each metadata from metric items
+        metric_items_df_list = []  # contains each dataframe from metric items
+        for i, item in enumerate(metric.metric_items):
+            metric_items_df_list.append(
+                item.values.set_index("timestamp").add_suffix(f"-{i}")
+            )
+            kpi_map_list.append(item.metadata)
+        if not kpi_map_list:
+            return pd.DataFrame()
+        df_kpi = pd.concat(metric_items_df_list, axis=1)
+        if len(metric.dropped_keys):
+            df_kpi = df_kpi.reindex(
+                df_kpi.index.union(minute_keys_to_timestamps(metric.dropped_keys))
+            )
+        self.output_combined(
+            metric_index,
+            df_kpi,
+            os.path.join(self.merged_submetrics_path, f"metric-{metric_index}.csv"),
+        )
+        return pd.DataFrame(kpi_map_list)
+
+    def merge_all_submetrics(self, lazy: bool = False):
+        """Merge the series of each metric into one dataframe.
+
+        With `lazy` the metric files are decoded one series at a time instead
+        of being loaded as a whole.
+        """
         print(f"merge {self.metrics_path}")
-        num_metrics = len(self.target_metrics)
+        label_index = LabelIndex()
         for metric_index in self.target_metrics.index:
-            metric_name = self.target_metrics.loc[metric_index]["name"]
+            self._merge_and_index(metric_index, label_index, lazy)
+        label_index.save(self.merged_submetrics_path)
+        self._label_index = label_index
+
+    def _merge_and_index(
+        self, metric_index: int, label_index: LabelIndex, lazy: bool = False
+    ):
+        """Merge one metric unless journaled and add its kpi map to the index."""
+        metric_name = self.target_metrics.loc[metric_index]["name"]
+        kpi_map_path = os.path.join(
+            self.merged_submetrics_path, f"metric-{metric_index}-kpi-map.csv"
+        )
+        if self.is_completed("merge", metric_index):
+            if not os.path.exists(kpi_map_path):
+                return
+            df_kpi_map = pd.read_csv(kpi_map_path)
+        else:
+            num_metrics = len(self.target_metrics)
             print(f"Processing {metric_index}/{num_metrics} {metric_name} ...")
-            metric = self._get_metric(metric_name)
-            kpi_map_list = []  # contains each metadata from metric items
-            metric_items_df_list = []  # contains each dataframe from metric items
-            for i in range(metric.num_metric_items):
-                item = metric.metric_items[i]
-                metric_items_df_list.append(
-                    item.values.set_index("timestamp").add_suffix(f"-{i}")
+            df_kpi_map = self.merge_one_metric(metric_index, metric_name, lazy)
+            if df_kpi_map.empty:
+                # all series filtered out, there is nothing to aggregate
+                print(f"No series of {metric_name} left to merge")
+                if os.path.exists(kpi_map_path):
+                    os.remove(kpi_map_path)
+                self.mark_completed("merge", metric_index)
+                return
+            write_csv(df_kpi_map, kpi_map_path, index=False)
+            self.mark_completed("merge", metric_index)
+        label_index.add_metric(metric_index, df_kpi_map)
+
+    def run_fused(self, intermediate_writer=None) -> dict:
+        """Merge and aggregate metric by metric, handing frames over in memory.
+
+        Series are decoded lazily. Only kpi maps and the label index are
+        written, other intermediate files are left to `intermediate_writer`
+        if given. Returns the aggregated frames by metric index.
+        """
+        print(f"merge and aggregate {self.metrics_path}")
+        self.start_fused(intermediate_writer)
+        self._label_index = LabelIndex()
+        for metric_index in self.target_metrics.index:
+            self._merge_and_index(metric_index, self._label_index, lazy=True)
+            if metric_index in self.combined_frames:
+                self.aggregate_one_metric(metric_index)
+        self._label_index.save(self.merged_submetrics_path)
+        return self.aggregated_frames
+
+    @staticmethod
+    def read_kpi_map(metric_index: int, kpi_map_folder_path: str) -> pd.DataFrame:
+        """Read a Prometheus kpi map, written without an index column."""
+        kpi_map_path = os.path.join(
+            kpi_map_folder_path, f"metric-{metric_index}-kpi-map.csv"
+        )
+        if os.path.exists(kpi_map_path):
+            return pd.read_csv(kpi_map_path)
+
+    @property
+    def label_index(self) -> LabelIndex:
+        """Label index of the combined metrics, built from kpi maps if not persisted."""
+        if self._label_index is None:
+            if os.path.exists(
+                os.path.join(self.merged_submetrics_path, LabelIndex.filename)
+            ):
+                self._label_index = LabelIndex.load(self.merged_submetrics_path)
+            else:
+                self._label_index = LabelIndex.from_kpi_maps(
+                    self.merged_submetrics_path,
+                    self.target_metrics.index,
+                    PrometheusAggregator.read_kpi_map,
                 )
-                kpi_map_list.append(item.metadata)
-            df_kpi_map = pd.DataFrame(kpi_map_list)
-            df_kpi = pd.concat(metric_items_df_list, axis=1)
-            df_kpi_map.to_csv(
-                os.path.join(
-                    self.merged_submetrics_path, f"metric-{metric_index}-kpi-map.csv"
-                ),
-                index=False,
-            )
-            df_kpi.to_csv(
-                os.path.join(self.merged_submetrics_path, f"metric-{metric_index}.csv")
-            )
+        return self._label_index
+
+    def _select_alms_kpis(
+        self, metric_index: int, df_kpi_map: pd.DataFrame, df_kpi: pd.DataFrame
+    ) -> tuple:
+        """Keep only KPIs in the alms namespace."""
+        alms_kpi_ids = self.label_index.select_ids(metric_index, namespace="alms")
+        df_kpi = df_kpi[list(alms_kpi_ids)]
+        return df_kpi_map.loc[alms_kpi_ids], df_kpi
 
     def aggregate_one_metric(self, metric_index: int):
         metric_name = self.target_metrics.loc[metric_index]["name"]
@@ -174,17 +669,10 @@ class PrometheusAggregator(Aggregator):
     ):
         # ALERTS contain only counts of alerts
         # drop KPIs with namespace not alms
-        useless_kpi_indices = df_kpi_map[df_kpi_map["namespace"] != "alms"].index
-        for i in useless_kpi_indices:
-            df_kpi.drop(columns=f"value-{i}", inplace=True)
-        df_kpi_map = df_kpi_map.drop(useless_kpi_indices)
-        # create group columns for aggregation
-        group_columns = ["container"]
-        df_kpi_map["container"] = df_kpi_map["container"].fillna("undefined")
-        df_kpi_map = df_kpi_map[group_columns]
-        # group indices by labels
-        df_kpi_indices_to_agg = (
-            df_kpi_map.reset_index().groupby(group_columns).agg(Aggregator.index_list)
+        df_kpi_map, df_kpi = self._select_alms_kpis(metric_index, df_kpi_map, df_kpi)
+        # group indices by container
+        df_kpi_indices_to_agg = self.label_index.group_frame(
+            metric_index, "container", df_kpi_map.index, missing="undefined"
         )
         self.aggregate(
             metric_index,
@@ -198,19 +686,12 @@ class PrometheusAggregator(Aggregator):
     ):
         # ALERTS_FOR_STATE contain only timestamps of alerts
         # drop KPIs with namespace not alms
-        useless_kpi_indices = df_kpi_map[df_kpi_map["namespace"] != "alms"].index
-        for i in useless_kpi_indices:
-            df_kpi.drop(columns=f"value-{i}", inplace=True)
-        df_kpi_map = df_kpi_map.drop(useless_kpi_indices)
+        df_kpi_map, df_kpi = self._select_alms_kpis(metric_index, df_kpi_map, df_kpi)
         # transform df_kpi to boolean values according to timestamps in values
         df_kpi = df_kpi.notnull().astype("int")
-        # create group columns for aggregation
-        group_columns = ["container"]
-        df_kpi_map["container"] = df_kpi_map["container"].fillna("undefined")
-        df_kpi_map = df_kpi_map[group_columns]
-        # group indices by labels
-        df_kpi_indices_to_agg = (
-            df_kpi_map.reset_index().groupby(group_columns).agg(Aggregator.index_list)
+        # group indices by container
+        df_kpi_indices_to_agg = self.label_index.group_frame(
+            metric_index, "container", df_kpi_map.index, missing="undefined"
         )
         self.aggregate(
             metric_index,
@@ -223,24 +704,23 @@ class PrometheusAggregator(Aggregator):
         self, metric_index: int, df_kpi_map: pd.DataFrame, df_kpi: pd.DataFrame
     ):
         # drop KPIs with namespace not alms
-        useless_kpi_indices = df_kpi_map[df_kpi_map["namespace"] != "alms"].index
-        for i in useless_kpi_indices:
-            df_kpi.drop(columns=f"value-{i}", inplace=True)
-        df_kpi_map = df_kpi_map.drop(useless_kpi_indices)
-        # create group columns for aggregation
+        df_kpi_map, df_kpi = self._select_alms_kpis(metric_index, df_kpi_map, df_kpi)
+        # group indices by labels
         if "container" in df_kpi_map:
-            group_columns = ["container"]
-            df_kpi_map = df_kpi_map[group_columns]
+            df_kpi_indices_to_agg = self.label_index.group_frame(
+                metric_index, "container", df_kpi_map.index
+            )
         elif "pod" in df_kpi_map:
             df_kpi_map["pod_service"] = df_kpi_map["pod"].str.extract(r"(alms[-a-z]+)-")
             group_columns = ["pod_service"]
-            df_kpi_map = df_kpi_map[group_columns]
+            df_kpi_indices_to_agg = (
+                df_kpi_map[group_columns]
+                .reset_index()
+                .groupby(group_columns)
+                .agg(Aggregator.index_list)
+            )
         else:
             print(f"\tNo labels can be aggregated!")
-        # group indices by labels
-        df_kpi_indices_to_agg = (
-            df_kpi_map.reset_index().groupby(group_columns).agg(Aggregator.index_list)
-        )
         self.aggregate(
             metric_index,
             df_kpi_indices_to_agg,
@@ -284,10 +764,7 @@ class PrometheusAggregator(Aggregator):
         self, metric_index: int, df_kpi_map: pd.DataFrame, df_kpi: pd.DataFrame
     ):
         # drop KPIs with namespace not alms
-        useless_kpi_indices = df_kpi_map[df_kpi_map["namespace"] != "alms"].index
-        for i in useless_kpi_indices:
-            df_kpi.drop(columns=f"value-{i}", inplace=True)
-        df_kpi_map = df_kpi_map.drop(useless_kpi_indices)
+        df_kpi_map, df_kpi = self._select_alms_kpis(metric_index, df_kpi_map, df_kpi)
         # drop useless labels
         is_singleton_label = df_kpi_map.nunique() == 1
         df_kpi_map = df_kpi_map.drop(
@@ -324,17 +801,23 @@ class PrometheusAggregator(Aggregator):
     ):
         # drop KPIs with namespace not alms
         if "namespace" in df_kpi_map.columns:
-            useless_kpi_indices = df_kpi_map[df_kpi_map["namespace"] != "alms"].index
-            for i in useless_kpi_indices:
-                df_kpi.drop(columns=f"value-{i}", inplace=True)
+            df_kpi_map, df_kpi = self._select_alms_kpis(
+                metric_index, df_kpi_map, df_kpi
+            )
         if len(df_kpi.columns) > 1:
             print(
                 f"Adaptation should only apply to metric with only one column! Metric {metric_index} has more than one column!"
             )
+        df_kpi = as_dense(df_kpi)
+        df_kpi = df_kpi.set_axis(flatten_columns(df_kpi.columns, "value-{kpi}"), axis=1)
         df_kpi.rename(columns={df_kpi.columns[0]: "value"}, inplace=True)
         if not df_kpi.empty:
-            df_kpi.to_csv(
-                os.path.join(self.aggregated_metrics_path, f"metric-{metric_index}.csv")
+            self.output_aggregated(
+                metric_index,
+                df_kpi,
+                os.path.join(
+                    self.aggregated_metrics_path, f"metric-{metric_index}.csv"
+                ),
             )
 
     def aggregate(
@@ -345,6 +828,8 @@ class PrometheusAggregator(Aggregator):
         aggregate_funcs: list,
     ):
         df_agg_list = []
+        df_statistics_list = []
+        column_prefixes = []
         df_kpi_indices_to_agg = df_kpi_indices_to_agg.rename(
             columns={"index": "index_list"}
         ).reset_index()
@@ -353,26 +838,34 @@ class PrometheusAggregator(Aggregator):
             column_prefix = df_kpi_indices_to_agg[
                 df_kpi_indices_to_agg.drop(columns="index_list").columns[0]
             ].loc[i]
-            indices_in_df_kpi = [
-                int(column.removeprefix("value-"))
-                for column in df_kpi.columns.to_list()
-            ]
             valid_indices = list(
-                set(df_kpi_indices_to_agg.loc[i]["index_list"]) & set(indices_in_df_kpi)
+                set(df_kpi_indices_to_agg.loc[i]["index_list"]) & set(df_kpi.columns)
             )
-            columns_to_agg = [f"value-{i}" for i in valid_indices]
-            df_metric_to_agg = df_kpi[columns_to_agg]
+            df_metric_to_agg = df_kpi[valid_indices]
             with warnings.catch_warnings():
                 warnings.simplefilter("ignore", category=RuntimeWarning)
-                df_metric_agg = df_metric_to_agg.agg(
-                    aggregate_funcs, axis=1
-                ).add_prefix(column_prefix + "-")
+                df_metric_agg = df_metric_to_agg.agg(aggregate_funcs, axis=1)
+            # quantiles can be combined across days from mergeable sketches
+            if self.sketch_accuracy and Aggregator.first_quartile in aggregate_funcs:
+                df_metric_agg["sketch"] = sketch_rows(
+                    as_dense(df_metric_to_agg), self.sketch_accuracy
+                )
             df_agg_list.append(df_metric_agg)
-        df_complete_agg = pd.concat(df_agg_list, axis=1)
-        if not df_complete_agg.empty:
-            df_complete_agg.to_csv(
-                os.path.join(self.aggregated_metrics_path, f"metric-{metric_index}.csv")
+            column_prefixes.append(column_prefix)
+            if self.persist_statistics:
+                df_statistics_list.append(
+                    sufficient_statistics(as_dense(df_metric_to_agg))
+                )
+        df_complete = Aggregator.join_groups(df_agg_list, column_prefixes)
+        if not df_complete.empty:
+            self.output_aggregated(
+                metric_index,
+                df_complete,
+                os.path.join(
+                    self.aggregated_metrics_path, f"metric-{metric_index}.csv"
+                ),
             )
+        self.write_statistics(metric_index, df_statistics_list, column_prefixes)
 
     def aggregate_all_metrics(self):
         """Aggregate all available metrics to reduce dimensionality."""
@@ -383,11 +876,14 @@ class PrometheusAggregator(Aggregator):
         ]
         metric_indices.sort()
         for metric_index in metric_indices:
+            if self.is_completed("aggregate", metric_index):
+                continue
             self.aggregate_one_metric(metric_index)
+            self.mark_completed("aggregate", metric_index)
 
     def merge_metrics(self):
         """Merge all metrics into one dataframe."""
-        df_all_list = []
+        metric_paths = {}
         metric_indices = [
             filename.removeprefix("metric-").removesuffix("-kpi-map.json")
             for filename in os.listdir(self.aggregated_metrics_path)
@@ -396,13 +892,11 @@ class PrometheusAggregator(Aggregator):
         metric_indices.sort()
         for metric_index in metric_indices:
             print(f"Processing metric {metric_index} ...")
-            metric_path = os.path.join(
+            metric_paths[metric_index] = os.path.join(
                 self.aggregated_metrics_path, f"metric-{metric_index}.csv"
             )
-            df_metric = pd.read_csv(metric_path).set_index("timestamp")
-            df_all_list.append(df_metric.add_prefix(f"metric-{metric_index}-"))
-        df_all = pd.concat(df_all_list, axis=1)
+        df_all = Aggregator.merge_metric_files(metric_paths)
         num_cols = len(df_all.columns)
         num_rows = len(df_all)
         print(f"{num_rows} rows x {num_cols} columns")
-        df_all.to_csv(self.complete_time_series_path)
+        write_csv(df_all, self.complete_time_series_path)
@@ -0,0 +1,224 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class QuantileSketch:
+    """Mergeable DDSketch-style quantile sketch with bounded relative error.
+
+    Values are counted in logarithmic buckets, so any quantile is estimated
+    within `relative_accuracy` of an exact value. Merging two sketches adds
+    their bucket counts, which makes merging associative and commutative.
+    Infinite values, such as the `+Inf` bucket bounds of Prometheus, are
+    counted apart and only returned by the extreme quantiles.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.positive = {}
+        self.negative = {}
+        self.zero_count = 0
+        self.positive_inf_count = 0
+        self.negative_inf_count = 0
+
+    @property
+    def count(self) -> int:
+        return (
+            sum(self.positive.values())
+            + sum(self.negative.values())
+            + self.zero_count
+            + self.positive_inf_count
+            + self.negative_inf_count
+        )
+
+    @staticmethod
+    def keys(values: np.ndarray, relative_accuracy: float) -> np.ndarray:
+        """Map absolute values to bucket keys."""
+        gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.ceil(np.log(np.abs(values)) / np.log(gamma))
+
+    def add(self, values: np.ndarray):
+        values = np.asarray(values, dtype="float64")
+        values = values[~np.isnan(values)]
+        self.zero_count += int(np.count_nonzero(values == 0))
+        self.positive_inf_count += int(np.count_nonzero(values == np.inf))
+        self.negative_inf_count += int(np.count_nonzero(values == -np.inf))
+        values = values[np.isfinite(values)]
+        for store, selected in [
+            (self.positive, values[values > 0]),
+            (self.negative, values[values < 0]),
+        ]:
+            keys, counts = np.unique(
+                QuantileSketch.keys(selected, self.relative_accuracy),
+                return_counts=True,
+            )
+            for key, count in zip(keys.astype("int64").tolist(), counts.tolist()):
+                store[key] = store.get(key, 0) + count
+
+    def merge(self, other: "QuantileSketch"):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Sketches with different accuracies cannot be merged!")
+        for store, other_store in [
+            (self.positive, other.positive),
+            (self.negative, other.negative),
+        ]:
+            for key, count in other_store.items():
+                store[key] = store.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.positive_inf_count += other.positive_inf_count
+        self.negative_inf_count += other.negative_inf_count
+        return self
+
+    def _bucket_value(self, key: int) -> float:
+        return 2 * self.gamma**key / (self.gamma + 1)
+
+    def quantile(self, q: float) -> float:
+        count = self.count
+        if count == 0:
+            return np.nan
+        rank = q * (count - 1)
+        seen = self.negative_inf_count
+        if seen > rank:
+            return -np.inf
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._bucket_value(key)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._bucket_value(key)
+        return np.inf
+
+    def serialize(self) -> str:
+        """Serialize as `accuracy|zero count|positive buckets|negative buckets`.
+
+        Counts of `+inf` and `-inf` are appended as two more fields when any.
+        """
+        fields = [
+            repr(self.relative_accuracy),
+            str(self.zero_count),
+            ",".join(f"{k}:{c}" for k, c in sorted(self.positive.items())),
+            ",".join(f"{k}:{c}" for k, c in sorted(self.negative.items())),
+        ]
+        if self.positive_inf_count or self.negative_inf_count:
+            fields += [str(self.positive_inf_count), str(self.negative_inf_count)]
+        return "|".join(fields)
+
+    @classmethod
+    def deserialize(cls, serialized: str) -> "QuantileSketch":
+        accuracy, zero_count, positive, negative, *inf_counts = serialized.split("|")
+        sketch = cls(float(accuracy))
+        sketch.zero_count = int(zero_count)
+        if inf_counts:
+            sketch.positive_inf_count, sketch.negative_inf_count = map(int, inf_counts)
+        for store, buckets in [
+            (sketch.positive, positive),
+            (sketch.negative, negative),
+        ]:
+            for bucket in filter(None, buckets.split(",")):
+                key, count = bucket.split(":")
+                store[int(key)] = int(count)
+        return sketch
+
+
+def sketch_rows(df: pd.DataFrame, relative_accuracy: float = 0.01) -> pd.Series:
+    """Build one serialized sketch per row of a group of KPIs.
+
+    Bucket keys of the whole block are computed at once and counted with a
+    single `np.unique` over (row, sign, key) codes, infinite values get the
+    signs -2 and 2. Rows without values get NaN.
+    """
+    values = df.to_numpy(dtype="float64")
+    rows, cols = np.nonzero(~np.isnan(values))
+    observed = values[rows, cols]
+    signs = np.sign(observed).astype("int64")
+    infinite = np.isinf(observed)
+    signs[infinite] *= 2
+    keyed = (signs != 0) & ~infinite
+    keys = np.zeros(len(observed), dtype="int64")
+    keys[keyed] = QuantileSketch.keys(observed[keyed], relative_accuracy)
+    sketches = pd.Series(np.nan, index=df.index, dtype="object")
+    if len(observed) == 0:
+        return sketches
+    unique_codes, counts = np.unique(
+        np.stack([rows, signs, keys], axis=1), axis=0, return_counts=True
+    )
+    bounds = np.searchsorted(unique_codes[:, 0], np.arange(len(df) + 1))
+    accuracy = repr(relative_accuracy)
+    observed_rows = np.unique(unique_codes[:, 0])
+    serialized = []
+    for row in observed_rows:
+        start, end = bounds[row], bounds[row + 1]
+        row_signs = unique_codes[start:end, 1]
+        row_keys = unique_codes[start:end, 2]
+        row_counts = counts[start:end]
+        buckets = {}
+        for sign in [1, -1]:
+            selected = row_signs == sign
+            buckets[sign] = ",".join(
+                f"{k}:{c}"
+                for k, c in zip(
+                    row_keys[selected].tolist(), row_counts[selected].tolist()
+                )
+            )
+        zero_count = int(row_counts[row_signs == 0].sum())
+        sketch = f"{accuracy}|{zero_count}|{buckets[1]}|{buckets[-1]}"
+        inf_counts = [int(row_counts[row_signs == sign].sum()) for sign in [2, -2]]
+        if any(inf_counts):
+            sketch += f"|{inf_counts[0]}|{inf_counts[1]}"
+        serialized.append(sketch)
+    sketches.iloc[observed_rows] = serialized
+    return sketches
+
+
+def merge_sketches(serialized_sketches) -> QuantileSketch:
+    """Merge serialized sketches, NaN entries are skipped."""
+    merged = None
+    for serialized in serialized_sketches:
+        if not isinstance(serialized, str):
+            continue
+        sketch = QuantileSketch.deserialize(serialized)
+        merged = sketch if merged is None else merged.merge(sketch)
+    return merged if merged is not None else QuantileSketch()
+
+
+def read_sketches(aggregated_paths: list, metric_index: int) -> pd.DataFrame:
+    """Read sketch columns of one metric from several aggregated folders."""
+    df_list = []
+    for aggregated_path in aggregated_paths:
+        metric_path = os.path.join(aggregated_path, f"metric-{metric_index}.csv")
+        df_metric = pd.read_csv(metric_path).set_index("timestamp")
+        df_metric.index = pd.to_datetime(df_metric.index)
+        sketch_columns = [col for col in df_metric.columns if col.endswith("-sketch")]
+        df_list.append(df_metric[sketch_columns])
+    return pd.concat(df_list).sort_index()
+
+
+def combine_sketch_quantiles(
+    df_sketches: pd.DataFrame,
+    quantiles: tuple = (0.25, 0.5, 0.75),
+    freq: str = None,
+) -> pd.DataFrame:
+    """Estimate quantiles over all sketch columns, per time bucket if `freq` is given.
+
+    Partial results of days, experiments or groups are combined by merging
+    their sketches, the raw inputs are not needed.
+    """
+    if freq is None:
+        buckets = [(None, df_sketches)]
+    else:
+        buckets = df_sketches.groupby(df_sketches.index.floor(freq))
+    rows = {}
+    for bucket, df_bucket in buckets:
+        sketch = merge_sketches(df_bucket.to_numpy().ravel())
+        rows[bucket] = [sketch.quantile(q) for q in quantiles]
+    return pd.DataFrame.from_dict(
+        rows, orient="index", columns=[f"percentile_{int(q * 100)}" for q in quantiles]
+    )
@@ -0,0 +1,251 @@
+import os
+import tempfile
+import warnings
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.stats import rankdata
+from app.checkpoint import write_csv
+from app.column_pruning import CHUNK_CELLS, chunk_rows_of
+from app.dataset_sink import COLUMN_PREFIXES
+
+BLOCK_COLUMNS = 512
+REDUNDANCY_THRESHOLD = 0.95
+CORRELATION_METHODS = ("pearson", "spearman")
+# variances of standardized values below this, per pair of valid values,
+# are rounding noise of constant columns
+VARIANCE_EPSILON = 1e-12
+
+
+def columns_to_memmap(chunks, columns: list, num_rows: int, path: str) -> np.memmap:
+    """Copy row chunks of a dataset into a column-major float64 memmap file."""
+    values = np.lib.format.open_memmap(
+        path,
+        mode="w+",
+        dtype="float64",
+        shape=(num_rows, len(columns)),
+        fortran_order=True,
+    )
+    start = 0
+    for df_chunk in chunks:
+        stop = start + len(df_chunk)
+        values[start:stop] = df_chunk.reindex(columns=columns).to_numpy(dtype="float64")
+        start = stop
+    if start != num_rows:
+        raise ValueError(f"Expected {num_rows} rows but read {start}!")
+    return values
+
+
+def standardize_columns(values: np.ndarray, method: str = "pearson"):
+    """Standardize the columns of a 2D array in place, NaN values are kept.
+
+    Spearman replaces the values of each column by their ranks first. Constant
+    columns become zeros.
+    """
+    if method == "spearman":
+        values[:] = rankdata(values, axis=0, nan_policy="omit")
+    elif method != "pearson":
+        raise ValueError(f"Unsupported correlation method {method}!")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        means = np.nan_to_num(np.nanmean(values, axis=0))
+        scales = np.nan_to_num(np.nanstd(values, axis=0))
+    scales[scales == 0] = 1.0
+    values -= means
+    values /= scales
+
+
+def _load_block(values: np.ndarray, start: int, stop: int) -> tuple:
+    block = np.array(values[:, start:stop])
+    mask = ~np.isnan(block)
+    block[~mask] = 0.0
+    return block, mask.astype("float64")
+
+
+def block_correlation(
+    x: np.ndarray,
+    mask_x: np.ndarray,
+    y: np.ndarray,
+    mask_y: np.ndarray,
+    min_periods: int = 2,
+) -> np.ndarray:
+    """Pairwise complete correlations between the columns of two blocks.
+
+    NaN values are zeros in `x` and `y` and flagged by 0 in their masks, so
+    that the sums over the rows valid in both columns of each pair are
+    matrix products. Pairs with fewer than `min_periods` common values or a
+    constant column among them are NaN.
+    """
+    counts = mask_x.T @ mask_y
+    sums_x = x.T @ mask_y
+    sums_y = mask_x.T @ y
+    with np.errstate(invalid="ignore", divide="ignore"):
+        covariances = x.T @ y - sums_x * sums_y / counts
+        variances_x = (x * x).T @ mask_y - sums_x * sums_x / counts
+        variances_y = mask_x.T @ (y * y) - sums_y * sums_y / counts
+        correlations = covariances / np.sqrt(variances_x * variances_y)
+    correlations[
+        (counts < max(min_periods, 2))
+        | ~(variances_x > counts * VARIANCE_EPSILON)
+        | ~(variances_y > counts * VARIANCE_EPSILON)
+    ] = np.nan
+    return np.clip(correlations, -1.0, 1.0)
+
+
+def correlated_column_clusters(
+    values: np.ndarray,
+    columns: list,
+    method: str = "pearson",
+    threshold: float = REDUNDANCY_THRESHOLD,
+    block_columns: int = BLOCK_COLUMNS,
+    min_periods: int = 2,
+) -> pd.DataFrame:
+    """Cluster columns whose absolute correlation reaches `threshold`.
+
+    `values` is standardized in place, then correlated block by block of
+    `block_columns` columns, so that only two blocks and their correlations
+    are held in memory at once. Clusters are the connected components of
+    the graph of correlated pairs. Spearman ranks each column over all its
+    values, which differs from pandas in the ranks of pairs with NaN.
+
+    Each cluster keeps as representative the column with the most values,
+    then the most correlated columns.
+    """
+    num_columns = values.shape[1]
+    for start in range(0, num_columns, block_columns):
+        stop = min(start + block_columns, num_columns)
+        block = np.array(values[:, start:stop])
+        standardize_columns(block, method)
+        values[:, start:stop] = block
+    counts = np.zeros(num_columns, dtype="int64")
+    degrees = np.zeros(num_columns, dtype="int64")
+    max_correlations = np.full(num_columns, np.nan)
+    edges = []
+    starts = range(0, num_columns, block_columns)
+    for start_x in starts:
+        stop_x = min(start_x + block_columns, num_columns)
+        print(f"Correlating columns {start_x}-{stop_x} of {num_columns} ...")
+        x, mask_x = _load_block(values, start_x, stop_x)
+        counts[start_x:stop_x] = mask_x.sum(axis=0)
+        for start_y in starts:
+            if start_y < start_x:
+                continue
+            stop_y = min(start_y + block_columns, num_columns)
+            if start_y == start_x:
+                y, mask_y = x, mask_x
+            else:
+                y, mask_y = _load_block(values, start_y, stop_y)
+            correlations = np.abs(block_correlation(x, mask_x, y, mask_y, min_periods))
+            if start_y == start_x:
+                np.fill_diagonal(correlations, np.nan)
+            max_correlations[start_x:stop_x] = np.fmax(
+                max_correlations[start_x:stop_x], np.fmax.reduce(correlations, axis=1)
+            )
+            adjacent = correlations >= threshold
+            degrees[start_x:stop_x] += adjacent.sum(axis=1)
+            if start_y != start_x:
+                max_correlations[start_y:stop_y] = np.fmax(
+                    max_correlations[start_y:stop_y],
+                    np.fmax.reduce(correlations, axis=0),
+                )
+                degrees[start_y:stop_y] += adjacent.sum(axis=0)
+            rows, cols = np.nonzero(adjacent)
+            if len(rows) == 0:
+                continue
+            # keep only a spanning forest of the block, not all its pairs
+            num_x = stop_x - start_x
+            nodes = np.concatenate(
+                [np.arange(start_x, stop_x), np.arange(start_y, stop_y)]
+            )
+            block_graph = coo_matrix(
+                (np.ones(len(rows)), (rows, cols + num_x)),
+                shape=(len(nodes), len(nodes)),
+            )
+            _, labels = connected_components(block_graph, directed=False)
+            _, first_positions = np.unique(labels, return_index=True)
+            roots = nodes[first_positions[labels]]
+            linked = roots != nodes
+            edges.append(np.stack([roots[linked], nodes[linked]]))
+    edges = np.concatenate(edges, axis=1) if edges else np.zeros((2, 0), dtype="int64")
+    graph = coo_matrix(
+        (np.ones(edges.shape[1]), (edges[0], edges[1])),
+        shape=(num_columns, num_columns),
+    )
+    _, clusters = connected_components(graph, directed=False)
+    df_clusters = pd.DataFrame(
+        {
+            "column": columns,
+            "count": counts,
+            "degree": degrees,
+            "max_correlation": max_correlations,
+            "cluster": clusters,
+        }
+    )
+    df_clusters["cluster_size"] = df_clusters.groupby("cluster")["column"].transform(
+        "size"
+    )
+    representatives = (
+        df_clusters.sort_values(["count", "degree"], ascending=False, kind="stable")
+        .groupby("cluster")["column"]
+        .first()
+    )
+    df_clusters["representative"] = df_clusters["cluster"].map(representatives)
+    df_clusters["keep"] = df_clusters["column"] == df_clusters["representative"]
+    return df_clusters
+
+
+def gen_redundancy_analysis(
+    merged_path: str,
+    output_path: str,
+    method: str = "pearson",
+    threshold: float = REDUNDANCY_THRESHOLD,
+    block_columns: int = BLOCK_COLUMNS,
+    chunk_cells: int = CHUNK_CELLS,
+    min_periods: int = 2,
+    column_prefixes: tuple = COLUMN_PREFIXES,
+) -> pd.DataFrame:
+    """Cluster correlated columns of a merged time series file.
+
+    The file is read in chunks of about `chunk_cells` cells into a temporary
+    column-major memmap next to `output_path`, so memory stays bounded by
+    the blocks being correlated. The clusters and representative columns
+    are written to `output_path`.
+    """
+    print(f"Analyzing redundancy of {merged_path} ...")
+    columns = [
+        column
+        for column in pd.read_csv(merged_path, index_col="timestamp", nrows=0).columns
+        if column.startswith(tuple(column_prefixes))
+    ]
+    num_rows = sum(
+        len(df_chunk)
+        for df_chunk in pd.read_csv(
+            merged_path, usecols=["timestamp"], chunksize=chunk_cells
+        )
+    )
+    print(f"{num_rows} rows x {len(columns)} columns")
+    with tempfile.TemporaryDirectory(
+        dir=os.path.dirname(os.path.abspath(output_path))
+    ) as tmp_path:
+        values = columns_to_memmap(
+            pd.read_csv(
+                merged_path,
+                index_col="timestamp",
+                usecols=["timestamp"] + columns,
+                chunksize=chunk_rows_of(len(columns), chunk_cells),
+                float_precision="round_trip",
+            ),
+            columns,
+            num_rows,
+            os.path.join(tmp_path, "values.npy"),
+        )
+        df_clusters = correlated_column_clusters(
+            values, columns, method, threshold, block_columns, min_periods
+        )
+        del values
+    num_kept = df_clusters["keep"].sum()
+    print(f"Keeping {num_kept}/{len(columns)} representative columns")
+    write_csv(df_clusters, output_path, index=False)
+    return df_clusters
@@ -0,0 +1,250 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+from app.checkpoint import write_csv
+
+ROLLING_WINDOWS = (5, 15, 60)
+ROLLING_STATISTICS = ("mean", "std", "min", "max", "rate")
+SUPPORTED_STATISTICS = ROLLING_STATISTICS + ("counter_rate",)
+# cells of a block of columns, its intermediate arrays stay in the CPU cache
+BLOCK_CELLS = 1 << 15
+MIN_BLOCK_COLUMNS = 8
+
+
+def _cumulative(values: np.ndarray) -> np.ndarray:
+    """Cumulative sums along rows with a leading row of zeros."""
+    cumulative = np.zeros((len(values) + 1, values.shape[1]))
+    np.cumsum(values, axis=0, out=cumulative[1:])
+    return cumulative
+
+
+def _cumulative_sums(values: np.ndarray, mask: np.ndarray):
+    """Compute cumulative sums, sums of squares and counts shared by all windows."""
+    # center columns to keep cumulative sums of squares numerically stable
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        offsets = np.nan_to_num(np.nanmean(values, axis=0))
+    centered = values - offsets
+    centered[~mask] = 0.0
+    cum_sum = _cumulative(centered)
+    cum_sq = _cumulative(np.multiply(centered, centered, out=centered))
+    cum_count = _cumulative(mask)
+    return cum_sum, cum_sq, cum_count, offsets
+
+
+def _window_difference(cumulative: np.ndarray, window: int) -> np.ndarray:
+    """Turn a cumulative sum into moving sums over the trailing window."""
+    moving = np.empty((len(cumulative) - 1, cumulative.shape[1]))
+    moving[:window] = cumulative[1 : window + 1]
+    np.subtract(cumulative[window + 1 :], cumulative[1:-window], out=moving[window:])
+    return moving
+
+
+def _window_extremes(values: np.ndarray, windows: tuple, func) -> dict:
+    """Compute moving min or max of several windows by doubling spans.
+
+    Extremes over spans of 1, 2, 4, ... rows are built from the previous span
+    and a copy shifted by it, then each window combines the largest span not
+    longer than it with a shifted copy, in O(n log w) contiguous operations.
+    """
+    fill = np.inf if func is np.minimum else -np.inf
+    spans = {1 << (window.bit_length() - 1) for window in windows}
+    extremes = np.where(np.isnan(values), fill, values)
+    span_extremes = {1: extremes}
+    span = 1
+    while span * 2 <= max(windows):
+        previous = extremes
+        extremes = np.empty_like(previous)
+        extremes[:span] = previous[:span]
+        func(previous[span:], previous[:-span], out=extremes[span:])
+        if span not in spans:
+            del span_extremes[span]
+        span *= 2
+        span_extremes[span] = extremes
+    results = {}
+    for window in windows:
+        span = 1 << (window.bit_length() - 1)
+        extremes = span_extremes[span]
+        shift = window - span
+        if shift == 0:
+            results[window] = extremes.copy()
+            continue
+        result = np.empty_like(extremes)
+        result[:shift] = extremes[:shift]
+        func(extremes[shift:], extremes[:-shift], out=result[shift:])
+        results[window] = result
+    return results
+
+
+def _valid_positions(mask: np.ndarray) -> tuple:
+    """Row of the last valid value up to each row and of the first from it on."""
+    num_rows = len(mask)
+    rows = np.arange(num_rows)[:, np.newaxis]
+    last = np.maximum.accumulate(np.where(mask, rows, -1), axis=0)
+    first = np.minimum.accumulate(np.where(mask, rows, num_rows)[::-1], axis=0)[::-1]
+    return last, np.ascontiguousarray(first)
+
+
+def _gather_rows(values: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    return np.take_along_axis(values, np.clip(rows, 0, len(values) - 1), axis=0)
+
+
+def _window_rate(
+    last_values: np.ndarray,
+    first_values: np.ndarray,
+    last: np.ndarray,
+    first: np.ndarray,
+    window: int,
+) -> np.ndarray:
+    """Per second change between the first and last valid values of each window.
+
+    The values at the last valid row up to each row and at the first valid
+    row from each row on do not depend on the window, so windows only shift
+    the latter by their length.
+    """
+    shift = min(window - 1, len(first))
+    start_values = np.empty_like(first_values)
+    start_values[:shift] = first_values[0]
+    start_values[shift:] = first_values[: len(first_values) - shift]
+    start_rows = np.empty_like(first)
+    start_rows[:shift] = first[0]
+    start_rows[shift:] = first[: len(first) - shift]
+    result = np.subtract(last_values, start_values)
+    seconds = np.subtract(last, start_rows, dtype="float64")
+    seconds *= 60
+    result /= seconds
+    # windows with less than two valid values have no rate
+    np.copyto(result, np.nan, where=start_rows >= last)
+    return result
+
+
+def _counter_increases(values: np.ndarray, last: np.ndarray) -> np.ndarray:
+    """Running increase of counters, a drop is a reset that starts from zero."""
+    previous_rows = np.empty_like(last)
+    previous_rows[0] = -1
+    previous_rows[1:] = last[:-1]
+    previous = _gather_rows(values, previous_rows)
+    increases = values - previous
+    resets = increases < 0
+    increases[resets] = values[resets]
+    increases[np.isnan(increases) | (previous_rows < 0)] = 0.0
+    return np.cumsum(increases, axis=0)
+
+
+def rolling_statistics(
+    values: np.ndarray,
+    windows: tuple = ROLLING_WINDOWS,
+    statistics: tuple = ROLLING_STATISTICS,
+    min_periods: int = 1,
+) -> dict:
+    """Compute window statistics of all columns of a 2D array at once.
+
+    Windows are row based and NaN values are ignored, a window yields NaN
+    when it holds fewer than `min_periods` valid values. `rate` is the
+    per second change between the first and last valid values of a window,
+    `counter_rate` the same for counters, whose drops are resets. Results
+    are keyed by `(window, statistic)`.
+    """
+    unsupported = set(statistics) - set(SUPPORTED_STATISTICS)
+    if unsupported:
+        raise ValueError(f"Unsupported rolling statistics {sorted(unsupported)}!")
+    values = np.ascontiguousarray(values, dtype="float64")
+    mask = ~np.isnan(values)
+    cum_sum, cum_sq, cum_count, offsets = _cumulative_sums(values, mask)
+    extremes = {
+        stat: _window_extremes(values, windows, func)
+        for stat, func in [("min", np.minimum), ("max", np.maximum)]
+        if stat in statistics
+    }
+    rates = {}
+    if "rate" in statistics or "counter_rate" in statistics:
+        last, first = _valid_positions(mask)
+    if "rate" in statistics:
+        rates["rate"] = values
+    if "counter_rate" in statistics:
+        rates["counter_rate"] = _counter_increases(values, last)
+    for stat, cumulative in rates.items():
+        rates[stat] = (_gather_rows(cumulative, last), _gather_rows(cumulative, first))
+    results = {}
+    for window in windows:
+        sums = _window_difference(cum_sum, window)
+        counts = _window_difference(cum_count, window)
+        missing = counts < max(min_periods, 1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for stat in statistics:
+                if stat == "mean":
+                    result = np.divide(sums, counts)
+                    result += offsets
+                elif stat == "std":
+                    result = _window_difference(cum_sq, window)
+                    squared_sums = np.multiply(sums, sums)
+                    squared_sums /= counts
+                    result -= squared_sums
+                    result /= counts - 1
+                    np.maximum(result, 0, out=result)
+                    np.sqrt(result, out=result)
+                    np.copyto(result, np.nan, where=counts < 2)
+                elif stat in extremes:
+                    result = extremes[stat][window]
+                else:
+                    result = _window_rate(*rates[stat], last, first, window)
+                np.copyto(result, np.nan, where=missing)
+                results[(window, stat)] = result
+    return results
+
+
+def compute_rolling_features(
+    df: pd.DataFrame,
+    windows: tuple = ROLLING_WINDOWS,
+    statistics: tuple = ROLLING_STATISTICS,
+    min_periods: int = 1,
+) -> pd.DataFrame:
+    """Compute rolling features over minute windows for all columns of a merged dataset.
+
+    Columns are processed in blocks small enough for their intermediate
+    arrays to stay in the CPU cache, the kernels are bound by memory traffic.
+    """
+    df = df.sort_index()
+    original_index = df.index
+    # windows are expressed in minutes, so fill missing minutes with NaN gaps
+    minute_index = pd.date_range(df.index.min(), df.index.max(), freq="min")
+    if len(minute_index) == len(original_index):
+        values = df.to_numpy(dtype="float64")
+        positions = slice(None)
+    else:
+        values = df.reindex(minute_index).to_numpy(dtype="float64")
+        positions = minute_index.get_indexer(original_index)
+    keys = [(window, stat) for window in windows for stat in statistics]
+    num_cols = len(df.columns)
+    # column-major, so that each block is written contiguously
+    features = np.empty((len(keys) * num_cols, len(original_index)))
+    block_cols = max(BLOCK_CELLS // max(len(values), 1), MIN_BLOCK_COLUMNS)
+    for start in range(0, num_cols, block_cols):
+        stop = min(start + block_cols, num_cols)
+        results = rolling_statistics(
+            values[:, start:stop], windows, statistics, min_periods
+        )
+        for i, key in enumerate(keys):
+            offset = i * num_cols
+            features[offset + start : offset + stop] = results[key][positions].T
+    columns = [f"{col}-w{window}-{stat}" for window, stat in keys for col in df.columns]
+    return pd.DataFrame(features.T, index=original_index, columns=columns, copy=False)
+
+
+def gen_rolling_features(
+    merged_path: str,
+    output_path: str,
+    windows: tuple = ROLLING_WINDOWS,
+    statistics: tuple = ROLLING_STATISTICS,
+    min_periods: int = 1,
+):
+    """Generate rolling features from a merged time series file."""
+    print(f"Generating rolling features of {merged_path} ...")
+    df = pd.read_csv(merged_path).set_index("timestamp")
+    df.index = pd.to_datetime(df.index)
+    df_features = compute_rolling_features(df, windows, statistics, min_periods)
+    num_rows = len(df_features)
+    num_columns = len(df_features.columns)
+    print(f"{num_rows} rows x {num_columns} columns")
+    write_csv(df_features, output_path)
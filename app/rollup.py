@@ -0,0 +1,145 @@
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+from app.checkpoint import write_csv
+
+SUFFICIENT_STATISTICS = ["count", "sum", "sum_of_squares", "min", "max"]
+ROLLUP_TIERS = ["5min", "1h", "1D"]
+
+
+def sufficient_statistics(df_metric_to_agg: pd.DataFrame) -> pd.DataFrame:
+    """Compute mergeable statistics of a group of KPIs per minute."""
+    values = df_metric_to_agg.to_numpy(dtype="float64")
+    isnan = np.isnan(values)
+    zeros = np.where(isnan, 0.0, values)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        return pd.DataFrame(
+            {
+                "count": (~isnan).sum(axis=1),
+                "sum": zeros.sum(axis=1),
+                "sum_of_squares": (zeros * zeros).sum(axis=1),
+                "min": np.nanmin(values, axis=1),
+                "max": np.nanmax(values, axis=1),
+            },
+            index=df_metric_to_agg.index,
+        )
+
+
+def _split_statistics(df_statistics: pd.DataFrame) -> dict:
+    """Split `{group}-{statistic}` columns into one array per statistic."""
+    groups = {}
+    for stat in SUFFICIENT_STATISTICS:
+        columns = [col for col in df_statistics.columns if col.endswith(f"-{stat}")]
+        groups[stat] = [col.removesuffix(f"-{stat}") for col in columns]
+    return groups
+
+
+def rollup_statistics(df_statistics: pd.DataFrame, freq: str) -> pd.DataFrame:
+    """Merge sufficient statistics into coarser time buckets in one pass."""
+    df_statistics = df_statistics.sort_index()
+    buckets = df_statistics.index.floor(freq)
+    starts = np.flatnonzero(np.concatenate([[True], buckets[1:] != buckets[:-1]]))
+    df_rollup_list = []
+    for stat, groups in _split_statistics(df_statistics).items():
+        columns = [f"{group}-{stat}" for group in groups]
+        values = df_statistics[columns].to_numpy(dtype="float64")
+        if stat == "min":
+            values = np.fmin.reduceat(values, starts, axis=0)
+        elif stat == "max":
+            values = np.fmax.reduceat(values, starts, axis=0)
+        else:
+            values = np.add.reduceat(np.nan_to_num(values), starts, axis=0)
+        df_rollup_list.append(
+            pd.DataFrame(values, index=buckets[starts], columns=columns)
+        )
+    df_rollup = pd.concat(df_rollup_list, axis=1)[df_statistics.columns]
+    df_rollup.index.name = "timestamp"
+    return df_rollup
+
+
+def derive_moments(df_statistics: pd.DataFrame) -> pd.DataFrame:
+    """Derive mean and standard deviation of each group from sufficient statistics."""
+    df_moments_list = [df_statistics]
+    for group in _split_statistics(df_statistics)["count"]:
+        count = df_statistics[f"{group}-count"]
+        total = df_statistics[f"{group}-sum"]
+        sum_of_squares = df_statistics[f"{group}-sum_of_squares"]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = total / count
+            deviations = sum_of_squares - total * mean
+            # deviations within the rounding error of the sum of squares are
+            # cancellation noise, e.g. of constant groups with large values
+            deviations = deviations.mask(
+                deviations <= count * np.finfo("float64").eps * sum_of_squares, 0.0
+            )
+            variance = deviations / (count - 1)
+        df_moments_list.append(
+            pd.DataFrame(
+                {
+                    f"{group}-mean": mean,
+                    f"{group}-std": np.sqrt(variance.clip(lower=0)),
+                }
+            )
+        )
+    return pd.concat(df_moments_list, axis=1)
+
+
+def read_statistics_file(path: str) -> pd.DataFrame:
+    df_statistics = pd.read_csv(path).set_index("timestamp")
+    df_statistics.index = pd.to_datetime(df_statistics.index)
+    return df_statistics
+
+
+def build_rollups(statistics_path: str, metric_index: int, tiers: list = ROLLUP_TIERS):
+    """Build all rollup tiers of a metric, each tier from the previous finer one."""
+    df_statistics = read_statistics_file(
+        os.path.join(statistics_path, f"metric-{metric_index}.csv")
+    )
+    for tier in tiers:
+        df_statistics = rollup_statistics(df_statistics, tier)
+        tier_path = os.path.join(statistics_path, f"rollup-{tier}")
+        if not os.path.exists(tier_path):
+            os.mkdir(tier_path)
+        write_csv(df_statistics, os.path.join(tier_path, f"metric-{metric_index}.csv"))
+
+
+def build_all_rollups(statistics_path: str, tiers: list = ROLLUP_TIERS):
+    metric_indices = sorted(
+        int(filename.removeprefix("metric-").removesuffix(".csv"))
+        for filename in os.listdir(statistics_path)
+        if filename.startswith("metric-") and filename.endswith(".csv")
+    )
+    for metric_index in metric_indices:
+        print(f"Rolling up metric {metric_index} ...")
+        build_rollups(statistics_path, metric_index, tiers)
+
+
+def read_rollup(
+    statistics_path: str,
+    metric_index: int,
+    resolution: str = "1min",
+    tiers: list = ROLLUP_TIERS,
+) -> pd.DataFrame:
+    """Read statistics of a metric at a requested resolution.
+
+    The coarsest persisted tier whose buckets divide the resolution is read,
+    then merged further if the resolution is not a tier itself.
+    """
+    resolution_delta = pd.Timedelta(resolution)
+    metric_path = os.path.join(statistics_path, f"metric-{metric_index}.csv")
+    tier_delta = pd.Timedelta(minutes=1)
+    for tier in tiers:
+        delta = pd.Timedelta(tier)
+        tier_path = os.path.join(
+            statistics_path, f"rollup-{tier}", f"metric-{metric_index}.csv"
+        )
+        if resolution_delta % delta == pd.Timedelta(0) and os.path.exists(tier_path):
+            metric_path = tier_path
+            tier_delta = delta
+    df_statistics = read_statistics_file(metric_path)
+    if tier_delta < resolution_delta:
+        df_statistics = rollup_statistics(df_statistics, resolution)
+    return derive_moments(df_statistics)
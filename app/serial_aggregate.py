@@ -14,9 +14,12 @@ from app import (
     PROMETHEUS_UNIFIED_PATH,
     PROMETHEUS_TARGET_METRICS_PATH,
 )
+from app.checkpoint import BackgroundWriter, write_csv
 from app.gcloud_aggregator import GCloudAggregator
 from app.locust_aggregator import LocustAggregator
 from app.merger import (
+    complete_faulty_experiment,
+    concat_aggregated_metrics,
     copy_merged_faulty_metrics_for_experiments,
     merge_faulty_metrics_from_aggregated,
     merge_faulty_metrics_from_one_experiment,
@@ -51,6 +54,53 @@ def aggregate_faulty_metrics_in_one_experiment(exp_name: str):
     locust_aggregator.aggregate_all_metrics()
 
 
+def fuse_faulty_metrics_in_one_experiment(
+    exp_name: str, debug_intermediate: bool = False, dataset_path: str = None
+) -> tuple:
+    """Aggregate and merge one faulty experiment without rereading files.
+
+    Frames are handed from merging to aggregation to the experiment merge in
+    memory, metric by metric. With `debug_intermediate` the combined and
+    aggregated files are still written, in a background thread.
+    """
+    exp_path = os.path.join(FAILURE_INJECTION_PATH, exp_name)
+    print(f"Processing {exp_name} ...")
+    intermediate_writer = BackgroundWriter() if debug_intermediate else None
+    try:
+        gcloud_aggregator = GCloudAggregator(
+            exp_path,
+            "gcloud_metrics",
+            METRIC_TYPE_MAP_PATH,
+        )
+        gcloud_frames = gcloud_aggregator.run_fused(intermediate_writer)
+
+        prometheus_aggregator = PrometheusAggregator(
+            exp_path,
+            "prometheus-metrics",
+            PROMETHEUS_TARGET_METRICS_PATH,
+        )
+        prometheus_frames = prometheus_aggregator.run_fused(intermediate_writer)
+
+        locust_aggregator = LocustAggregator(FAILURE_INJECTION_PATH, exp_name)
+        df_locust = locust_aggregator.aggregate_stats()
+        if intermediate_writer is not None:
+            intermediate_writer.submit(
+                write_csv,
+                df_locust,
+                locust_aggregator.aggregated_metrics_path,
+                index=False,
+            )
+        return complete_faulty_experiment(
+            exp_name,
+            concat_aggregated_metrics(gcloud_frames, prometheus_frames),
+            df_locust.set_index("timestamp"),
+            dataset_path,
+        )
+    finally:
+        if intermediate_writer is not None:
+            intermediate_writer.close()
+
+
 def gen_gcloud_target_metrics():
     metric_indices = [
         int(filename.lstrip("metric-").rstrip("-kpi-map.json"))
@@ -0,0 +1,204 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import zlib
+
+import numpy as np
+from app.checkpoint import atomic_output
+
+MAGIC = b"PMCHUNK1"
+FOOTER_STRUCT = struct.Struct("<Q8s")
+
+
+def encode_keys(keys: np.ndarray) -> bytes:
+    """Compress minute keys as delta-of-deltas, regular series become zeros."""
+    deltas = np.diff(np.asarray(keys, dtype="int64"), prepend=0)
+    return zlib.compress(np.diff(deltas, prepend=0).astype("<i8").tobytes())
+
+
+def decode_keys(buffer) -> np.ndarray:
+    delta_of_deltas = np.frombuffer(zlib.decompress(buffer), dtype="<i8")
+    return np.cumsum(np.cumsum(delta_of_deltas)).astype("int64")
+
+
+def encode_values(values: np.ndarray) -> bytes:
+    """Compress values by XOR-ing the bits of consecutive floats like Gorilla."""
+    bits = np.asarray(values, dtype="<f8").view("<u8")
+    xored = bits ^ np.concatenate([np.zeros(1, dtype="<u8"), bits[:-1]])
+    return zlib.compress(xored.tobytes())
+
+
+def decode_values(buffer) -> np.ndarray:
+    xored = np.frombuffer(zlib.decompress(buffer), dtype="<u8")
+    return np.bitwise_xor.accumulate(xored).view("<f8").astype("float64")
+
+
+def write_chunked_metric(chunks_path: str, metric_name: str, series) -> int:
+    """Write series given as (labels, minute keys, values) to a chunked file.
+
+    The file holds the compressed chunks of all series back to back, then a
+    compressed JSON footer with the labels, byte offsets and lengths of each
+    series, then the footer length and a magic number.
+    """
+    labels_list = []
+    chunks = []
+    with atomic_output(chunks_path, "wb") as fp:
+        fp.write(MAGIC)
+        for labels, keys, values in series:
+            key_chunk = encode_keys(keys)
+            value_chunk = encode_values(values)
+            chunks.append([fp.tell(), len(key_chunk), len(value_chunk), len(keys)])
+            fp.write(key_chunk)
+            fp.write(value_chunk)
+            labels_list.append(labels)
+        footer = zlib.compress(
+            json.dumps(
+                {"name": metric_name, "labels": labels_list, "chunks": chunks}
+            ).encode()
+        )
+        fp.write(footer)
+        fp.write(FOOTER_STRUCT.pack(len(footer), MAGIC))
+    return len(labels_list)
+
+
+def label_predicates(**labels) -> dict:
+    """Sets of accepted values by label, `None` accepts a missing label."""
+    return {
+        label: (set(value) if isinstance(value, (list, tuple, set)) else {value})
+        for label, value in labels.items()
+    }
+
+
+def match_labels(series_labels: dict, predicates: dict) -> bool:
+    return all(
+        series_labels.get(label) in accepted for label, accepted in predicates.items()
+    )
+
+
+class ChunkedMetricReader:
+    """Random access to the series of a chunked metric file through mmap."""
+
+    def __init__(self, chunks_path: str):
+        self.chunks_path = chunks_path
+        with open(chunks_path, "rb") as fp:
+            self.buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        footer_length, magic = FOOTER_STRUCT.unpack(self.buffer[-FOOTER_STRUCT.size :])
+        if magic != MAGIC or self.buffer[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{chunks_path} is not a chunked metric file!")
+        footer_end = len(self.buffer) - FOOTER_STRUCT.size
+        footer = json.loads(
+            zlib.decompress(self.buffer[footer_end - footer_length : footer_end])
+        )
+        self.metric_name = footer["name"]
+        self.labels = footer["labels"]
+        self.chunks = np.asarray(footer["chunks"], dtype="int64").reshape(-1, 4)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def close(self):
+        self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def select(self, **labels) -> np.ndarray:
+        """Positions of series matching all label predicates.
+
+        A predicate is either a value or a collection of accepted values.
+        """
+        predicates = label_predicates(**labels)
+        return np.array(
+            [
+                position
+                for position, series_labels in enumerate(self.labels)
+                if match_labels(series_labels, predicates)
+            ],
+            dtype="int64",
+        )
+
+    def read_keys(self, position: int) -> np.ndarray:
+        """Decode only the minute keys of one series."""
+        offset, key_length, _, _ = self.chunks[position]
+        return decode_keys(self.buffer[offset : offset + key_length])
+
+    def read_series(self, position: int) -> tuple:
+        """Decode the minute keys and values of one series."""
+        offset, key_length, value_length, _ = self.chunks[position]
+        key_end = offset + key_length
+        return (
+            decode_keys(self.buffer[offset:key_end]),
+            decode_values(self.buffer[key_end : key_end + value_length]),
+        )
+
+    def iter_series(self, positions=None):
+        """Yield (labels, minute keys, values) of the given or all series."""
+        if positions is None:
+            positions = range(len(self))
+        for position in positions:
+            keys, values = self.read_series(position)
+            yield self.labels[position], keys, values
+
+
+def chunks_path_of(metric_path: str) -> str:
+    return os.path.splitext(metric_path)[0] + ".chunks"
+
+
+def has_fresh_chunks(metric_path: str) -> bool:
+    """Check whether a chunked file exists and is not older than its JSON dump."""
+    chunks_path = chunks_path_of(metric_path)
+    return os.path.exists(chunks_path) and (
+        not os.path.exists(metric_path)
+        or os.path.getmtime(chunks_path) >= os.path.getmtime(metric_path)
+    )
+
+
+def convert_metric_file(metric_path: str, metric_name: str = None) -> int:
+    """Convert one Prometheus JSON dump into a chunked file next to it."""
+    from app.prometheus_aggregator import Metric
+
+    metric_name = metric_name or os.path.basename(metric_path)
+    return write_chunked_metric(
+        chunks_path_of(metric_path),
+        metric_name,
+        (
+            (item.metadata, item.keys, item.value_array)
+            for item in Metric.iter_items(metric_name, metric_path, use_chunks=False)
+        ),
+    )
+
+
+def convert_metrics_folder(metrics_path: str, force: bool = False):
+    """Convert all JSON dumps of a Prometheus metrics folder once."""
+    with open(os.path.join(metrics_path, "metric_names_map.json")) as fp:
+        metric_names = list(json.load(fp).values())
+    for filename in sorted(os.listdir(metrics_path)):
+        if not (filename.startswith("metric-") and filename.endswith(".json")):
+            continue
+        metric_path = os.path.join(metrics_path, filename)
+        if not force and has_fresh_chunks(metric_path):
+            continue
+        metric_index = int(filename.split("-")[1])
+        metric_name = metric_names[metric_index - 1]
+        num_series = convert_metric_file(metric_path, metric_name)
+        print(f"Converted {filename} with {num_series} series")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert Prometheus JSON dumps into chunked binary files"
+    )
+    parser.add_argument("metrics_paths", nargs="+")
+    parser.add_argument("--force", action="store_true")
+    args = parser.parse_args()
+    for metrics_path in args.metrics_paths:
+        convert_metrics_folder(metrics_path, args.force)
+
+
+if __name__ == "__main__":
+    main()
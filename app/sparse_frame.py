@@ -0,0 +1,335 @@
+import os
+
+import numpy as np
+import pandas as pd
+from app.checkpoint import atomic_output, write_csv
+from app.minute_dedup import minute_keys_to_timestamps
+
+# combined metrics with fewer observed points than this are stored sparsely
+SPARSE_FILL_RATIO = 0.1
+QUANTILE_FUNCS = {"median": 0.5, "first_quartile": 0.25, "third_quartile": 0.75}
+
+
+def _as_index(columns) -> pd.Index:
+    # pd.Index() would turn a MultiIndex into an index of tuples
+    return columns if isinstance(columns, pd.Index) else pd.Index(columns)
+
+
+class SparseFrame:
+    """Time series of many KPIs stored as observed points only (COO).
+
+    Points are kept sorted by row then column, missing points take
+    `fill_value`. Memory and row aggregations scale with the number of
+    observed points instead of rows x columns.
+    """
+
+    def __init__(
+        self,
+        index: pd.Index,
+        columns: pd.Index,
+        rows: np.ndarray,
+        cols: np.ndarray,
+        values: np.ndarray,
+        fill_value: float = np.nan,
+        dtype: str = "float64",
+    ):
+        self.index = index
+        self.columns = _as_index(columns)
+        order = np.lexsort((cols, rows))
+        self.rows = np.asarray(rows, dtype="int64")[order]
+        self.cols = np.asarray(cols, dtype="int64")[order]
+        self.values = np.asarray(values, dtype="float64")[order]
+        self.fill_value = fill_value
+        self.dtype = dtype
+
+    @classmethod
+    def from_dense(cls, df: pd.DataFrame) -> "SparseFrame":
+        df = df.sort_index()
+        values = df.to_numpy(dtype="float64")
+        rows, cols = np.nonzero(~np.isnan(values))
+        return cls(df.index, df.columns, rows, cols, values[rows, cols])
+
+    @classmethod
+    def from_minutes(
+        cls,
+        series_ids: np.ndarray,
+        keys: np.ndarray,
+        values: np.ndarray,
+        columns,
+        unique_keys: np.ndarray = None,
+    ) -> "SparseFrame":
+        """Build from long-format series like `pivot_minutes` without a dense matrix.
+
+        `unique_keys` are the sorted minute keys of the rows, by default
+        those of `keys`.
+        """
+        keys = np.asarray(keys, dtype="int64")
+        values = np.asarray(values, dtype="float64")
+        if unique_keys is None:
+            unique_keys = np.unique(keys)
+        observed = ~np.isnan(values)
+        return cls(
+            minute_keys_to_timestamps(unique_keys),
+            columns,
+            np.searchsorted(unique_keys, keys[observed]),
+            np.asarray(series_ids)[observed],
+            values[observed],
+        )
+
+    @staticmethod
+    def fill_ratio_of(num_points: int, shape: tuple) -> float:
+        size = shape[0] * shape[1]
+        return num_points / size if size else 1.0
+
+    @property
+    def shape(self) -> tuple:
+        return len(self.index), len(self.columns)
+
+    @property
+    def fill_ratio(self) -> float:
+        return SparseFrame.fill_ratio_of(len(self.values), self.shape)
+
+    @property
+    def empty(self) -> bool:
+        return len(self.index) == 0 or len(self.columns) == 0
+
+    def _with_points(self, columns, rows, cols, values) -> "SparseFrame":
+        frame = SparseFrame.__new__(SparseFrame)
+        frame.index = self.index
+        frame.columns = _as_index(columns)
+        frame.rows, frame.cols, frame.values = rows, cols, values
+        frame.fill_value = self.fill_value
+        frame.dtype = self.dtype
+        return frame
+
+    def __getitem__(self, columns: list) -> "SparseFrame":
+        """Select columns in the given order."""
+        positions = self.columns.get_indexer(columns)
+        if (positions < 0).any():
+            raise KeyError(f"{np.asarray(columns)[positions < 0]} not in columns")
+        mapping = np.full(len(self.columns), -1, dtype="int64")
+        mapping[positions] = np.arange(len(positions))
+        new_cols = mapping[self.cols]
+        selected = new_cols >= 0
+        rows = self.rows[selected]
+        cols = new_cols[selected]
+        values = self.values[selected]
+        # keep points sorted by column within rows in the new column order
+        order = np.lexsort((cols, rows))
+        return self._with_points(
+            self.columns[positions], rows[order], cols[order], values[order]
+        )
+
+    def set_axis(self, labels, axis: int = 1) -> "SparseFrame":
+        """Relabel the columns without copying the points."""
+        if axis != 1:
+            raise ValueError("Only columns of a SparseFrame can be relabeled!")
+        return self._with_points(labels, self.rows, self.cols, self.values)
+
+    def reindex(self, columns: list) -> "SparseFrame":
+        """Select columns, unknown columns are empty."""
+        known = [column for column in columns if column in self.columns]
+        frame = self[known]
+        if len(known) == len(columns):
+            return frame
+        positions = pd.Index(columns).get_indexer(known)
+        return self._with_points(
+            columns, frame.rows, positions[frame.cols], frame.values
+        )
+
+    def fillna(self, value: float) -> "SparseFrame":
+        frame = self._with_points(self.columns, self.rows, self.cols, self.values)
+        frame.fill_value = value
+        return frame
+
+    def notnull(self) -> "SparseFrame":
+        """Observed points become True and missing points False."""
+        frame = self._with_points(
+            self.columns, self.rows, self.cols, np.ones(len(self.values))
+        )
+        frame.fill_value = 0
+        frame.dtype = "bool"
+        return frame
+
+    def astype(self, dtype) -> "SparseFrame":
+        frame = self._with_points(self.columns, self.rows, self.cols, self.values)
+        frame.dtype = np.dtype(dtype).name
+        return frame
+
+    def to_numpy(self, dtype: str = "float64") -> np.ndarray:
+        matrix = np.full(self.shape, self.fill_value, dtype="float64")
+        matrix[self.rows, self.cols] = self.values
+        return matrix.astype(dtype)
+
+    def to_dense(self) -> pd.DataFrame:
+        return pd.DataFrame(
+            self.to_numpy(self.dtype), index=self.index, columns=self.columns
+        )
+
+    def reduce_cumulative(self, per_second: bool = False) -> "SparseFrame":
+        """Sparse counterpart of `Aggregator.reduce_cumulative_frame`.
+
+        A delta exists only where a column is observed in two consecutive rows.
+        """
+        order = np.lexsort((self.rows, self.cols))
+        rows, cols, values = self.rows[order], self.cols[order], self.values[order]
+        consecutive = np.flatnonzero(
+            (cols[1:] == cols[:-1]) & (rows[1:] == rows[:-1] + 1)
+        )
+        previous, current = values[consecutive], values[consecutive + 1]
+        deltas = np.where(current < previous, current, current - previous)
+        delta_rows = rows[consecutive + 1]
+        if per_second:
+            seconds = np.diff(self.index.to_numpy().astype("datetime64[ns]"))
+            seconds = seconds / np.timedelta64(1, "s")
+            deltas = deltas / seconds[delta_rows - 1]
+        return SparseFrame(
+            self.index, self.columns, delta_rows, cols[consecutive + 1], deltas
+        )
+
+    def _row_quantiles(self, counts: np.ndarray, q: float) -> np.ndarray:
+        """Linearly interpolated quantile of each row like `Series.quantile`."""
+        order = np.lexsort((self.values, self.rows))
+        sorted_values = self.values[order]
+        starts = np.cumsum(counts) - counts
+        observed = counts > 0
+        quantiles = np.full(len(counts), np.nan)
+        position = q * (counts[observed] - 1)
+        lower = np.floor(position).astype("int64")
+        upper = np.ceil(position).astype("int64")
+        low = sorted_values[starts[observed] + lower]
+        high = sorted_values[starts[observed] + upper]
+        quantiles[observed] = low + (high - low) * (position - lower)
+        return quantiles
+
+    def agg(self, funcs: list, axis: int = 1) -> pd.DataFrame:
+        """Aggregate each row over all columns like `DataFrame.agg(funcs, axis=1)`.
+
+        Only observed points are touched. With a non-NaN `fill_value` only sum
+        and count are computed sparsely, other functions use a dense copy.
+        """
+        if axis != 1:
+            raise ValueError("Sparse frames are only aggregated along rows!")
+        names = [func if isinstance(func, str) else func.__name__ for func in funcs]
+        filled = not np.isnan(self.fill_value)
+        if filled and not set(names) <= {"sum", "count"}:
+            return self.to_dense().agg(funcs, axis=1)
+        num_rows = len(self.index)
+        counts = np.bincount(self.rows, minlength=num_rows)
+        sums = np.bincount(self.rows, weights=self.values, minlength=num_rows)
+        observed = counts > 0
+        starts = np.cumsum(counts)[observed] - counts[observed]
+        results = {}
+        for name, func in zip(names, funcs):
+            if name == "count":
+                result = np.full(num_rows, len(self.columns)) if filled else counts
+            elif name == "sum":
+                result = sums
+                if filled:
+                    result = sums + self.fill_value * (len(self.columns) - counts)
+            elif name == "mean":
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    result = np.where(observed, sums / counts, np.nan)
+            elif name in ["min", "max"]:
+                ufunc = np.minimum if name == "min" else np.maximum
+                result = np.full(num_rows, np.nan)
+                if len(starts):
+                    result[observed] = ufunc.reduceat(self.values, starts)
+            elif name in QUANTILE_FUNCS:
+                result = self._row_quantiles(counts, QUANTILE_FUNCS[name])
+            else:
+                return self.to_dense().agg(funcs, axis=1)
+            results[name] = result
+        df_agg = pd.DataFrame(results, index=self.index)
+        # like pandas, counts alone and sums of integers stay integers
+        if set(names) == {"count"} or (
+            self.dtype != "float64" and set(names) <= {"sum", "count"}
+        ):
+            return df_agg.astype("int64")
+        return df_agg.astype("float64")
+
+    def save(self, path: str):
+        index = self.index.to_numpy()
+        with atomic_output(path, "wb") as fp:
+            np.savez_compressed(
+                fp,
+                index=index.astype("datetime64[ns]").astype("int64"),
+                unit=np.asarray(np.datetime_data(index.dtype)[0]),
+                columns=np.asarray(self.columns, dtype=str),
+                rows=self.rows.astype("int32"),
+                cols=self.cols.astype("int32"),
+                values=self.values,
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "SparseFrame":
+        with np.load(path) as data:
+            # the unit is restored so that both layouts read back alike
+            unit = str(data["unit"]) if "unit" in data.files else "ns"
+            index = pd.DatetimeIndex(
+                data["index"].astype("datetime64[ns]"), name="timestamp"
+            ).as_unit(unit)
+            return cls(
+                index,
+                data["columns"].tolist(),
+                data["rows"].astype("int64"),
+                data["cols"].astype("int64"),
+                data["values"],
+            )
+
+
+def sparse_path_of(csv_path: str) -> str:
+    return os.path.splitext(csv_path)[0] + ".npz"
+
+
+def write_combined(
+    df_or_frame, csv_path: str, sparse_fill_ratio: float = None, **kwargs
+):
+    """Write a combined metric sparsely if its fill ratio is low, else as CSV.
+
+    The file of the other layout is removed so that readers never see a
+    stale copy.
+    """
+    frame = df_or_frame
+    if sparse_fill_ratio is not None and not isinstance(frame, SparseFrame):
+        frame = SparseFrame.from_dense(frame)
+    if sparse_fill_ratio is not None and frame.fill_ratio < sparse_fill_ratio:
+        frame.save(sparse_path_of(csv_path))
+        if os.path.exists(csv_path):
+            os.remove(csv_path)
+    else:
+        write_csv(as_dense(df_or_frame), csv_path, **kwargs)
+        remove_sparse(csv_path)
+
+
+def remove_sparse(csv_path: str):
+    """Remove a sparse copy that would shadow a newly written CSV."""
+    if os.path.exists(sparse_path_of(csv_path)):
+        os.remove(sparse_path_of(csv_path))
+
+
+def read_combined(csv_path: str):
+    """Read a combined metric in whichever layout it has been written."""
+    if os.path.exists(sparse_path_of(csv_path)):
+        return SparseFrame.load(sparse_path_of(csv_path))
+    df = pd.read_csv(csv_path)
+    df["timestamp"] = pd.to_datetime(df["timestamp"])
+    return df.set_index("timestamp").sort_index()
+
+
+def as_stored(df_or_frame, sparse_fill_ratio: float = None):
+    """Combined metric as `read_combined` returns it after `write_combined`."""
+    frame = df_or_frame
+    if sparse_fill_ratio is not None and not isinstance(frame, SparseFrame):
+        frame = SparseFrame.from_dense(frame)
+    if sparse_fill_ratio is not None and frame.fill_ratio < sparse_fill_ratio:
+        return frame
+    # a copy stores columns contiguously like frames read from CSV, so that
+    # row reductions add up in the same order as after a reread
+    return as_dense(df_or_frame).rename_axis("timestamp").sort_index().copy()
+
+
+def as_dense(df_or_frame) -> pd.DataFrame:
+    if isinstance(df_or_frame, SparseFrame):
+        return df_or_frame.to_dense()
+    return df_or_frame
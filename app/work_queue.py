@@ -0,0 +1,344 @@
+import argparse
+import json
+from multiprocessing import Pool
+import os
+import socket
+import threading
+import time
+import uuid
+
+from app import WORK_QUEUE_PATH
+from app.checkpoint import write_json
+
+
+def _read_json(path: str) -> dict:
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def new_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+class WorkQueue:
+    """Task queue in a shared directory, drained by workers on any host.
+
+    Tasks are JSON files in `tasks/`. A worker owns a task while it holds
+    its lease file in `leases/`, which is created with `os.link` so that
+    exactly one worker wins even on network filesystems. Leases expire
+    unless renewed by heartbeats, then any worker may break and reclaim
+    them. Every renewal gets a new token, so a breaker notices a renewal
+    that lands while it breaks the lease. Finished tasks are recorded in
+    `done/` or `failed/`.
+    """
+
+    def __init__(
+        self,
+        queue_path: str = WORK_QUEUE_PATH,
+        lease_seconds: float = 300,
+        heartbeat_seconds: float = 30,
+    ):
+        self.queue_path = queue_path
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        for folder in ["tasks", "leases", "done", "failed"]:
+            os.makedirs(os.path.join(queue_path, folder), exist_ok=True)
+
+    def _path(self, folder: str, task_id: str) -> str:
+        extension = "lease" if folder == "leases" else "json"
+        return os.path.join(self.queue_path, folder, f"{task_id}.{extension}")
+
+    def _task_ids(self, folder: str) -> list:
+        return sorted(
+            filename.removesuffix(".json")
+            for filename in os.listdir(os.path.join(self.queue_path, folder))
+            if filename.endswith(".json")
+        )
+
+    def enqueue(self, task_id: str, kind: str, args: list) -> bool:
+        """Add a task unless it is already queued or finished."""
+        if any(
+            os.path.exists(self._path(folder, task_id))
+            for folder in ["tasks", "done", "failed"]
+        ):
+            return False
+        write_json(
+            {"task_id": task_id, "kind": kind, "args": list(args)},
+            self._path("tasks", task_id),
+        )
+        return True
+
+    def pending_task_ids(self) -> list:
+        finished = set(self._task_ids("done")) | set(self._task_ids("failed"))
+        return [
+            task_id for task_id in self._task_ids("tasks") if task_id not in finished
+        ]
+
+    def status(self) -> dict:
+        pending = self.pending_task_ids()
+        leased = [
+            task_id
+            for task_id in pending
+            if os.path.exists(self._path("leases", task_id))
+        ]
+        return {
+            "pending": len(pending) - len(leased),
+            "leased": len(leased),
+            "done": len(self._task_ids("done")),
+            "failed": len(self._task_ids("failed")),
+        }
+
+    def _new_lease(self, worker_id: str) -> dict:
+        return {
+            "worker_id": worker_id,
+            "token": uuid.uuid4().hex,
+            "expires_at": time.time() + self.lease_seconds,
+        }
+
+    def _acquire(self, task_id: str, worker_id: str) -> dict:
+        lease_path = self._path("leases", task_id)
+        lease = self._new_lease(worker_id)
+        tmp_path = f"{lease_path}.{lease['token']}.tmp"
+        with open(tmp_path, "w") as fp:
+            json.dump(lease, fp)
+        try:
+            os.link(tmp_path, lease_path)
+        except FileExistsError:
+            return None
+        finally:
+            os.remove(tmp_path)
+        return lease
+
+    def _break_expired_lease(self, task_id: str) -> bool:
+        """Move an expired lease aside, only one of competing workers succeeds."""
+        lease_path = self._path("leases", task_id)
+        lease = _read_json(lease_path)
+        if lease is None or lease["expires_at"] > time.time():
+            return False
+        stale_path = f"{lease_path}.{uuid.uuid4().hex}.stale"
+        try:
+            os.rename(lease_path, stale_path)
+        except FileNotFoundError:
+            return False
+        stale_lease = _read_json(stale_path)
+        # the lease was renewed or reclaimed in between, put it back
+        if stale_lease is not None and (
+            stale_lease["token"] != lease["token"]
+            or stale_lease["expires_at"] > time.time()
+        ):
+            try:
+                os.link(stale_path, lease_path)
+            except FileExistsError:
+                pass
+            os.remove(stale_path)
+            return False
+        os.remove(stale_path)
+        print(f"Reclaiming task {task_id} from {lease['worker_id']}")
+        return True
+
+    def claim(self, worker_id: str):
+        """Lease the first available task, returns the task and its lease."""
+        for task_id in self.pending_task_ids():
+            lease = self._acquire(task_id, worker_id)
+            if lease is None and self._break_expired_lease(task_id):
+                lease = self._acquire(task_id, worker_id)
+            if lease is None:
+                continue
+            # finished by another worker since listing
+            if os.path.exists(self._path("done", task_id)) or os.path.exists(
+                self._path("failed", task_id)
+            ):
+                self.release(task_id, lease)
+                continue
+            task = _read_json(self._path("tasks", task_id))
+            if task is not None:
+                return task, lease
+            self.release(task_id, lease)
+        return None, None
+
+    def holds(self, task_id: str, lease: dict) -> bool:
+        current = _read_json(self._path("leases", task_id))
+        return current is not None and current["token"] == lease["token"]
+
+    def heartbeat(self, task_id: str, lease: dict) -> bool:
+        """Extend a lease, returns False if it has been lost to another worker.
+
+        A lease close to expiry counts as lost, it may be broken at any time,
+        so that a renewal never replaces the lease of a new owner.
+        """
+        if (
+            not self.holds(task_id, lease)
+            or lease["expires_at"] - time.time() < self.lease_seconds / 10
+        ):
+            return False
+        lease["token"] = uuid.uuid4().hex
+        lease["expires_at"] = time.time() + self.lease_seconds
+        write_json(lease, self._path("leases", task_id))
+        return True
+
+    def release(self, task_id: str, lease: dict):
+        if self.holds(task_id, lease):
+            try:
+                os.remove(self._path("leases", task_id))
+            except FileNotFoundError:
+                pass
+
+    def finish(self, task_id: str, lease: dict, summary: dict):
+        folder = "done" if summary["status"] == "ok" else "failed"
+        write_json(summary, self._path(folder, task_id))
+        self.release(task_id, lease)
+
+    def requeue_failed(self):
+        for task_id in self._task_ids("failed"):
+            os.remove(self._path("failed", task_id))
+
+
+class _Heartbeat(threading.Thread):
+    def __init__(self, queue: WorkQueue, task_id: str, lease: dict):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.task_id = task_id
+        self.lease = lease
+        self.stopped = threading.Event()
+        self.lost = False
+
+    def run(self):
+        while not self.stopped.wait(self.queue.heartbeat_seconds):
+            if not self.queue.heartbeat(self.task_id, self.lease):
+                print(f"Lost lease of task {self.task_id}")
+                self.lost = True
+                return
+
+
+def run_task(task: dict):
+    if task["kind"] == "aggregate":
+        from app.concurrent_aggregate import perform_aggregation
+
+        perform_aggregation(*task["args"])
+    elif task["kind"] == "merge":
+        from app.merger import merge_one_faulty_experiment, read_target_metrics
+
+        merge_one_faulty_experiment(*task["args"], *read_target_metrics())
+    else:
+        raise ValueError(f"Unsupported task kind {task['kind']}!")
+
+
+def work(
+    queue: WorkQueue,
+    worker_id: str = None,
+    poll_seconds: float = 5,
+    exit_when_drained: bool = True,
+) -> int:
+    """Claim and run tasks until the queue is drained, returns the number run."""
+    worker_id = worker_id or new_worker_id()
+    num_tasks = 0
+    while True:
+        task, lease = queue.claim(worker_id)
+        if task is None:
+            if exit_when_drained and not queue.pending_task_ids():
+                return num_tasks
+            # remaining tasks are leased, wait for them to finish or expire
+            time.sleep(poll_seconds)
+            continue
+        task_id = task["task_id"]
+        print(f"{worker_id} running task {task_id} ...")
+        heartbeat = _Heartbeat(queue, task_id, lease)
+        heartbeat.start()
+        summary = {"task_id": task_id, "worker_id": worker_id, "status": "ok"}
+        start = time.perf_counter()
+        try:
+            run_task(task)
+        except Exception as e:
+            print(f"Task {task_id} failed: {e!r}")
+            summary["status"] = "failed"
+            summary["error"] = repr(e)
+        finally:
+            heartbeat.stopped.set()
+            heartbeat.join()
+        summary["seconds"] = round(time.perf_counter() - start, 3)
+        # another worker owns the task now and records its own result
+        if heartbeat.lost or not queue.holds(task_id, lease):
+            print(f"Dropping result of task {task_id}, its lease was lost")
+            continue
+        queue.finish(task_id, lease, summary)
+        num_tasks += 1
+
+
+def _work_in_process(
+    queue_path: str, lease_seconds: float, heartbeat_seconds: float
+) -> int:
+    return work(WorkQueue(queue_path, lease_seconds, heartbeat_seconds))
+
+
+def run_workers(
+    queue_path: str = WORK_QUEUE_PATH,
+    processes: int = 4,
+    lease_seconds: float = 300,
+    heartbeat_seconds: float = 30,
+) -> int:
+    """Drain the queue with several local worker processes."""
+    args = [(queue_path, lease_seconds, heartbeat_seconds)] * processes
+    with Pool(processes) as pool:
+        num_tasks = pool.starmap(_work_in_process, args)
+    return sum(num_tasks)
+
+
+def enqueue_aggregations(queue: WorkQueue, log_filename: str):
+    from app.concurrent_aggregate import gen_paths
+
+    for paths in gen_paths(log_filename):
+        task_id = "aggregate-" + "-".join(os.path.basename(path) for path in paths[4:6])
+        queue.enqueue(task_id, "aggregate", paths)
+
+
+def enqueue_merges(queue: WorkQueue, selector, source: str = "aggregated"):
+    from app.merger import select_experiments
+
+    for folder in select_experiments(selector):
+        queue.enqueue(f"merge-{folder}", "merge", [folder, source])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared work queue of experiments")
+    parser.add_argument("--queue-path", default=WORK_QUEUE_PATH)
+    parser.add_argument("--lease-seconds", type=float, default=300)
+    parser.add_argument("--heartbeat-seconds", type=float, default=30)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parser_aggregate = subparsers.add_parser("enqueue-aggregations")
+    parser_aggregate.add_argument(
+        "--log-filename", default="failure-injection-logs.csv"
+    )
+    parser_merge = subparsers.add_parser("enqueue-merges")
+    parser_merge.add_argument("selector")
+    parser_merge.add_argument("--source", default="aggregated")
+    parser_work = subparsers.add_parser("work")
+    parser_work.add_argument("--processes", type=int, default=1)
+    subparsers.add_parser("status")
+    subparsers.add_parser("requeue-failed")
+    args = parser.parse_args()
+
+    queue = WorkQueue(args.queue_path, args.lease_seconds, args.heartbeat_seconds)
+    if args.command == "enqueue-aggregations":
+        enqueue_aggregations(queue, args.log_filename)
+    elif args.command == "enqueue-merges":
+        enqueue_merges(queue, args.selector, args.source)
+    elif args.command == "work":
+        if args.processes > 1:
+            run_workers(
+                args.queue_path,
+                args.processes,
+                args.lease_seconds,
+                args.heartbeat_seconds,
+            )
+        else:
+            work(queue)
+    elif args.command == "requeue-failed":
+        queue.requeue_failed()
+    print(queue.status())
+
+
+if __name__ == "__main__":
+    main()
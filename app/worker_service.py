@@ -0,0 +1,326 @@
+import argparse
+import json
+import multiprocessing
+from multiprocessing import Pool, SimpleQueue
+import os
+import queue
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from app import (
+    GCLOUD_TARGET_METRICS_PATH,
+    METRIC_TYPE_MAP_PATH,
+    PROMETHEUS_TARGET_METRICS_PATH,
+)
+
+SOCKET_PATH = os.path.join(tempfile.gettempdir(), "alemira-aggregator.sock")
+WORKER_PROCESSES = 4
+# how often a silent job checks that its worker process is still alive
+LIVENESS_SECONDS = 1.0
+# stages of a job run in the order given, each called with the experiment
+# and the options given for it
+STAGES = ("aggregate", "merge", "fuse")
+
+
+def _stage_functions() -> dict:
+    # imported here, so that clients start without pandas
+    from app.serial_aggregate import (
+        aggregate_faulty_metrics_in_one_experiment,
+        fuse_faulty_metrics_in_one_experiment,
+        merge_faulty_metrics_from_one_experiment,
+    )
+
+    return {
+        "aggregate": aggregate_faulty_metrics_in_one_experiment,
+        "merge": merge_faulty_metrics_from_one_experiment,
+        "fuse": fuse_faulty_metrics_in_one_experiment,
+    }
+
+
+class _ProgressStream:
+    """Stdout of a worker process that sends each line to the job's client.
+
+    A job's stream starts with the pid of its worker and ends with None.
+    """
+
+    def __init__(self, progress_queue: SimpleQueue):
+        self.progress_queue = progress_queue
+        self.job_id = None
+        self.buffer = ""
+
+    def write(self, text: str) -> int:
+        self.buffer += text
+        *lines, self.buffer = self.buffer.split("\n")
+        for line in lines:
+            self.progress_queue.put((self.job_id, line))
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def start_job(self, job_id: str):
+        self.job_id = job_id
+        self.progress_queue.put((job_id, os.getpid()))
+
+    def end_job(self):
+        if self.buffer:
+            self.progress_queue.put((self.job_id, self.buffer))
+            self.buffer = ""
+        self.progress_queue.put((self.job_id, None))
+
+
+_progress_stream = None
+_stages = None
+
+
+def _init_worker(progress_queue: SimpleQueue):
+    """Load modules and target metrics once and stream prints of jobs to clients."""
+    global _progress_stream, _stages
+    from app.aggregator import Aggregator
+
+    _stages = _stage_functions()
+    for path in [
+        GCLOUD_TARGET_METRICS_PATH,
+        PROMETHEUS_TARGET_METRICS_PATH,
+        METRIC_TYPE_MAP_PATH,
+    ]:
+        if os.path.exists(path):
+            Aggregator.read_target_metrics_csv(path)
+    _progress_stream = _ProgressStream(progress_queue)
+    sys.stdout = _progress_stream
+
+
+def run_job(job_id: str, job: dict) -> dict:
+    """Run the stages of a job in a warm worker and report its timings."""
+    summary = {
+        "job_id": job_id,
+        "status": "ok",
+        "started_at": time.time(),
+        "stages": {},
+    }
+    _progress_stream.start_job(job_id)
+    try:
+        for stage in job["stages"]:
+            start = time.perf_counter()
+            _stages[stage](job["experiment"], **job.get("options", {}).get(stage, {}))
+            summary["stages"][stage] = round(time.perf_counter() - start, 3)
+    except Exception as e:
+        print(f"Job {job_id} failed: {e!r}")
+        summary["status"] = "failed"
+        summary["error"] = repr(e)
+    finally:
+        _progress_stream.end_job()
+    return summary
+
+
+def check_job(job: dict):
+    if not isinstance(job.get("experiment"), str):
+        raise ValueError("A job needs an experiment!")
+    stages = job.get("stages")
+    if not stages or any(stage not in STAGES for stage in stages):
+        raise ValueError(f"A job needs stages among {list(STAGES)}!")
+
+
+def _live_pids() -> set:
+    return {process.pid for process in multiprocessing.active_children()}
+
+
+class _JobHandler(socketserver.StreamRequestHandler):
+    def send(self, message: dict):
+        self.wfile.write((json.dumps(message) + "\n").encode())
+        self.wfile.flush()
+
+    def handle(self):
+        received_at = time.time()
+        service = self.server.service
+        try:
+            request = json.loads(self.rfile.readline())
+            command = request.get("command", "run")
+            if command == "status":
+                self.send(service.status())
+                return
+            if command == "shutdown":
+                self.send({"event": "shutdown"})
+                self.server.shutdown()
+                return
+            check_job(request)
+        except (ValueError, AttributeError) as e:
+            self.send({"event": "error", "error": repr(e)})
+            return
+        for message in service.run(request, received_at):
+            self.send(message)
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class WorkerService:
+    """Local daemon running aggregation jobs on a pool of warm workers.
+
+    Workers import all modules and read the target metrics once, then run
+    jobs sent as JSON lines over a Unix socket. The prints of a job are
+    streamed back to its client as progress events, followed by a summary
+    with the job latency.
+    """
+
+    def __init__(
+        self, socket_path: str = SOCKET_PATH, processes: int = WORKER_PROCESSES
+    ):
+        self.socket_path = socket_path
+        self.processes = processes
+        # written without a feeder thread, so lines are not lost when a worker dies
+        self.progress_queue = SimpleQueue()
+        self.job_streams = {}
+        self.started_at = time.time()
+        self.num_jobs = 0
+        # forked workers start with the modules of the service loaded
+        _stage_functions()
+        self.pool = Pool(processes, _init_worker, (self.progress_queue,))
+
+    def _dispatch_progress(self):
+        while True:
+            job_id, line = self.progress_queue.get()
+            stream = self.job_streams.get(job_id)
+            if stream is not None:
+                stream.put(line)
+
+    def status(self) -> dict:
+        return {
+            "event": "status",
+            "processes": self.processes,
+            "running": len(self.job_streams),
+            "jobs": self.num_jobs,
+            "uptime_seconds": round(time.time() - self.started_at, 3),
+        }
+
+    def run(self, job: dict, received_at: float):
+        """Run a job on the pool, yielding its progress events then its summary."""
+        job_id = uuid.uuid4().hex[:8]
+        stream = queue.Queue()
+        self.job_streams[job_id] = stream
+        self.num_jobs += 1
+        print(f"Job {job_id}: {job['stages']} of {job['experiment']}")
+        try:
+            result = self.pool.apply_async(run_job, (job_id, job))
+            yield {"event": "accepted", "job_id": job_id}
+            summary = None
+            worker_pid = None
+            while summary is None:
+                try:
+                    line = stream.get(timeout=LIVENESS_SECONDS)
+                except queue.Empty:
+                    # a killed worker never ends its stream nor returns
+                    if worker_pid is not None and worker_pid not in _live_pids():
+                        summary = {
+                            "job_id": job_id,
+                            "status": "failed",
+                            "started_at": started_at,
+                            "stages": {},
+                            "error": f"Worker process {worker_pid} died",
+                        }
+                    continue
+                if line is None:
+                    summary = result.get()
+                elif isinstance(line, int):
+                    worker_pid, started_at = line, time.time()
+                else:
+                    yield {"event": "progress", "job_id": job_id, "line": line}
+        finally:
+            del self.job_streams[job_id]
+        summary["start_latency_seconds"] = round(
+            summary.pop("started_at") - received_at, 6
+        )
+        summary["seconds"] = round(time.time() - received_at, 3)
+        print(
+            f"Job {job_id} {summary['status']} in {summary['seconds']}s, "
+            f"started after {summary['start_latency_seconds'] * 1000:.1f}ms"
+        )
+        yield {"event": "done", **summary}
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        threading.Thread(target=self._dispatch_progress, daemon=True).start()
+        with _UnixServer(self.socket_path, _JobHandler) as server:
+            server.service = self
+            print(f"Serving {self.processes} workers on {self.socket_path}")
+            try:
+                server.serve_forever()
+            finally:
+                self.pool.terminate()
+                os.remove(self.socket_path)
+
+
+def request(message: dict, socket_path: str = SOCKET_PATH):
+    """Send a request to the service and yield the events it replies with."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        with sock.makefile("rwb") as fp:
+            fp.write((json.dumps(message) + "\n").encode())
+            fp.flush()
+            for line in fp:
+                yield json.loads(line)
+
+
+def submit_job(
+    experiment: str,
+    stages: list,
+    options: dict = None,
+    socket_path: str = SOCKET_PATH,
+) -> dict:
+    """Run a job on the service, printing its progress, returns its summary."""
+    job = {"experiment": experiment, "stages": list(stages), "options": options or {}}
+    summary = None
+    for event in request(job, socket_path):
+        if event["event"] == "progress":
+            print(event["line"])
+        elif event["event"] in ["done", "error"]:
+            summary = event
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Warm worker service running aggregation jobs"
+    )
+    parser.add_argument("--socket-path", default=SOCKET_PATH)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parser_serve = subparsers.add_parser("serve")
+    parser_serve.add_argument("--processes", type=int, default=WORKER_PROCESSES)
+    parser_submit = subparsers.add_parser("submit")
+    parser_submit.add_argument("experiment")
+    parser_submit.add_argument(
+        "--stages", nargs="+", choices=list(STAGES), default=["aggregate", "merge"]
+    )
+    parser_submit.add_argument(
+        "--options",
+        type=json.loads,
+        default={},
+        help='options by stage as JSON, e.g. {"fuse": {"debug_intermediate": true}}',
+    )
+    subparsers.add_parser("status")
+    subparsers.add_parser("shutdown")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        WorkerService(args.socket_path, args.processes).serve_forever()
+    elif args.command == "submit":
+        summary = submit_job(
+            args.experiment, args.stages, args.options, args.socket_path
+        )
+        print(summary)
+        if summary is None or summary.get("status") != "ok":
+            sys.exit(1)
+    else:
+        for event in request({"command": args.command}, args.socket_path):
+            print(event)
+
+
+if __name__ == "__main__":
+    main()
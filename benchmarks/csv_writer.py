@@ -0,0 +1,73 @@
+import argparse
+import filecmp
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from app.csv_writer import write_csv_blocks
+
+
+def gen_df(num_rows: int, num_cols: int, nan_ratio: float) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(num_rows, num_cols)).cumsum(axis=0)
+    values[rng.random(values.shape) < nan_ratio] = np.nan
+    index = pd.date_range("2023-01-01", periods=num_rows, freq="min", name="timestamp")
+    return pd.DataFrame(
+        values, index=index, columns=[f"gm-{i}-value" for i in range(num_cols)]
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the block CSV writer with DataFrame.to_csv."
+    )
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--cols", type=int, default=10000)
+    parser.add_argument("--nan-ratio", type=float, default=0.1)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--float-precision", type=int, default=6)
+    args = parser.parse_args()
+
+    df = gen_df(args.rows, args.cols, args.nan_ratio)
+    print(f"{args.rows} rows x {args.cols} columns, {args.workers} workers")
+
+    with tempfile.TemporaryDirectory() as tmp_path:
+        naive_path = os.path.join(tmp_path, "naive.csv")
+        start = time.perf_counter()
+        df.to_csv(naive_path)
+        naive_seconds = time.perf_counter() - start
+        size = os.path.getsize(naive_path) / (1 << 20)
+        print(f"DataFrame.to_csv: {naive_seconds:.2f}s ({size:.0f} MiB)")
+
+        fast_path = os.path.join(tmp_path, "fast.csv")
+        start = time.perf_counter()
+        with open(fast_path, "wb") as fp:
+            write_csv_blocks(df, fp, workers=args.workers)
+        fast_seconds = time.perf_counter() - start
+        print(
+            f"write_csv_blocks: {fast_seconds:.2f}s "
+            f"({naive_seconds / fast_seconds:.1f}x), byte-identical "
+            f"{filecmp.cmp(naive_path, fast_path, shallow=False)}"
+        )
+
+        precision_path = os.path.join(tmp_path, "precision.csv")
+        start = time.perf_counter()
+        with open(precision_path, "wb") as fp:
+            write_csv_blocks(
+                df,
+                fp,
+                workers=args.workers,
+                float_format=f"%.{args.float_precision}g",
+            )
+        precision_seconds = time.perf_counter() - start
+        size = os.path.getsize(precision_path) / (1 << 20)
+        print(
+            f"write_csv_blocks with {args.float_precision} digits: "
+            f"{precision_seconds:.2f}s ({size:.0f} MiB)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from app.rolling_features import ROLLING_WINDOWS, compute_rolling_features
+
+
+def gen_df(num_rows: int, num_cols: int, nan_ratio: float) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(num_rows, num_cols)).cumsum(axis=0)
+    values[rng.random(values.shape) < nan_ratio] = np.nan
+    index = pd.date_range("2023-01-01", periods=num_rows, freq="min", name="timestamp")
+    return pd.DataFrame(
+        values, index=index, columns=[f"gm-{i}-value" for i in range(num_cols)]
+    )
+
+
+def naive_rate(df: pd.DataFrame, window: int) -> pd.DataFrame:
+    """Per second change between the first and last valid values of each window."""
+    values = df.reset_index(drop=True)
+    rows = values.apply(lambda col: col.index.to_series()).where(values.notna())
+
+    def first_valid(df_valid: pd.DataFrame) -> pd.DataFrame:
+        # pad the front, so that early windows start at the first row
+        padded = df_valid.reindex(range(1 - window, len(df_valid)))
+        return padded.bfill(limit=window - 1).shift(window - 1).iloc[window - 1 :]
+
+    first_rows = first_valid(rows)
+    last_rows = rows.ffill()
+    rate = (values.ffill() - first_valid(values)) / ((last_rows - first_rows) * 60)
+    return rate.where(first_rows < last_rows).set_axis(df.index)
+
+
+def naive_rolling_features(df: pd.DataFrame, windows: tuple) -> pd.DataFrame:
+    df_feature_list = []
+    for window in windows:
+        rolling = df.rolling(window, min_periods=1)
+        for stat, df_stat in [
+            ("mean", rolling.mean()),
+            ("std", rolling.std()),
+            ("min", rolling.min()),
+            ("max", rolling.max()),
+            ("rate", naive_rate(df, window)),
+        ]:
+            df_feature_list.append(df_stat.add_suffix(f"-w{window}-{stat}"))
+    return pd.concat(df_feature_list, axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare rolling features with the naive DataFrame.rolling approach."
+    )
+    parser.add_argument("--rows", type=int, default=1440)
+    parser.add_argument("--cols", type=int, default=5000)
+    parser.add_argument("--nan-ratio", type=float, default=0.1)
+    args = parser.parse_args()
+
+    df = gen_df(args.rows, args.cols, args.nan_ratio)
+    print(f"{args.rows} rows x {args.cols} columns, windows {ROLLING_WINDOWS}")
+
+    start = time.perf_counter()
+    df_naive = naive_rolling_features(df, ROLLING_WINDOWS)
+    naive_seconds = time.perf_counter() - start
+    print(f"DataFrame.rolling: {naive_seconds:.2f}s")
+
+    start = time.perf_counter()
+    df_fast = compute_rolling_features(df, ROLLING_WINDOWS)
+    fast_seconds = time.perf_counter() - start
+    print(
+        f"rolling_features: {fast_seconds:.2f}s ({naive_seconds / fast_seconds:.1f}x)"
+    )
+
+    df_fast = df_fast[df_naive.columns]
+    max_diff = np.nanmax(np.abs(df_fast.to_numpy() - df_naive.to_numpy()))
+    same_nans = (df_fast.isna().to_numpy() == df_naive.isna().to_numpy()).all()
+    print(f"max abs difference {max_diff:.3g}, identical NaN layout {same_nans}")
+
+
+if __name__ == "__main__":
+    main()
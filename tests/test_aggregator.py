@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+from app.aggregator import Aggregator
+from app.sparse_frame import SparseFrame
+
+NAN = np.nan
+
+
+def test_reduce_cumulative_takes_resets_as_deltas():
+    index = pd.date_range("2024-01-02", periods=5, freq="min")
+    for name in [None, "requests_total", 0]:
+        series = pd.Series([1.0, 3.0, 6.0, 2.0, NAN], index=index, name=name)
+        reduced = Aggregator.reduce_cumulative(series)
+        assert reduced.name == name
+        pd.testing.assert_index_equal(reduced.index, index)
+        np.testing.assert_array_equal(reduced.to_numpy(), [NAN, 2, 3, 2, NAN])
+
+
+def test_reduce_cumulative_frame_per_second_and_gaps():
+    # rows 30s, 60s and 120s apart
+    index = pd.to_datetime(
+        [f"2024-01-02 00:{t}" for t in ["00:00", "00:30", "01:30", "03:30", "04:30"]]
+    )
+    df = pd.DataFrame(
+        {
+            "a": [0.0, 30.0, 90.0, 210.0, 10.0],
+            # a gap yields no delta on both of its sides
+            "b": [1.0, NAN, 5.0, 7.0, 8.0],
+        },
+        index=index,
+    )
+    expected_deltas = [[NAN, NAN], [30, NAN], [60, NAN], [120, 2], [10, 1]]
+    np.testing.assert_array_equal(
+        Aggregator.reduce_cumulative_frame(df).to_numpy(), expected_deltas
+    )
+    seconds = np.array([NAN, 30, 60, 120, 60])[:, np.newaxis]
+    expected_rates = np.array(expected_deltas) / seconds
+    np.testing.assert_allclose(
+        Aggregator.reduce_cumulative_frame(df, per_second=True).to_numpy(),
+        expected_rates,
+    )
+    frame = SparseFrame.from_dense(df)
+    for per_second, expected in [(False, expected_deltas), (True, expected_rates)]:
+        reduced = frame.reduce_cumulative(per_second).to_dense()
+        np.testing.assert_allclose(reduced.to_numpy(), expected)
+        pd.testing.assert_index_equal(reduced.columns, df.columns)
@@ -0,0 +1,66 @@
+import multiprocessing
+import os
+
+import pandas as pd
+import pytest
+from app.checkpoint import RunJournal, atomic_output, write_csv
+
+
+def test_atomic_output_replaces_file_on_success(tmp_path):
+    path = str(tmp_path / "out.csv")
+    with atomic_output(path) as fp:
+        fp.write("old\n")
+    with pytest.raises(RuntimeError):
+        with atomic_output(path) as fp:
+            fp.write("partial")
+            raise RuntimeError("crash while writing")
+    with open(path) as fp:
+        assert fp.read() == "old\n"
+    assert os.listdir(tmp_path) == ["out.csv"]
+
+
+def test_write_csv_matches_to_csv(tmp_path):
+    df = pd.DataFrame({"a": [0.1, 2.0 / 3.0], "b": [1, 2]})
+    write_csv(df, str(tmp_path / "out.csv"), float_precision=4)
+    with open(tmp_path / "out.csv") as fp:
+        assert fp.read() == df.to_csv(float_format="%.4g")
+
+
+def mark_units(path: str, worker: int):
+    journal = RunJournal(path, resume=True)
+    for metric in range(50):
+        journal.mark_done("exp", f"source-{worker}", "merge", metric)
+
+
+def test_journal_resumes_completed_units(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = RunJournal(path)
+    journal.mark_done("exp", "gcloud", "merge", 3)
+    assert journal.is_done("exp", "gcloud", "merge", "3")
+    # a crash can leave an incomplete last line
+    with open(path, "a") as fp:
+        fp.write('{"experiment": "exp", "sou')
+    resumed = RunJournal(path, resume=True)
+    assert resumed.completed == {("exp", "gcloud", "merge", "3")}
+    assert not resumed.is_done("exp", "gcloud", "aggregate", 3)
+    # a fresh run starts over
+    assert RunJournal(path).completed == set()
+    assert not os.path.exists(path)
+
+
+def test_journal_collects_units_of_several_processes(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    context = multiprocessing.get_context("fork")
+    processes = [
+        context.Process(target=mark_units, args=(path, worker)) for worker in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(30)
+        assert process.exitcode == 0
+    assert RunJournal.read_units(path) == {
+        ("exp", f"source-{worker}", "merge", str(metric))
+        for worker in range(4)
+        for metric in range(50)
+    }
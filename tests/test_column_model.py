@@ -0,0 +1,99 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from app.column_model import (
+    UNIFIED_PATTERN,
+    concat_level,
+    flatten_columns,
+    kpi_ids,
+    parse_columns,
+)
+from app.merger import reindex_kpis
+
+UNIFIED_COLUMNS = pd.Index(
+    ["agg-kpi-1-mean", "agg-kpi-12-percentile_99", "agg-kpi-3-50", "agg-kpi-40"]
+)
+
+
+def test_parse_and_flatten_round_trip():
+    columns = parse_columns(UNIFIED_COLUMNS, UNIFIED_PATTERN)
+    assert list(columns.get_level_values("kpi")) == [1, 12, 3, 40]
+    assert list(columns.get_level_values("statistic")[:3]) == [
+        "mean",
+        "percentile_99",
+        "50",
+    ]
+    assert pd.isna(columns.get_level_values("statistic")[3])
+    assert list(flatten_columns(columns, "agg-kpi-{kpi}-{statistic}")) == [
+        "agg-kpi-1-mean",
+        "agg-kpi-12-percentile_99",
+        "agg-kpi-3-50",
+        "agg-kpi-40-",
+    ]
+    assert list(flatten_columns(columns, "kpi-{kpi:03d}")) == [
+        "kpi-001",
+        "kpi-012",
+        "kpi-003",
+        "kpi-040",
+    ]
+    assert list(kpi_ids(pd.Index(["value-7", "value-10"]))) == [7, 10]
+    with pytest.raises(ValueError, match="value-x"):
+        kpi_ids(pd.Index(["value-1", "value-x"]))
+
+
+def test_flatten_nested_levels():
+    df = pd.DataFrame(np.zeros((1, 2)), columns=["cpu", "memory"])
+    df_all = concat_level([df, df], [1, 2], ["metric", "name"])
+    assert list(flatten_columns(df_all.columns, "metric-{metric}-{name}")) == [
+        "metric-1-cpu",
+        "metric-1-memory",
+        "metric-2-cpu",
+        "metric-2-memory",
+    ]
+
+
+def write_aggregated(path, kpi_map: list, columns: list) -> str:
+    os.makedirs(path)
+    df_kpi_map = pd.DataFrame(kpi_map, index=range(1, len(kpi_map) + 1))
+    df_kpi_map.to_csv(os.path.join(path, "metric-1-kpi-map.csv"))
+    index = pd.Index(["2024-01-02 00:00:00", "2024-01-02 00:01:00"], name="timestamp")
+    values = np.arange(2 * len(columns), dtype="float64").reshape(2, -1)
+    pd.DataFrame(values, index=index, columns=columns).to_csv(
+        os.path.join(path, "metric-1.csv")
+    )
+    return str(path)
+
+
+def test_reindex_kpis_keeps_statistics(tmp_path):
+    path_a = write_aggregated(
+        tmp_path / "a",
+        [{"instance": "b"}, {"instance": "c"}],
+        ["agg-kpi-1-mean", "agg-kpi-1-percentile_99", "agg-kpi-2-50"],
+    )
+    path_b = write_aggregated(
+        tmp_path / "b",
+        [{"instance": "a"}, {"instance": "c"}],
+        ["agg-kpi-2", "agg-kpi-1-percentile_99", "agg-kpi-2-percentile_5"],
+    )
+    df_target_metrics = pd.DataFrame({"name": ["node_load1"]}, index=[1])
+    unified_paths = [str(tmp_path / "a-unified"), str(tmp_path / "b-unified")]
+    reindex_kpis(df_target_metrics, [path_a, path_b], str(tmp_path), unified_paths)
+    df_map = pd.read_csv(tmp_path / "kpi-map" / "metric-1-kpi-map.csv", index_col=0)
+    assert df_map["instance"].to_dict() == {1: "a", 2: "b", 3: "c"}
+    df_a = pd.read_csv(os.path.join(unified_paths[0], "metric-1.csv"), index_col=0)
+    df_b = pd.read_csv(os.path.join(unified_paths[1], "metric-1.csv"), index_col=0)
+    # b and c of experiment a become 2 and 3, a and c of experiment b 1 and 3
+    assert list(df_a.columns) == [
+        "agg-kpi-2-mean",
+        "agg-kpi-2-percentile_99",
+        "agg-kpi-3-50",
+    ]
+    assert list(df_b.columns) == [
+        "agg-kpi-1-percentile_99",
+        "agg-kpi-3",
+        "agg-kpi-3-percentile_5",
+    ]
+    np.testing.assert_array_equal(df_a.to_numpy(), [[0, 1, 2], [3, 4, 5]])
+    np.testing.assert_array_equal(df_b.to_numpy(), [[1, 0, 2], [4, 3, 5]])
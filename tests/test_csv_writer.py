@@ -0,0 +1,44 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from app.checkpoint import BackgroundWriter
+from app.csv_writer import _executor, write_csv_blocks
+
+
+def test_executor_uses_threads_while_other_threads_run():
+    df = pd.DataFrame(np.zeros((4, 2)))
+    writer = BackgroundWriter()
+    future = writer.executor.submit(_executor, 2, df, {})
+    executor, _ = future.result()
+    with executor:
+        assert isinstance(executor, ThreadPoolExecutor)
+    # the writer thread is still alive
+    executor, _ = _executor(2, df, {})
+    with executor:
+        assert isinstance(executor, ThreadPoolExecutor)
+    writer.close()
+    executor, _ = _executor(2, df, {})
+    with executor:
+        assert isinstance(executor, ProcessPoolExecutor)
+
+
+def test_missing_timestamps_match_to_csv(tmp_path):
+    index = pd.DatetimeIndex(["2024-01-02 00:00", None, "2024-01-02 00:01:30"])
+    df = pd.DataFrame({"a": [1.0, np.nan, 3.0]}, index=index)
+    for kwargs in [{}, {"na_rep": "NA"}, {"index_label": "timestamp"}]:
+        with open(tmp_path / "blocks.csv", "wb") as fp:
+            write_csv_blocks(df, fp, workers=2, block_rows=1, **kwargs)
+        with open(tmp_path / "blocks.csv", "rb") as fp:
+            assert fp.read() == df.to_csv(**kwargs).encode()
+
+
+def test_blocks_from_background_thread_match_to_csv(tmp_path):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.random((1000, 8)), columns=[f"c{i}" for i in range(8)])
+    with open(tmp_path / "blocks.csv", "wb") as fp:
+        writer = BackgroundWriter()
+        writer.submit(write_csv_blocks, df, fp, workers=2, block_rows=100)
+        writer.close()
+    with open(tmp_path / "blocks.csv", "rb") as fp:
+        assert fp.read() == df.to_csv().encode()
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from app.dataset_sink import list_partitions, read_merged_dataset, write_merged_dataset
+
+
+def gen_merged(seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    index = pd.date_range("2024-01-01 22:00", periods=300, freq="min", unit="ns")
+    columns = ["gm-cpu", "pm-load", "lm-latency", "other"]
+    return pd.DataFrame(rng.random((300, 4)), index=index, columns=columns)
+
+
+def test_filters_match_pandas_and_prune_partitions(tmp_path):
+    dataset_path = str(tmp_path)
+    experiments = {
+        "exp-a": gen_merged(0),
+        "exp-b": gen_merged(1),
+        "other": gen_merged(2),
+    }
+    for experiment, df in experiments.items():
+        write_merged_dataset(df, dataset_path, experiment, row_group_size=60)
+    df_partitions = list_partitions(dataset_path)
+    assert len(df_partitions) == 6
+    # files outside the filters are never opened
+    for partition in df_partitions.itertuples():
+        if partition.experiment == "other" or partition.day.day == 1:
+            with open(partition.path, "wb") as fp:
+                fp.write(b"not parquet")
+    start, end = "2024-01-02 00:30", "2024-01-02 01:10"
+    df = read_merged_dataset(
+        dataset_path, "exp-*", start, end, column_prefixes=("gm-", "pm-")
+    )
+    df_expected = pd.concat(
+        [
+            experiments[experiment]
+            .loc[start:end, ["gm-cpu", "pm-load"]]
+            .assign(experiment=experiment)
+            for experiment in ["exp-a", "exp-b"]
+        ]
+    )
+    df_expected.index.name = "timestamp"
+    pd.testing.assert_frame_equal(
+        df.sort_index(axis=1), df_expected.sort_index(axis=1), check_freq=False
+    )
+    single = read_merged_dataset(dataset_path, ["exp-b"], start, end)
+    assert "experiment" not in single.columns
+    np.testing.assert_array_equal(
+        single.to_numpy(), experiments["exp-b"].loc[start:end].to_numpy()
+    )
+
+
+def test_row_groups_keep_timestamp_statistics(tmp_path):
+    df = gen_merged(3)
+    write_merged_dataset(df, str(tmp_path), "exp", row_group_size=60)
+    path = list_partitions(str(tmp_path))["path"].iloc[-1]
+    metadata = pq.ParquetFile(path).metadata
+    assert metadata.num_row_groups == 3
+    timestamp = metadata.schema.names.index("timestamp")
+    bounds = [metadata.row_group(i).column(timestamp).statistics for i in range(3)]
+    assert all(stats.has_min_max for stats in bounds)
+    assert [pd.Timestamp(stats.min) for stats in bounds] == list(
+        pd.date_range("2024-01-02", periods=3, freq="60min")
+    )
+    assert read_merged_dataset(str(tmp_path), ["missing"]).empty
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+from app.gcloud_aggregator import GCloudAggregator
+
+
+def summarize(samples: list) -> tuple:
+    """Count, mean and sum of squared deviations of samples, NaN when empty."""
+    if not len(samples):
+        return 0.0, np.nan, np.nan
+    return len(samples), np.mean(samples), np.sum((samples - np.mean(samples)) ** 2)
+
+
+def test_merge_distributions_matches_concatenated_samples():
+    rng = np.random.default_rng(0)
+    # rows of KPIs with 0, 1 or more samples each
+    samples = [
+        [rng.normal(i, 1 + j, size=rng.integers(0, 6)) for j in range(4)]
+        for i in range(20)
+    ]
+    summaries = np.array([[summarize(kpi) for kpi in row] for row in samples])
+    counts, means, squared_deviations = (summaries[:, :, i] for i in range(3))
+    total_count, pooled_mean, pooled_squared_deviation = (
+        GCloudAggregator.merge_distributions(counts, means, squared_deviations)
+    )
+    for i, row in enumerate(samples):
+        pooled = np.concatenate(row)
+        assert total_count[i] == len(pooled)
+        if len(pooled) == 0:
+            assert np.isnan(pooled_mean[i]) and np.isnan(pooled_squared_deviation[i])
+            continue
+        assert pooled_mean[i] == pytest.approx(np.mean(pooled))
+        if len(pooled) > 1:
+            assert pooled_squared_deviation[i] / (len(pooled) - 1) == pytest.approx(
+                np.var(pooled, ddof=1)
+            )
+
+
+def test_reduce_cumulative_distributions_gives_interval_distributions():
+    rng = np.random.default_rng(1)
+    index = pd.date_range("2024-01-02", periods=8, freq="min")
+    intervals = {
+        kpi: [rng.normal(kpi, 2, size=rng.integers(0, 5)) for _ in index]
+        for kpi in [3, 7]
+    }
+    # the counter of KPI 7 is reset before the sixth row
+    columns = {}
+    for kpi, samples in intervals.items():
+        cumulative = [
+            summarize(
+                np.concatenate(samples[(5 if kpi == 7 and i >= 5 else 0) : i + 1])
+            )
+            for i in range(len(index))
+        ]
+        for j, statistic in enumerate(["count", "mean", "sum_of_squared_deviation"]):
+            columns[(kpi, statistic)] = [summary[j] for summary in cumulative]
+    df_metric = pd.DataFrame(columns, index=index)
+    df_metric.columns.names = ["kpi", "statistic"]
+    df_reduced = GCloudAggregator.reduce_cumulative_distributions(df_metric)
+    assert df_reduced.iloc[0].isna().all()
+    for kpi, samples in intervals.items():
+        for i in range(1, len(index)):
+            count, mean, squared_deviation = summarize(samples[i])
+            assert df_reduced.loc[index[i], (kpi, "count")] == count
+            if count:
+                assert df_reduced.loc[index[i], (kpi, "mean")] == pytest.approx(mean)
+                assert df_reduced.loc[
+                    index[i], (kpi, "sum_of_squared_deviation")
+                ] == pytest.approx(squared_deviation, abs=1e-9)
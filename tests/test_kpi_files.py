@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+from app.kpi_files import parse_kpi_csv, read_kpi_data
+
+
+def test_parse_short_fields_with_gaps():
+    columns, timestamps, values = parse_kpi_csv(b"timestamp,value\n1,\n2,3\n")
+    assert columns == ["value"]
+    assert timestamps.tolist() == [1, 2]
+    assert np.isnan(values[0, 0]) and values[1, 0] == 3
+
+
+def test_parse_matches_read_csv():
+    data = b"timestamp,count,mean\n60,1,0.1\n120,,2.5e-3\n180.5,4,\n"
+    columns, timestamps, values = parse_kpi_csv(data)
+    with pytest.raises(ValueError):
+        parse_kpi_csv(b'timestamp,value\n1,"2"\n')
+    fallback = read_kpi_data(
+        b'timestamp,count,mean\n60,1,0.1\n120,,2.5e-3\n180.5,4,""\n'
+    )
+    assert columns == fallback[0]
+    np.testing.assert_array_equal(timestamps, fallback[1])
+    np.testing.assert_array_equal(values, fallback[2])
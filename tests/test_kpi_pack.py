@@ -0,0 +1,26 @@
+import os
+
+from app.kpi_pack import metric_type_indices, pack_metrics_folder, read_metric_type
+
+
+def write_metric_type(metrics_path, metric_index: int):
+    metric_type_path = os.path.join(metrics_path, f"metric-type-{metric_index}")
+    os.makedirs(metric_type_path)
+    with open(os.path.join(metric_type_path, "kpi_map.jsonl"), "w") as fp:
+        fp.write('{"index": 1, "kpi": {"pod_name": "alms-a"}}\n')
+    with open(os.path.join(metric_type_path, "kpi-1.csv"), "w") as fp:
+        fp.write("timestamp,value\n1,\n2,3\n")
+
+
+def test_metric_type_indices_ignore_temporary_files(tmp_path):
+    write_metric_type(tmp_path, 3)
+    write_metric_type(tmp_path, 12)
+    pack_metrics_folder(str(tmp_path))
+    # left by an interrupted atomic_output
+    open(tmp_path / "metric-type-3.kpipack.0123abcd.tmp", "w").close()
+    open(tmp_path / "metric-type-list.txt", "w").close()
+    assert sorted(metric_type_indices(str(tmp_path)), key=int) == ["3", "12"]
+    pack_metrics_folder(str(tmp_path), force=True)
+    kpi_map_list, kpis = read_metric_type(str(tmp_path / "metric-type-3"))
+    assert kpi_map_list == [{"index": 1, "kpi": {"pod_name": "alms-a"}}]
+    assert len(list(kpis)) == 1
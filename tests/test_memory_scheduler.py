@@ -0,0 +1,154 @@
+import json
+import os
+import time
+
+import numpy as np
+import pytest
+from app.memory_scheduler import (
+    DEFAULT_MEMORY_MODELS,
+    MIN_MEASUREMENTS,
+    MemoryModel,
+    run_with_memory_budget,
+)
+
+MIB = 1 << 20
+
+
+def log_interval(log_path: str, name: str, seconds: float = 0.2):
+    start = time.time()
+    time.sleep(seconds)
+    with open(log_path, "a") as fp:
+        fp.write(f"{name} {start} {time.time()}\n")
+
+
+def allocate(mebibytes: int):
+    np.ones(mebibytes * MIB // 8).sum()
+
+
+def fail():
+    raise ValueError("bad input")
+
+
+def die():
+    os._exit(3)
+
+
+def byte_model() -> MemoryModel:
+    # estimates are the input bytes of a task
+    model = MemoryModel(safety_factor=1.0)
+    model.coefficients["test"] = (0.0, 1.0, 0.0)
+    return model
+
+
+def task(name: str, func, args: tuple, input_bytes: int) -> dict:
+    return {
+        "name": name,
+        "kind": "test",
+        "func": func,
+        "args": args,
+        "input_bytes": input_bytes,
+        "series": 0,
+    }
+
+
+def test_running_tasks_fit_the_budget(tmp_path):
+    log_path = str(tmp_path / "intervals.log")
+    estimates = {"a": 8, "b": 6, "c": 3, "d": 2, "e": 1, "huge": 12}
+    tasks = [
+        task(name, log_interval, (log_path, name), estimate)
+        for name, estimate in estimates.items()
+    ]
+    summaries = run_with_memory_budget(
+        tasks, memory_budget=10, max_processes=4, model=byte_model()
+    )
+    assert {summary["status"] for summary in summaries} == {"ok"}
+    with open(log_path) as fp:
+        intervals = {
+            name: (float(start), float(end)) for name, start, end in map(str.split, fp)
+        }
+    assert set(intervals) == set(estimates)
+    for name, (start, _) in intervals.items():
+        running = [
+            other
+            for other, (other_start, other_end) in intervals.items()
+            if other_start <= start < other_end
+        ]
+        if name == "huge":
+            # heavier than the whole budget, so it runs alone
+            assert running == ["huge"]
+        else:
+            assert sum(estimates[other] for other in running) <= 10
+    # the heaviest task that fits is started first
+    assert min(intervals, key=lambda name: intervals[name][0]) == "huge"
+
+
+def test_failures_are_reported_and_peaks_recorded(tmp_path):
+    profile_path = str(tmp_path / "profile.jsonl")
+    model = byte_model()
+    model.profile_path = profile_path
+    # the parent footprint is not counted towards the peak of its children
+    inherited = np.ones(200 * MIB // 8)
+    summaries = {
+        summary["name"]: summary
+        for summary in run_with_memory_budget(
+            [
+                task("small", allocate, (1,), 1),
+                task("heavy", allocate, (100,), 1),
+                task("fail", fail, (), 1),
+                task("die", die, (), 1),
+            ],
+            memory_budget=10,
+            max_processes=1,
+            model=model,
+        )
+    }
+    assert inherited.sum() > 0
+    assert summaries["small"]["peak_bytes"] < 50 * MIB
+    assert 100 * MIB <= summaries["heavy"]["peak_bytes"] < 150 * MIB
+    assert summaries["fail"]["status"] == "failed"
+    assert "bad input" in summaries["fail"]["error"]
+    assert summaries["die"]["status"] == "failed"
+    assert "exit code 3" in summaries["die"]["error"]
+    recorded = MemoryModel.read_measurements(profile_path)
+    assert sorted(m["name"] for m in recorded) == ["heavy", "small"]
+
+
+def test_calibration_fits_measurements(tmp_path):
+    profile_path = str(tmp_path / "profile.jsonl")
+    rng = np.random.default_rng(0)
+    with open(profile_path, "w") as fp:
+        for input_bytes, series in rng.integers(1, 1 << 20, size=(8, 2)).tolist():
+            peak = 100 * MIB + 3 * input_bytes + 2048 * series
+            measurement = {
+                "kind": "prometheus",
+                "input_bytes": input_bytes,
+                "series": series,
+                "peak_bytes": peak,
+            }
+            fp.write(json.dumps(measurement) + "\n")
+        fp.write('{"kind": "prometheus", "input_b\n')
+        for _ in range(MIN_MEASUREMENTS - 1):
+            fp.write(
+                json.dumps(
+                    {"kind": "gcloud", "input_bytes": 1, "series": 1, "peak_bytes": 1}
+                )
+                + "\n"
+            )
+    model = MemoryModel(profile_path, safety_factor=1.0)
+    assert model.coefficients["prometheus"] == pytest.approx((100 * MIB, 3, 2048))
+    # too few measurements to replace the default model
+    assert model.coefficients["gcloud"] == DEFAULT_MEMORY_MODELS["gcloud"]
+    assert model.estimate("prometheus", 10, 1) == pytest.approx(100 * MIB + 30 + 2048)
+
+
+def test_calibration_clips_negative_coefficients():
+    model = MemoryModel()
+    model.calibrate(
+        [
+            {"kind": "locust", "input_bytes": b, "series": 0, "peak_bytes": 1000 - b}
+            for b in range(MIN_MEASUREMENTS)
+        ]
+    )
+    base, per_byte, per_series = model.coefficients["locust"]
+    assert base == pytest.approx(1000)
+    assert per_byte == 0 and per_series == 0
@@ -0,0 +1,133 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from app import merger
+from app.checkpoint import RunJournal
+from app.column_pruning import chunk_rows_of
+
+
+def write_experiment(path, folder: str, df: pd.DataFrame):
+    os.makedirs(path / folder)
+    df.to_csv(path / folder / f"{folder}.csv", index_label="timestamp")
+
+
+def test_chunk_rows_shrink_with_columns():
+    assert chunk_rows_of(4, chunk_cells=64) == 16
+    assert chunk_rows_of(100, chunk_cells=64) == 1
+    assert chunk_rows_of(0, chunk_cells=64) == 64
+
+
+def test_pruning_does_not_depend_on_chunk_size(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    index = pd.date_range("2024-01-02", periods=50, freq="min")
+    values = rng.random(50)
+    write_experiment(
+        tmp_path,
+        "exp-1-userapi",
+        pd.DataFrame(
+            {"a": values, "copy_of_a": values, "constant": 1.0, "b": rng.random(50)},
+            index=index,
+        ),
+    )
+    write_experiment(
+        tmp_path,
+        "exp-2-userapi",
+        pd.DataFrame(
+            {
+                "a": values,
+                "copy_of_a": values,
+                "constant": 1.0,
+                "c": rng.random(50),
+                "empty": np.nan,
+            },
+            index=index,
+        ),
+    )
+    monkeypatch.setattr(merger, "FAILURE_INJECTION_PATH", str(tmp_path))
+    outputs = []
+    for chunk_cells in [1 << 22, 10]:
+        df_pruned = merger.prune_merged_faulty_experiments(chunk_cells=chunk_cells)
+        outputs.append(
+            (
+                df_pruned,
+                [
+                    (tmp_path / folder / f"{folder}-pruned.csv").read_bytes()
+                    for folder in ["exp-1-userapi", "exp-2-userapi"]
+                ],
+            )
+        )
+    pd.testing.assert_frame_equal(outputs[0][0], outputs[1][0])
+    assert outputs[0][1] == outputs[1][1]
+    assert set(outputs[0][0]["column"]) == {"copy_of_a", "constant", "empty"}
+
+
+def write_aggregated_experiment(path, folder: str, with_locust: bool = True):
+    rng = np.random.default_rng(len(folder))
+    index = pd.date_range("2024-01-02", periods=20, freq="min", name="timestamp")
+    for aggregated in ["gcloud_aggregated", "prometheus_aggregated"]:
+        os.makedirs(path / folder / aggregated)
+        pd.DataFrame(
+            {"g-mean": rng.random(20), "g-sketch": "0.01|0||"}, index=index
+        ).to_csv(path / folder / aggregated / "metric-1.csv")
+    if with_locust:
+        pd.DataFrame({"rps": rng.random(20)}, index=index).to_csv(
+            path / folder / "locust_aggregated_stats.csv"
+        )
+
+
+@pytest.fixture
+def faulty_experiments(tmp_path, monkeypatch):
+    write_aggregated_experiment(tmp_path, "exp-1-userapi")
+    write_aggregated_experiment(tmp_path, "exp-2-userapi", with_locust=False)
+    write_aggregated_experiment(tmp_path, "exp-3-userapi")
+    pd.DataFrame({"index": [1], "name": ["cpu"], "kind": [1]}).to_csv(
+        tmp_path / "gcloud_targets.csv", index=False
+    )
+    pd.DataFrame({"name": ["load"]}).to_csv(tmp_path / "prom_targets.csv", index=False)
+    monkeypatch.setattr(merger, "FAILURE_INJECTION_PATH", str(tmp_path))
+    monkeypatch.setattr(
+        merger, "GCLOUD_TARGET_METRICS_PATH", str(tmp_path / "gcloud_targets.csv")
+    )
+    monkeypatch.setattr(
+        merger, "PROMETHEUS_TARGET_METRICS_PATH", str(tmp_path / "prom_targets.csv")
+    )
+    return tmp_path
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_merge_summary_reports_failed_experiments(faulty_experiments, processes):
+    path = faulty_experiments
+    journal = RunJournal(str(path / "journal.jsonl"))
+    df_summary = merger.merge_faulty_experiments(
+        "*userapi*", processes=processes, journal=journal
+    )
+    assert df_summary["folder"].tolist() == [
+        "exp-1-userapi",
+        "exp-2-userapi",
+        "exp-3-userapi",
+    ]
+    assert df_summary["status"].tolist() == ["ok", "failed", "ok"]
+    assert "FileNotFoundError" in df_summary["error"][1]
+    assert df_summary["rows"].tolist() == [20, 0, 20]
+    assert df_summary["columns"].tolist() == [3, 0, 3]
+    pd.testing.assert_frame_equal(
+        pd.read_csv(path / "merge-summary.csv"), df_summary, check_dtype=False
+    )
+    df_merged = pd.read_csv(path / "exp-1-userapi" / "exp-1-userapi.csv")
+    assert len(df_merged) == 20
+    assert not any(col.endswith("-sketch") for col in df_merged.columns)
+    # a resumed run only retries the failed experiment
+    journal = RunJournal(str(path / "journal.jsonl"), resume=True)
+    df_summary = merger.merge_faulty_experiments(
+        "*userapi*", processes=processes, journal=journal
+    )
+    assert df_summary["folder"].tolist() == ["exp-2-userapi"]
+    assert df_summary["status"].tolist() == ["failed"]
+
+
+def test_merge_one_experiment_raises_errors(faulty_experiments):
+    assert merger.merge_faulty_metrics_from_one_experiment("exp-1-userapi") == (20, 3)
+    with pytest.raises(FileNotFoundError):
+        merger.merge_faulty_metrics_from_one_experiment("exp-2-userapi")
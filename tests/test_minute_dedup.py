@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+from app.minute_dedup import (
+    dedup_minutes,
+    mean_duplicate_rows,
+    minute_keys_to_timestamps,
+    pivot_minutes,
+    to_minute_keys,
+)
+
+T0 = 1704153600  # 2024-01-02 00:00:00
+
+
+def test_minute_keys_round_like_pandas():
+    # ties at 30 seconds round half to even
+    offsets = [0, 29, 30, 31, 90, 150, 89.999, 30.0000001, -30, -31]
+    for timestamps in [
+        np.array(offsets, dtype="float64") + T0,
+        T0 + np.arange(-90, 91),
+    ]:
+        expected = pd.to_datetime(timestamps, unit="s").round("min")
+        keys = to_minute_keys(timestamps)
+        np.testing.assert_array_equal(
+            minute_keys_to_timestamps(keys).to_numpy(), expected.to_numpy()
+        )
+
+
+def gen_long_series(num_points: int = 500):
+    rng = np.random.default_rng(0)
+    series_ids = rng.integers(0, 7, num_points)
+    keys = rng.integers(100, 130, num_points)
+    values = rng.normal(size=num_points)
+    values[rng.random(num_points) < 0.2] = np.nan
+    return series_ids, keys, values
+
+
+def test_dedup_matches_groupby_mean():
+    series_ids, keys, values = gen_long_series()
+    dedup_ids, dedup_keys, means = dedup_minutes(series_ids, keys, values)
+    expected = (
+        pd.DataFrame({"series": series_ids, "key": keys, "value": values})
+        .groupby(["series", "key"])["value"]
+        .mean()
+    )
+    np.testing.assert_array_equal(dedup_ids, expected.index.get_level_values(0))
+    np.testing.assert_array_equal(dedup_keys, expected.index.get_level_values(1))
+    np.testing.assert_allclose(means, expected.to_numpy(), rtol=1e-12)
+
+
+def test_dedup_keeps_sorted_unique_input():
+    series_ids, keys, values = np.array([0, 0, 1]), np.array([5, 6, 5]), np.ones(3)
+    result = dedup_minutes(series_ids, keys, values)
+    for array, expected in zip(result, [series_ids, keys, values]):
+        np.testing.assert_array_equal(array, expected)
+    assert all(len(array) == 0 for array in dedup_minutes([], [], []))
+
+
+def test_pivot_matches_pivot_table():
+    series_ids, keys, values = dedup_minutes(*gen_long_series())
+    unique_keys, matrix = pivot_minutes(series_ids, keys, values, 8)
+    expected = pd.DataFrame({"series": series_ids, "key": keys, "value": values})
+    expected = expected.pivot(index="key", columns="series", values="value")
+    expected = expected.reindex(columns=range(8))
+    np.testing.assert_array_equal(unique_keys, expected.index)
+    np.testing.assert_array_equal(matrix, expected.to_numpy())
+
+
+def test_mean_duplicate_rows_matches_groupby_mean():
+    rng = np.random.default_rng(1)
+    index = pd.DatetimeIndex(
+        pd.to_datetime(T0 + 60 * rng.integers(0, 10, 40), unit="s"), name="timestamp"
+    )
+    values = rng.normal(size=(40, 3))
+    values[rng.random(values.shape) < 0.3] = np.nan
+    df = pd.DataFrame(values, index=index, columns=["a", "b", "c"])
+    pd.testing.assert_frame_equal(
+        mean_duplicate_rows(df), df.groupby(level=0).mean(), rtol=1e-12
+    )
+    df_unique = df.groupby(level=0).mean()
+    assert mean_duplicate_rows(df_unique) is df_unique
@@ -0,0 +1,263 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from app.checkpoint import RunJournal
+from app.minute_dedup import minute_keys_to_timestamps
+from app.prometheus_aggregator import Metric, PrometheusAggregator
+
+MIDNIGHT = 1704153600  # 2024-01-02 00:00:00
+
+
+def write_prometheus_metrics(path, metrics: dict) -> str:
+    """Write a Prometheus metrics folder and its target metrics table.
+
+    `metrics` maps metric names to lists of (labels, timestamps, values).
+    """
+    metrics_path = os.path.join(path, "prometheus-metrics")
+    os.makedirs(metrics_path)
+    names = list(metrics)
+    with open(os.path.join(metrics_path, "metric_names_map.json"), "w") as fp:
+        json.dump({str(i): name for i, name in enumerate(names)}, fp)
+    for metric_index, (name, series) in enumerate(metrics.items(), 1):
+        result = [
+            {
+                "metric": {"__name__": name, **labels},
+                "values": [[float(t), repr(float(v))] for t, v in zip(ts, values)],
+            }
+            for labels, ts, values in series
+        ]
+        with open(
+            os.path.join(metrics_path, f"metric-{metric_index}-day-1.json"), "w"
+        ) as fp:
+            json.dump({"resultType": "matrix", "result": result}, fp)
+    target_metrics_path = os.path.join(path, "prom_targets.csv")
+    pd.DataFrame({"name": names}).to_csv(target_metrics_path, index=False)
+    return target_metrics_path
+
+
+def merge(path, lazy: bool) -> PrometheusAggregator:
+    aggregator = PrometheusAggregator(
+        str(path), "prometheus-metrics", os.path.join(path, "prom_targets.csv")
+    )
+    aggregator.merge_all_submetrics(lazy=lazy)
+    return aggregator
+
+
+def read_bytes(path) -> bytes:
+    with open(path, "rb") as fp:
+        return fp.read()
+
+
+def test_lazy_merge_writes_same_bytes_as_eager(tmp_path):
+    rng = np.random.default_rng(0)
+    # 257 minutes ending at midnight, the last block of 256 rows holds only it
+    ts = MIDNIGHT - np.arange(257)[::-1] * 60 + 5
+    metrics = {
+        "node_load1": [
+            ({"instance": "a"}, ts, np.arange(257.0)),
+            ({"instance": "b"}, ts[::3], rng.random(len(ts[::3]))),
+        ],
+        "container_memory_rss": [
+            ({"namespace": "alms", "pod": "p"}, ts[:100], rng.random(100)),
+            ({"namespace": "other", "pod": "q"}, ts[50:], rng.random(207)),
+        ],
+    }
+    for folder in ["eager", "lazy"]:
+        os.makedirs(tmp_path / folder)
+        write_prometheus_metrics(tmp_path / folder, metrics)
+    merge(tmp_path / "eager", lazy=False)
+    merge(tmp_path / "lazy", lazy=True)
+    for filename in ["metric-1.csv", "metric-2.csv"]:
+        eager_bytes = read_bytes(tmp_path / "eager" / "prometheus_combined" / filename)
+        lazy_bytes = read_bytes(tmp_path / "lazy" / "prometheus_combined" / filename)
+        assert lazy_bytes == eager_bytes
+    assert b"2024-01-02 00:00:00," in lazy_bytes
+
+
+def test_aggregate_without_persisted_label_index(tmp_path):
+    rng = np.random.default_rng(1)
+    ts = MIDNIGHT + np.arange(30) * 60
+    write_prometheus_metrics(
+        tmp_path,
+        {
+            "container_memory_rss": [
+                (
+                    {"namespace": "alms", "container": "c", "pod": "alms-a-x"},
+                    ts,
+                    rng.random(30),
+                ),
+                (
+                    {"namespace": "other", "container": "c", "pod": "b-x"},
+                    ts,
+                    rng.random(30),
+                ),
+            ]
+        },
+    )
+    merge(tmp_path, lazy=False).aggregate_all_metrics()
+    aggregated_path = tmp_path / "prometheus_aggregated" / "metric-1.csv"
+    indexed_bytes = read_bytes(aggregated_path)
+    os.remove(tmp_path / "prometheus_combined" / "label-index.json")
+    PrometheusAggregator(
+        str(tmp_path), "prometheus-metrics", str(tmp_path / "prom_targets.csv")
+    ).aggregate_all_metrics()
+    assert read_bytes(aggregated_path) == indexed_bytes
+
+
+def test_metric_without_series_in_scope_is_skipped(tmp_path):
+    rng = np.random.default_rng(2)
+    ts = MIDNIGHT + np.arange(30) * 60
+    write_prometheus_metrics(
+        tmp_path,
+        {
+            "node_load1": [({"instance": "a"}, ts, rng.random(30))],
+            "namespace_cpu:kube_pod_container_resource_requests:sum": [
+                ({"namespace": "other"}, ts, rng.random(30))
+            ],
+        },
+    )
+    for lazy in [False, True]:
+        aggregator = merge(tmp_path, lazy=lazy)
+        combined_path = tmp_path / "prometheus_combined"
+        assert not os.path.exists(combined_path / "metric-2-kpi-map.csv")
+        aggregator.aggregate_all_metrics()
+        assert os.listdir(tmp_path / "prometheus_aggregated") == ["metric-1.csv"]
+
+
+def gen_result_items() -> list:
+    rng = np.random.default_rng(3)
+    items = []
+    for i, labels in enumerate(
+        [
+            {"namespace": "alms", "pod": "a"},
+            {"namespace": "other", "pod": "b"},
+            {"pod": "c"},
+            {"namespace": "alms", "pod": "d", "container": "x"},
+        ]
+    ):
+        # duplicated minutes, unsorted samples and a NaN value
+        ts = MIDNIGHT + np.sort(rng.integers(0, 600, 15 + i))[::-1]
+        values = rng.random(len(ts))
+        values[3] = np.nan
+        items.append(
+            {
+                "metric": {"__name__": "load", **labels},
+                "values": [[float(t), repr(float(v))] for t, v in zip(ts, values)],
+            }
+        )
+    return items
+
+
+def expected_values(item: dict) -> pd.DataFrame:
+    samples = np.array(item["values"], dtype="float64")
+    timestamps = pd.to_datetime(samples[:, 0].astype("int64"), unit="s")
+    return (
+        pd.DataFrame({"timestamp": timestamps.round("min"), "value": samples[:, 1]})
+        .groupby("timestamp", as_index=False)["value"]
+        .mean()
+    )
+
+
+def assert_same_series(metric_items: list, result_items: list):
+    assert len(metric_items) == len(result_items)
+    for metric_item, result_item in zip(metric_items, result_items):
+        assert metric_item.metadata == result_item["metric"]
+        df_expected = expected_values(result_item)
+        assert len(metric_item) == len(df_expected)
+        pd.testing.assert_frame_equal(
+            metric_item.values, df_expected, check_dtype=False, rtol=1e-12
+        )
+
+
+def test_metric_views_match_series():
+    items = gen_result_items()
+    metric = Metric("load", {"resultType": "matrix", "result": items})
+    assert metric.num_metric_items == 4
+    assert metric.metric_items is metric.metric_items
+    assert_same_series(metric.metric_items, items)
+    # a metric of views of another metric holds the same series
+    subset = Metric("load", metric.metric_items[1:3])
+    assert_same_series(subset.metric_items, items[1:3])
+    assert np.all(
+        subset.keys == np.concatenate([metric.metric_items[i].keys for i in [1, 2]])
+    )
+
+
+def metric_keys(keys: np.ndarray) -> np.ndarray:
+    return minute_keys_to_timestamps(keys).to_numpy()
+
+
+def test_label_predicates_keep_dropped_minutes(tmp_path):
+    items = gen_result_items()
+    metric = Metric(
+        "load", {"resultType": "matrix", "result": items}, namespace=["alms", None]
+    )
+    assert_same_series(metric.metric_items, [items[0], items[2], items[3]])
+    np.testing.assert_array_equal(
+        metric_keys(metric.dropped_keys), expected_values(items[1])["timestamp"]
+    )
+    metric_path = str(tmp_path / "metric-1-day-1.json")
+    with open(metric_path, "w") as fp:
+        json.dump(
+            {"status": "success", "data": {"resultType": "matrix", "result": items}}, fp
+        )
+    dropped_keys = []
+    lazy_items = list(
+        Metric.iter_items(
+            "load", metric_path, dropped_keys=dropped_keys, namespace="alms"
+        )
+    )
+    assert_same_series(lazy_items, [items[0], items[3]])
+    np.testing.assert_array_equal(
+        metric_keys(np.unique(np.concatenate(dropped_keys))),
+        np.unique(pd.concat([expected_values(items[i])["timestamp"] for i in [1, 2]])),
+    )
+    # small reads make items span several chunks of the file
+    decoded = list(Metric.iter_result_items("load", metric_path, chunk_size=64))
+    assert decoded == items
+
+
+def test_resumed_run_skips_journaled_metrics(tmp_path):
+    rng = np.random.default_rng(4)
+    ts = MIDNIGHT + np.arange(30) * 60
+    write_prometheus_metrics(
+        tmp_path,
+        {
+            "node_load1": [({"instance": "a"}, ts, rng.random(30))],
+            "node_load5": [({"instance": "b"}, ts, rng.random(30))],
+        },
+    )
+    journal_path = str(tmp_path / "journal.jsonl")
+
+    def run(resume: bool) -> PrometheusAggregator:
+        aggregator = PrometheusAggregator(
+            str(tmp_path),
+            "prometheus-metrics",
+            str(tmp_path / "prom_targets.csv"),
+            journal=RunJournal(journal_path, resume=resume),
+        )
+        aggregator.merge_all_submetrics()
+        aggregator.aggregate_all_metrics()
+        return aggregator
+
+    run(resume=False)
+    aggregated_path = tmp_path / "prometheus_aggregated"
+    aggregated_bytes = {
+        filename: read_bytes(aggregated_path / filename)
+        for filename in ["metric-1.csv", "metric-2.csv"]
+    }
+    # the run crashed before aggregating metric 2
+    with open(journal_path) as fp:
+        lines = [line for line in fp if '"aggregate", "metric": "2"' not in line]
+    with open(journal_path, "w") as fp:
+        fp.writelines(lines)
+    os.remove(aggregated_path / "metric-2.csv")
+    os.utime(aggregated_path / "metric-1.csv", (0, 0))
+    # merged metrics are not merged again
+    os.remove(tmp_path / "prometheus-metrics" / "metric-1-day-1.json")
+    run(resume=True)
+    assert os.stat(aggregated_path / "metric-1.csv").st_mtime == 0
+    for filename, expected in aggregated_bytes.items():
+        assert read_bytes(aggregated_path / filename) == expected
@@ -0,0 +1,73 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+from app.quantile_sketch import QuantileSketch, merge_sketches, sketch_rows
+
+
+def sketch_of(values) -> QuantileSketch:
+    sketch = QuantileSketch()
+    sketch.add(values)
+    return sketch
+
+
+def test_quantiles_are_within_relative_accuracy():
+    values = np.random.default_rng(0).lognormal(size=1000)
+    sketch = sketch_of(values)
+    for q in [0, 0.1, 0.5, 0.9, 1]:
+        exact = np.quantile(values, q, method="lower")
+        assert sketch.quantile(q) == pytest.approx(exact, rel=0.01)
+
+
+def test_zero_negative_and_nan_values():
+    sketch = sketch_of([-4.0, -1.0, 0.0, 0.0, np.nan, 2.0])
+    assert sketch.count == 5
+    assert sketch.zero_count == 2
+    assert sketch.quantile(0) == pytest.approx(-4, rel=0.01)
+    assert sketch.quantile(0.5) == 0
+    assert sketch.quantile(1) == pytest.approx(2, rel=0.01)
+    assert np.isnan(QuantileSketch().quantile(0.5))
+
+
+def test_infinite_values_are_counted_apart():
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        sketch = sketch_of([1.0, 2.0, np.inf, -np.inf])
+    assert sketch.serialize() == "0.01|0|0:1,35:1||1|1"
+    assert sketch.quantile(0) == -np.inf
+    assert sketch.quantile(1) == np.inf
+    assert sketch.quantile(0.5) == pytest.approx(1, rel=0.01)
+    assert sketch_of([1.0, 2.0]).serialize() == "0.01|0|0:1,35:1|"
+
+
+def test_merge_and_serialize_round_trip():
+    rng = np.random.default_rng(1)
+    parts = [rng.normal(size=200), [0.0, np.inf], rng.normal(size=50)]
+    merged = sketch_of(parts[0])
+    for part in parts[1:]:
+        merged.merge(QuantileSketch.deserialize(sketch_of(part).serialize()))
+    whole = sketch_of(np.concatenate(parts))
+    assert merged.serialize() == whole.serialize()
+    restored = QuantileSketch.deserialize(whole.serialize())
+    assert restored.serialize() == whole.serialize()
+    assert restored.quantile(1) == np.inf
+    with pytest.raises(ValueError):
+        merged.merge(QuantileSketch(0.05))
+
+
+def test_sketch_rows_match_sketches_of_each_row():
+    rng = np.random.default_rng(2)
+    values = rng.normal(size=(5, 8))
+    values[0] = np.nan
+    values[1, :3] = [0.0, np.inf, -np.inf]
+    values[2, ::2] = np.nan
+    df = pd.DataFrame(values)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        sketches = sketch_rows(df)
+    assert np.isnan(sketches.iloc[0])
+    for i in range(1, 5):
+        assert sketches.iloc[i] == sketch_of(values[i]).serialize()
+    merged = merge_sketches(sketches.to_numpy())
+    assert merged.serialize() == sketch_of(values.ravel()).serialize()
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+from app.redundancy import (
+    _load_block,
+    block_correlation,
+    gen_redundancy_analysis,
+    standardize_columns,
+)
+from scipy.sparse.csgraph import connected_components
+
+
+def gen_columns(seed: int, num_rows: int = 300) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    base = rng.standard_normal((num_rows, 3))
+    columns = {}
+    for i in range(12):
+        noise = rng.standard_normal(num_rows) * [0.01, 0.3, 1.0][i % 3]
+        columns[f"gm-{i}"] = base[:, i % 3] * (-1) ** i * (i + 1) + noise
+    columns["pm-constant"] = np.full(num_rows, 7.0)
+    columns["pm-sparse"] = np.where(np.arange(num_rows) < 3, base[:, 0], np.nan)
+    df = pd.DataFrame(columns)
+    # NaN gaps differ from column to column
+    for i, column in enumerate(df.columns[:12]):
+        df.loc[rng.random(num_rows) < 0.05 * (i % 4), column] = np.nan
+    return df
+
+
+def test_block_correlation_matches_pandas_with_nans():
+    df = gen_columns(0)
+    values = df.to_numpy(copy=True)
+    standardize_columns(values)
+    x, mask_x = _load_block(values, 0, 5)
+    y, mask_y = _load_block(values, 5, values.shape[1])
+    correlations = block_correlation(x, mask_x, y, mask_y, min_periods=5)
+    expected = df.corr(min_periods=5).iloc[:5, 5:].to_numpy()
+    np.testing.assert_allclose(correlations, expected, rtol=1e-10, atol=1e-12)
+    # constant columns and pairs with too few common values have no correlation
+    assert np.isnan(correlations[:, df.columns.get_loc("pm-constant") - 5]).all()
+    assert np.isnan(correlations[:, df.columns.get_loc("pm-sparse") - 5]).all()
+
+
+def test_clusters_do_not_depend_on_blocks(tmp_path):
+    df = gen_columns(1)
+    df.index = pd.date_range(
+        "2024-01-02", periods=len(df), freq="min", name="timestamp"
+    )
+    df["other"] = 0.0
+    df.to_csv(tmp_path / "merged.csv")
+    adjacent = df.drop(columns="other").corr().abs().to_numpy() >= 0.95
+    _, expected = connected_components(adjacent, directed=False)
+    results = [
+        gen_redundancy_analysis(
+            str(tmp_path / "merged.csv"),
+            str(tmp_path / f"clusters-{block_columns}.csv"),
+            block_columns=block_columns,
+            chunk_cells=500,
+        )
+        for block_columns in [2, 5, 512]
+    ]
+    for df_clusters in results:
+        assert list(df_clusters["column"]) == list(df.columns[:-1])
+        pd.testing.assert_frame_equal(df_clusters, results[-1])
+    clusters = results[-1]["cluster"].to_numpy()
+    # same partition of the columns as the full correlation matrix
+    assert len(set(zip(clusters, expected))) == len(set(expected))
+    assert len(set(clusters)) == len(set(expected))
+    # nearly noiseless columns 0, 3, 6 and 9 follow the same base series
+    df_clusters = results[-1].set_index("column")
+    assert df_clusters.loc["gm-0", "cluster"] == df_clusters.loc["gm-9", "cluster"]
+    assert df_clusters.loc["gm-0", "cluster_size"] >= 4
+    assert df_clusters.loc["pm-constant", "cluster_size"] == 1
+    assert df_clusters.groupby("cluster")["keep"].sum().eq(1).all()
+    saved = pd.read_csv(tmp_path / "clusters-2.csv")
+    assert saved["keep"].sum() == len(set(clusters))
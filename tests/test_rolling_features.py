@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+from app import rolling_features
+from app.rolling_features import compute_rolling_features, rolling_statistics
+
+
+def gen_values(num_rows: int, num_cols: int, nan_ratio: float) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(num_rows, num_cols)).cumsum(axis=0) + 1000
+    values[rng.random(values.shape) < nan_ratio] = np.nan
+    # a column without values and one with a long gap
+    values[:, 0] = np.nan
+    values[20:90, 1] = np.nan
+    return values
+
+
+@pytest.mark.parametrize("nan_ratio", [0, 0.3, 0.8])
+@pytest.mark.parametrize("min_periods", [1, 3])
+def test_statistics_match_dataframe_rolling(nan_ratio, min_periods):
+    values = gen_values(200, 12, nan_ratio)
+    windows = tuple(w for w in (1, 5, 16, 60, 300) if w >= min_periods)
+    results = rolling_statistics(
+        values, windows, ("mean", "std", "min", "max"), min_periods
+    )
+    df = pd.DataFrame(values)
+    for window in windows:
+        rolling = df.rolling(window, min_periods=min_periods)
+        for stat in ["mean", "std", "min", "max"]:
+            expected = getattr(rolling, stat)().to_numpy()
+            # NaN layouts must match, pandas sums of squares are less exact
+            np.testing.assert_allclose(
+                results[(window, stat)], expected, rtol=1e-9, atol=1e-8
+            )
+
+
+def test_rate_spans_first_and_last_valid_values():
+    values = np.array(
+        [[1.0, 10.0], [np.nan, 11.0], [4.0, 3.0], [7.0, 5.0], [np.nan, 9.0]]
+    )
+    results = rolling_statistics(values, (3,), ("rate", "counter_rate"))
+    rate = results[(3, "rate")]
+    np.testing.assert_allclose(
+        rate[:, 0], [np.nan, np.nan, 3 / 120, 3 / 60, 3 / 60], equal_nan=True
+    )
+    np.testing.assert_allclose(
+        rate[:, 1], [np.nan, 1 / 60, -7 / 120, -6 / 120, 6 / 120], equal_nan=True
+    )
+    # the drop from 11 to 3 is a reset of the counter
+    counter_rate = results[(3, "counter_rate")]
+    np.testing.assert_allclose(
+        counter_rate[:, 1], [np.nan, 1 / 60, 4 / 120, 5 / 120, 6 / 120], equal_nan=True
+    )
+    np.testing.assert_allclose(counter_rate[:, 0], rate[:, 0], equal_nan=True)
+
+
+def test_unsupported_statistic_is_rejected():
+    with pytest.raises(ValueError):
+        rolling_statistics(np.zeros((3, 1)), (2,), ("median",))
+
+
+def test_features_fill_missing_minutes(monkeypatch):
+    values = gen_values(120, 30, 0.2)
+    index = pd.date_range("2024-01-02", periods=120, freq="min")
+    df = pd.DataFrame(values, index=index, columns=[f"c{i}" for i in range(30)])
+    # minutes 40 to 49 are missing, windows still span minutes
+    df_sparse = df.drop(index[40:50])
+    monkeypatch.setattr(rolling_features, "MIN_BLOCK_COLUMNS", 4)
+    df_features = compute_rolling_features(df_sparse, (5, 15))
+    df_full = df.copy()
+    df_full.iloc[40:50] = np.nan
+    expected = rolling_statistics(df_full.to_numpy(), (5, 15))
+    assert len(df_features.columns) == 2 * 5 * 30
+    for (window, stat), result in expected.items():
+        columns = [f"c{i}-w{window}-{stat}" for i in range(30)]
+        np.testing.assert_allclose(
+            df_features[columns].to_numpy(),
+            np.delete(result, np.s_[40:50], axis=0),
+            rtol=1e-12,
+            equal_nan=True,
+        )
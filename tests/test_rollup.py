@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+from app.rollup import (
+    build_rollups,
+    derive_moments,
+    read_rollup,
+    read_statistics_file,
+    rollup_statistics,
+    sufficient_statistics,
+)
+
+
+def write_statistics(path) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    index = pd.date_range("2024-01-02", periods=6 * 60, freq="min", name="timestamp")
+    values = rng.normal(size=(len(index), 4))
+    values[::7, 1] = np.nan
+    df_statistics = sufficient_statistics(pd.DataFrame(values, index=index))
+    df_statistics.columns = [f"load-{stat}" for stat in df_statistics.columns]
+    df_statistics.to_csv(path / "metric-1.csv")
+    build_rollups(str(path), 1)
+    return read_statistics_file(str(path / "metric-1.csv"))
+
+
+@pytest.mark.parametrize("resolution", ["5min", "15min", "2h", "7min", "90min"])
+def test_read_rollup_matches_rollup_of_minutes(tmp_path, resolution):
+    df_minutes = write_statistics(tmp_path)
+    expected = derive_moments(rollup_statistics(df_minutes, resolution))
+    pd.testing.assert_frame_equal(
+        read_rollup(str(tmp_path), 1, resolution), expected, check_freq=False
+    )
+
+
+def test_read_rollup_reads_only_dividing_tiers(tmp_path, monkeypatch):
+    write_statistics(tmp_path)
+    read_paths = []
+
+    def read_and_record(path: str) -> pd.DataFrame:
+        read_paths.append(path)
+        return read_statistics_file(path)
+
+    monkeypatch.setattr("app.rollup.read_statistics_file", read_and_record)
+    for resolution in ["2h", "90min", "7min"]:
+        read_rollup(str(tmp_path), 1, resolution)
+    assert [path.removeprefix(str(tmp_path)) for path in read_paths] == [
+        "/rollup-1h/metric-1.csv",
+        "/rollup-5min/metric-1.csv",
+        "/metric-1.csv",
+    ]
+
+
+def test_moments_of_constant_large_values_have_no_deviation():
+    index = pd.date_range("2024-01-02", periods=3, freq="min")
+    df_statistics = sufficient_statistics(
+        pd.DataFrame(np.full((3, 1000), 1e8 + 0.1), index=index)
+    )
+    df_statistics.columns = [f"load-{stat}" for stat in df_statistics.columns]
+    df_moments = derive_moments(rollup_statistics(df_statistics, "1h"))
+    assert df_moments["load-std"].tolist() == [0.0]
+    assert df_moments["load-mean"].iloc[0] == pytest.approx(1e8 + 0.1)
+
+
+def test_moments_match_numpy():
+    rng = np.random.default_rng(1)
+    values = rng.normal(5, 2, size=(60, 10))
+    index = pd.date_range("2024-01-02", periods=60, freq="min")
+    df_statistics = sufficient_statistics(pd.DataFrame(values, index=index))
+    df_statistics.columns = [f"load-{stat}" for stat in df_statistics.columns]
+    df_moments = derive_moments(rollup_statistics(df_statistics, "1h"))
+    assert df_moments["load-std"].iloc[0] == pytest.approx(np.std(values, ddof=1))
+    assert df_moments["load-min"].iloc[0] == values.min()
+    assert df_moments["load-count"].iloc[0] == values.size
@@ -0,0 +1,162 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+from app import merger, serial_aggregate
+from test_prometheus_aggregator import MIDNIGHT, write_prometheus_metrics
+
+GCLOUD_TARGETS = [
+    (1, "kubernetes.io/container/cpu/core_usage_time", 3),
+    (2, "kubernetes.io/node/cpu/allocatable_utilization", 1),
+]
+LOCUST_PERCENTILES = ["50%", "66%", "75%", "80%", "90%", "95%", "98%", "99%"]
+LOCUST_PERCENTILES += ["99.9%", "99.99%", "100%"]
+
+
+def write_gcloud_metrics(exp_path: str, rng):
+    for metric_index, name, kind in GCLOUD_TARGETS:
+        metric_path = os.path.join(
+            exp_path, "gcloud_metrics", f"metric-type-{metric_index}"
+        )
+        os.makedirs(metric_path)
+        with open(os.path.join(metric_path, "kpi_map.jsonl"), "w") as fp:
+            for kpi_index in range(1, 5):
+                labels = {"project_id": "p", "node_name": f"node-{kpi_index % 3}"}
+                if metric_index == 1:
+                    labels = {
+                        "project_id": "p",
+                        "container_name": f"c{kpi_index % 2}",
+                        "pod_name": f"alms-svc{'ab'[kpi_index % 2]}-abc",
+                    }
+                fp.write(json.dumps({"index": kpi_index, "kpi": labels}) + "\n")
+                ts = MIDNIGHT + np.arange(90) * 60 + rng.integers(-25, 25, 90)
+                values = rng.random(90)
+                if kind == 3:
+                    values = np.cumsum(values)
+                    values[50:] -= values[49]
+                pd.DataFrame({"timestamp": ts, "value": values}).to_csv(
+                    os.path.join(metric_path, f"kpi-{kpi_index}.csv"), index=False
+                )
+
+
+def write_locust_stats(exp_path: str, rng):
+    rows = [
+        {
+            "Timestamp": MIDNIGHT + second,
+            "User Count": 10,
+            "Type": "",
+            "Name": "Aggregated",
+            "Requests/s": rng.random(),
+            "Failures/s": rng.random() * 0.01,
+            **{column: rng.random() * 100 for column in LOCUST_PERCENTILES},
+            "Total Request Count": 1,
+            "Total Failure Count": 0,
+            "Total Median Response Time": 1.0,
+            "Total Average Response Time": 2.0,
+            "Total Min Response Time": 0,
+            "Total Max Response Time": 3,
+            "Total Average Content Size": 5.0,
+        }
+        for second in range(0, 80 * 60, 20)
+    ]
+    pd.DataFrame(rows).to_csv(
+        os.path.join(exp_path, "alemira_stats_history.csv"), index=False
+    )
+
+
+@pytest.fixture
+def experiment(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    exp_path = str(tmp_path / "exp")
+    write_gcloud_metrics(exp_path, rng)
+    ts = MIDNIGHT + np.arange(70) * 60 + 5.5
+    prometheus_targets_path = write_prometheus_metrics(
+        exp_path,
+        {
+            "node_load1": [
+                ({"instance": f"i{i}"}, ts, rng.random(70)) for i in range(3)
+            ],
+            "container_memory_rss": [
+                (
+                    {"namespace": "alms", "container": "c1", "pod": "alms-svcb-abc"},
+                    ts[10:],
+                    rng.random(60),
+                ),
+                (
+                    {"namespace": "alms", "container": "c0", "pod": "alms-svca-abc"},
+                    ts,
+                    rng.random(70),
+                ),
+            ],
+        },
+    )
+    write_locust_stats(exp_path, rng)
+    gcloud_targets_path = str(tmp_path / "gcloud_targets.csv")
+    pd.DataFrame(GCLOUD_TARGETS, columns=["index", "name", "kind"]).to_csv(
+        gcloud_targets_path, index=False
+    )
+    for module in [merger, serial_aggregate]:
+        monkeypatch.setattr(module, "FAILURE_INJECTION_PATH", str(tmp_path))
+        monkeypatch.setattr(
+            module, "PROMETHEUS_TARGET_METRICS_PATH", prometheus_targets_path
+        )
+    monkeypatch.setattr(merger, "GCLOUD_TARGET_METRICS_PATH", gcloud_targets_path)
+    monkeypatch.setattr(serial_aggregate, "METRIC_TYPE_MAP_PATH", gcloud_targets_path)
+    return exp_path
+
+
+def read_experiment(exp_path: str) -> pd.DataFrame:
+    return pd.read_csv(
+        os.path.join(exp_path, "exp.csv"), index_col=0, float_precision="round_trip"
+    )
+
+
+def read_intermediate_files(exp_path: str) -> dict:
+    frames = {}
+    for folder in ["gcloud_combined", "gcloud_aggregated", "prometheus_combined"]:
+        for filename in sorted(os.listdir(os.path.join(exp_path, folder))):
+            if filename.endswith(".csv") and "kpi-map" not in filename:
+                frames[folder, filename] = pd.read_csv(
+                    os.path.join(exp_path, folder, filename), index_col=0
+                )
+    frames["locust"] = pd.read_csv(
+        os.path.join(exp_path, "locust_aggregated_stats.csv")
+    )
+    return frames
+
+
+def test_fused_run_matches_file_based_run(experiment):
+    serial_aggregate.aggregate_faulty_metrics_in_one_experiment("exp")
+    serial_aggregate.merge_faulty_metrics_from_one_experiment("exp")
+    df_files = read_experiment(experiment)
+    files = read_intermediate_files(experiment)
+    assert len(df_files) > 50
+    assert df_files.columns.str.startswith("pm-").any()
+    assert df_files.columns.str.startswith("gm-").any()
+    os.remove(os.path.join(experiment, "exp.csv"))
+    for debug_intermediate in [False, True]:
+        for folder in os.listdir(experiment):
+            if folder.endswith(("_combined", "_aggregated", "_stats.csv")):
+                path = os.path.join(experiment, folder)
+                (os.remove if os.path.isfile(path) else shutil.rmtree)(path)
+        serial_aggregate.fuse_faulty_metrics_in_one_experiment(
+            "exp", debug_intermediate=debug_intermediate
+        )
+        df_fused = read_experiment(experiment)
+        assert sorted(df_fused.columns) == sorted(df_files.columns)
+        # file-based values went through a CSV round trip of at most an ulp
+        pd.testing.assert_frame_equal(
+            df_fused.loc[:, df_files.columns], df_files, check_exact=False, rtol=1e-12
+        )
+        if not debug_intermediate:
+            assert not os.path.exists(
+                os.path.join(experiment, "gcloud_aggregated", "metric-1.csv")
+            )
+            assert not os.path.exists(
+                os.path.join(experiment, "locust_aggregated_stats.csv")
+            )
+    for key, df in read_intermediate_files(experiment).items():
+        pd.testing.assert_frame_equal(df, files[key], check_exact=False, rtol=1e-12)
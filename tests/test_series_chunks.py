@@ -0,0 +1,108 @@
+import os
+
+import numpy as np
+from app.series_chunks import (
+    ChunkedMetricReader,
+    chunks_path_of,
+    convert_metrics_folder,
+    decode_keys,
+    decode_values,
+    encode_keys,
+    encode_values,
+    has_fresh_chunks,
+    write_chunked_metric,
+)
+from test_prometheus_aggregator import (
+    MIDNIGHT,
+    merge,
+    read_bytes,
+    write_prometheus_metrics,
+)
+
+
+def test_keys_and_values_round_trip():
+    rng = np.random.default_rng(0)
+    key_cases = [
+        np.arange(28_000_000, 28_001_440),
+        np.array([-5, 3, 4, 100, 101, 99]),
+        np.array([7]),
+        np.array([], dtype="int64"),
+    ]
+    for keys in key_cases:
+        decoded = decode_keys(encode_keys(keys))
+        assert decoded.dtype == np.int64
+        np.testing.assert_array_equal(decoded, keys)
+    special = [np.nan, np.inf, -np.inf, -0.0, 0.0, 5e-324, 1.5, 1.5]
+    value_cases = [rng.standard_normal(1000), np.array(special), np.array([])]
+    for values in value_cases:
+        decoded = decode_values(encode_values(values))
+        # bit exact, including the sign of zero and NaN payloads
+        np.testing.assert_array_equal(decoded.view("u8"), values.view("u8"))
+    # regular keys and repeated values compress to almost nothing
+    assert len(encode_keys(key_cases[0])) < 100
+    assert len(encode_values(np.full(1440, 0.25))) < 100
+
+
+def test_reader_selects_and_reads_series(tmp_path):
+    series = [
+        ({"namespace": "alms", "pod": "a"}, np.arange(10), np.arange(10.0)),
+        ({"pod": "b"}, np.array([3, 5, 9]), np.array([np.nan, 1.0, 2.0])),
+        ({"namespace": "other", "pod": "c"}, np.array([1]), np.array([4.0])),
+    ]
+    path = str(tmp_path / "metric-1-day-1.chunks")
+    assert write_chunked_metric(path, "node_load1", series) == 3
+    with ChunkedMetricReader(path) as reader:
+        assert reader.metric_name == "node_load1"
+        assert len(reader) == 3
+        np.testing.assert_array_equal(reader.select(namespace=["alms", None]), [0, 1])
+        np.testing.assert_array_equal(reader.select(pod="c"), [2])
+        np.testing.assert_array_equal(reader.read_keys(1), [3, 5, 9])
+        for (labels, keys, values), expected in zip(reader.iter_series(), series):
+            assert labels == expected[0]
+            np.testing.assert_array_equal(keys, expected[1])
+            np.testing.assert_array_equal(values, expected[2])
+
+
+def test_converted_folder_merges_like_json(tmp_path):
+    rng = np.random.default_rng(1)
+    ts = MIDNIGHT + np.arange(120) * 60 + 7
+    metrics = {
+        "node_load1": [
+            ({"instance": "a"}, ts, rng.random(120)),
+            ({"instance": "b"}, ts[::4], rng.random(30)),
+        ],
+        "container_memory_rss": [
+            ({"namespace": "alms", "pod": "p"}, ts, rng.random(120)),
+            ({"namespace": "other", "pod": "q"}, ts, rng.random(120)),
+        ],
+    }
+    for folder in ["json", "chunks"]:
+        os.makedirs(tmp_path / folder)
+        write_prometheus_metrics(tmp_path / folder, metrics)
+    metrics_path = str(tmp_path / "chunks" / "prometheus-metrics")
+    metric_path = os.path.join(metrics_path, "metric-1-day-1.json")
+    assert not has_fresh_chunks(metric_path)
+    convert_metrics_folder(metrics_path)
+    assert has_fresh_chunks(metric_path)
+    # the chunked files are read even without the JSON dumps
+    for filename in os.listdir(metrics_path):
+        if filename.startswith("metric-") and filename.endswith(".json"):
+            os.remove(os.path.join(metrics_path, filename))
+    merge(tmp_path / "json", lazy=False)
+    merge(tmp_path / "chunks", lazy=False)
+    for filename in ["metric-1.csv", "metric-2.csv"]:
+        assert read_bytes(tmp_path / "chunks" / "prometheus_combined" / filename) == (
+            read_bytes(tmp_path / "json" / "prometheus_combined" / filename)
+        )
+
+
+def test_chunks_older_than_json_are_stale(tmp_path):
+    metric_path = str(tmp_path / "metric-1-day-1.json")
+    with open(metric_path, "w") as fp:
+        fp.write("{}")
+    write_chunked_metric(chunks_path_of(metric_path), "m", [])
+    os.utime(chunks_path_of(metric_path), (1000, 1000))
+    os.utime(metric_path, (2000, 2000))
+    assert not has_fresh_chunks(metric_path)
+    os.utime(chunks_path_of(metric_path), (2000, 2000))
+    assert has_fresh_chunks(metric_path)
@@ -0,0 +1,121 @@
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+from app.aggregator import Aggregator
+from app.sparse_frame import (
+    SparseFrame,
+    as_stored,
+    read_combined,
+    sparse_path_of,
+    write_combined,
+)
+
+AGG_FUNCS = [
+    "min",
+    "max",
+    "mean",
+    "median",
+    "count",
+    "sum",
+    Aggregator.first_quartile,
+    Aggregator.third_quartile,
+]
+
+
+def gen_sparse_df() -> pd.DataFrame:
+    """Rows with 0, 1, 2, 3 and more observed values among 12 columns."""
+    rng = np.random.default_rng(0)
+    values = np.full((40, 12), np.nan)
+    for row in range(40):
+        cols = rng.choice(12, size=row % 6, replace=False)
+        values[row, cols] = rng.normal(size=len(cols)).round(2)
+    # ties and negative zeros are ordered like pandas does
+    values[5, :4] = [1.0, 1.0, -0.0, 0.0]
+    index = pd.date_range("2024-01-02", periods=40, freq="min", name="timestamp")
+    return pd.DataFrame(values, index=index, columns=[f"kpi-{i}" for i in range(12)])
+
+
+def dense_agg(df: pd.DataFrame, funcs: list) -> pd.DataFrame:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        return df.agg(funcs, axis=1)
+
+
+@pytest.mark.parametrize("func", AGG_FUNCS)
+def test_agg_matches_dense_frame(func):
+    df = gen_sparse_df()
+    pd.testing.assert_frame_equal(
+        SparseFrame.from_dense(df).agg([func]), dense_agg(df, [func]), rtol=1e-12
+    )
+
+
+def test_agg_of_all_functions_at_once():
+    df = gen_sparse_df()
+    pd.testing.assert_frame_equal(
+        SparseFrame.from_dense(df).agg(AGG_FUNCS), dense_agg(df, AGG_FUNCS), rtol=1e-12
+    )
+
+
+def test_filled_sum_and_count_match_dense_frame():
+    df = gen_sparse_df()
+    frame = SparseFrame.from_dense(df)
+    pd.testing.assert_frame_equal(
+        frame.fillna(0).agg(["sum", "count"]),
+        df.fillna(0).agg(["sum", "count"], axis=1),
+    )
+    pd.testing.assert_frame_equal(
+        frame.fillna(0.5).agg(["sum", "count", "median"]),
+        dense_agg(df.fillna(0.5), ["sum", "count", "median"]),
+    )
+    pd.testing.assert_frame_equal(
+        frame.notnull().astype("int").agg(["sum", "count"]),
+        df.notnull().astype("int").agg(["sum", "count"], axis=1),
+    )
+
+
+def test_column_selection_and_reindex_match_dense_frame():
+    df = gen_sparse_df()
+    frame = SparseFrame.from_dense(df)
+    columns = ["kpi-7", "kpi-2", "kpi-11"]
+    pd.testing.assert_frame_equal(frame[columns].to_dense(), df[columns])
+    with pytest.raises(KeyError):
+        frame[["kpi-1", "unknown"]]
+    columns = ["unknown", "kpi-3", "kpi-0", "missing"]
+    pd.testing.assert_frame_equal(
+        frame.reindex(columns).to_dense(), df.reindex(columns=columns)
+    )
+    pd.testing.assert_frame_equal(
+        frame.reindex(columns).agg(AGG_FUNCS),
+        dense_agg(df.reindex(columns=columns), AGG_FUNCS),
+        rtol=1e-12,
+    )
+
+
+@pytest.mark.parametrize("sparse_fill_ratio", [None, 0.01, 0.5])
+def test_combined_round_trip(tmp_path, sparse_fill_ratio):
+    df = gen_sparse_df()
+    csv_path = str(tmp_path / "metric-1.csv")
+    # a stale copy of the other layout must not shadow the new one
+    write_combined(df, csv_path, 0.5 if sparse_fill_ratio is None else None)
+    write_combined(df, csv_path, sparse_fill_ratio)
+    stored = read_combined(csv_path)
+    sparse = sparse_fill_ratio == 0.5
+    assert isinstance(stored, SparseFrame) == sparse
+    assert os.path.exists(sparse_path_of(csv_path)) == sparse
+    assert os.path.exists(csv_path) != sparse
+    expected = as_stored(df, sparse_fill_ratio)
+    if sparse:
+        pd.testing.assert_frame_equal(
+            stored.to_dense(), expected.to_dense(), check_freq=False
+        )
+        stored = stored.to_dense()
+    pd.testing.assert_frame_equal(stored, df, check_freq=False)
+    pd.testing.assert_frame_equal(
+        dense_agg(stored, AGG_FUNCS),
+        dense_agg(df, AGG_FUNCS),
+        rtol=1e-12,
+        check_freq=False,
+    )
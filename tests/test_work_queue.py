@@ -0,0 +1,113 @@
+import json
+import multiprocessing
+import os
+import time
+
+import pytest
+from app import work_queue
+from app.work_queue import WorkQueue, work
+
+
+def run_sleeping_task(task: dict):
+    """Record which worker ran a task, then take `args[0]` seconds."""
+    seconds, log_path = task["args"]
+    with open(log_path, "a") as fp:
+        fp.write(f"{task['task_id']} {os.getpid()}\n")
+    time.sleep(seconds)
+
+
+@pytest.fixture(autouse=True)
+def sleeping_tasks(monkeypatch):
+    # workers are forked, so they run the task patched here
+    monkeypatch.setattr(work_queue, "run_task", run_sleeping_task)
+
+
+def start_worker(
+    queue_path: str,
+    worker_id: str,
+    lease_seconds: float,
+    heartbeat_seconds: float,
+    delay: float = 0,
+) -> multiprocessing.Process:
+    def target():
+        time.sleep(delay)
+        queue = WorkQueue(queue_path, lease_seconds, heartbeat_seconds)
+        # the exit code is the number of tasks finished by the worker
+        raise SystemExit(work(queue, worker_id, poll_seconds=0.05))
+
+    process = multiprocessing.get_context("fork").Process(target=target)
+    process.start()
+    return process
+
+
+def read_runs(log_path) -> list:
+    with open(log_path) as fp:
+        return [line.split()[0] for line in fp]
+
+
+def test_workers_run_each_task_once(tmp_path):
+    queue_path = str(tmp_path / "queue")
+    log_path = str(tmp_path / "runs.log")
+    queue = WorkQueue(queue_path)
+    task_ids = [f"task-{i:02d}" for i in range(16)]
+    for i, task_id in enumerate(task_ids):
+        # half of the tasks outlive their first lease and need heartbeats
+        queue.enqueue(task_id, "sleep", [0.05 + 0.08 * i, log_path])
+    processes = [
+        start_worker(
+            queue_path, f"worker-{i}", lease_seconds=0.6, heartbeat_seconds=0.05
+        )
+        for i in range(4)
+    ]
+    for process in processes:
+        process.join(30)
+    assert sum(process.exitcode for process in processes) == 16
+    assert sorted(read_runs(log_path)) == task_ids
+    assert queue.status() == {"pending": 0, "leased": 0, "done": 16, "failed": 0}
+
+
+def test_stalled_worker_loses_its_task(tmp_path):
+    queue_path = str(tmp_path / "queue")
+    log_path = str(tmp_path / "runs.log")
+    queue = WorkQueue(queue_path)
+    queue.enqueue("slow", "sleep", [1.0, log_path])
+    # heartbeats too late to keep the lease, so the second worker reclaims it
+    stalled = start_worker(
+        queue_path, "stalled", lease_seconds=0.2, heartbeat_seconds=0.5
+    )
+    reclaiming = start_worker(
+        queue_path, "reclaiming", lease_seconds=5, heartbeat_seconds=0.5, delay=0.4
+    )
+    for process in [stalled, reclaiming]:
+        process.join(30)
+    assert stalled.exitcode == 0
+    assert reclaiming.exitcode == 1
+    assert read_runs(log_path) == ["slow", "slow"]
+    with open(os.path.join(queue_path, "done", "slow.json")) as fp:
+        assert json.load(fp)["worker_id"] == "reclaiming"
+    assert queue.status() == {"pending": 0, "leased": 0, "done": 1, "failed": 0}
+
+
+def test_breaking_a_renewed_lease_fails(tmp_path, monkeypatch):
+    queue = WorkQueue(str(tmp_path / "queue"), lease_seconds=0.2)
+    queue.enqueue("task", "sleep", [0, ""])
+    task, lease = queue.claim("owner")
+    time.sleep(0.25)
+    read_json = work_queue._read_json
+    renewed = []
+
+    def read_then_renew(path: str) -> dict:
+        # the owner renews, with a clock running behind, between the breaker
+        # reading the expired lease and moving it aside
+        result = read_json(path)
+        if not renewed and path.endswith(".lease"):
+            renewed.append(None)
+            lease["expires_at"] = time.time() + 5
+            queue.lease_seconds = 5
+            renewed[0] = queue.heartbeat("task", lease)
+        return result
+
+    monkeypatch.setattr(work_queue, "_read_json", read_then_renew)
+    assert not queue._break_expired_lease("task")
+    assert renewed == [True]
+    assert queue.holds("task", lease)
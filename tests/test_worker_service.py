@@ -0,0 +1,82 @@
+import os
+import threading
+
+import pytest
+from app import worker_service
+
+
+def print_stage(experiment: str, repeat: int = 1):
+    for _ in range(repeat):
+        print(f"aggregating {experiment}")
+
+
+def failing_stage(experiment: str):
+    raise FileNotFoundError(experiment)
+
+
+def killed_stage(experiment: str):
+    os._exit(1)
+
+
+@pytest.fixture
+def socket_path(tmp_path, monkeypatch):
+    # workers are forked, so they see the stages patched here
+    monkeypatch.setattr(
+        worker_service,
+        "_stage_functions",
+        lambda: {
+            "aggregate": print_stage,
+            "merge": failing_stage,
+            "fuse": killed_stage,
+        },
+    )
+    monkeypatch.setattr(worker_service, "LIVENESS_SECONDS", 0.1)
+    socket_path = str(tmp_path / "service.sock")
+    service = worker_service.WorkerService(socket_path, processes=1)
+    thread = threading.Thread(target=service.serve_forever, daemon=True)
+    thread.start()
+    while not os.path.exists(socket_path):
+        thread.join(0.01)
+    yield socket_path
+    list(worker_service.request({"command": "shutdown"}, socket_path))
+    thread.join(5)
+
+
+def run(socket_path: str, stages: list, options: dict = None) -> list:
+    job = {"experiment": "exp", "stages": stages, "options": options or {}}
+    return list(worker_service.request(job, socket_path))
+
+
+def test_job_streams_progress_then_summary(socket_path):
+    events = run(socket_path, ["aggregate"], {"aggregate": {"repeat": 2}})
+    assert [event["event"] for event in events] == [
+        "accepted",
+        "progress",
+        "progress",
+        "done",
+    ]
+    assert events[1]["line"] == "aggregating exp"
+    assert events[-1]["status"] == "ok"
+    assert set(events[-1]["stages"]) == {"aggregate"}
+    assert events[-1]["start_latency_seconds"] >= 0
+
+
+def test_failing_stage_fails_job(socket_path):
+    summary = run(socket_path, ["aggregate", "merge"])[-1]
+    assert summary["status"] == "failed"
+    assert "FileNotFoundError" in summary["error"]
+
+
+def test_killed_worker_fails_job(socket_path):
+    summary = run(socket_path, ["fuse"])[-1]
+    assert summary["status"] == "failed"
+    assert "died" in summary["error"]
+    # the pool replaces the worker and keeps serving
+    assert run(socket_path, ["aggregate"])[-1]["status"] == "ok"
+    status = list(worker_service.request({"command": "status"}, socket_path))[0]
+    assert status["running"] == 0
+
+
+def test_invalid_job_is_rejected(socket_path):
+    events = run(socket_path, ["bogus"])
+    assert events[0]["event"] == "error"